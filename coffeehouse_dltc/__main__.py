@@ -1,9 +1,24 @@
 #!/usr/bin/env python
 from __future__ import unicode_literals
+from coffeehouse_dltc.base.tokenizer import compare_tokenizers
+from coffeehouse_dltc.benchmark import benchmark_architectures, print_benchmark
+from coffeehouse_dltc.cascade import CascadePredictor, compare_cascade, print_cascade_report
 from coffeehouse_dltc.chmodel.configuration import Configuration
+from coffeehouse_dltc.chmodel.distillation import Distiller, print_distillation_report
+from coffeehouse_dltc.classify import StreamClassifier
+from coffeehouse_dltc.evaluation import Evaluator, print_report
+from coffeehouse_dltc.inspector import ClusterInspector, print_inspection, generate_messages
+from coffeehouse_dltc.chmodel.sweep import Sweep
+from coffeehouse_dltc.chmodel.crossval import CrossValidation, print_cross_validation
+from coffeehouse_dltc.config import DISTILLATION_ARCHITECTURE, BENCHMARK_ARCHITECTURES, \
+    PROJECTION_DTYPE, PROJECTION_TOLERANCE, PROJECTION_HALF_TOLERANCE, SESSION_MESSAGE_LENGTH, \
+    CROSS_VALIDATION_FOLDS, CROSS_VALIDATION_PROCESSES
 from coffeehouse_dltc.main import DLTC
+from coffeehouse_dltc.nn.projection import compare_projection, print_projection_report
+from coffeehouse_dltc.sessions import compare_sessions
 import sys
 import os
+import json
 
 
 def _real_main(argv=None):
@@ -19,8 +34,32 @@ def _real_main(argv=None):
         _model_info(argv)
     if argv[1] == '--train-model':
         _train_model(argv)
+    if argv[1] == '--resume-training':
+        _train_model(argv, resume=True)
     if argv[1] == '--test-model':
         _test_model(argv)
+    if argv[1] == '--inspect-model':
+        _inspect_model(argv)
+    if argv[1] == '--sweep':
+        _sweep(argv)
+    if argv[1] == '--cross-validate':
+        _cross_validate(argv)
+    if argv[1] == '--distill':
+        _distill(argv)
+    if argv[1] == '--classify':
+        _classify(argv)
+    if argv[1] == '--evaluate':
+        _evaluate(argv)
+    if argv[1] == '--compare-tokenizers':
+        _compare_tokenizers(argv)
+    if argv[1] == '--benchmark':
+        _benchmark(argv)
+    if argv[1] == '--export-projection':
+        _export_projection(argv)
+    if argv[1] == '--compare-sessions':
+        _compare_sessions(argv)
+    if argv[1] == '--cascade':
+        _cascade(argv)
 
 
 def _help_menu(argv=None):
@@ -34,7 +73,19 @@ def _help_menu(argv=None):
         "CoffeeHouse DLTC CLI\n\n"
         "   --model-info <directory_structure_input>\n"
         "   --train-model <directory_structure_input>\n"
+        "   --resume-training <directory_structure_input>\n"
         "   --test-model <model_directory>\n"
+        "   --inspect-model <model_directory> [messages_file]\n"
+        "   --sweep <directory_structure_input>\n"
+        "   --cross-validate <directory_structure_input> [k] [processes]\n"
+        "   --distill <model_directory> <directory_structure_input> [architecture] [unlabeled_file ...]\n"
+        "   --classify <model_directory> [input_file] [output_file]\n"
+        "   --evaluate <model_directory> <directory_structure_input> [min_macro_f1]\n"
+        "   --compare-tokenizers <directory_structure_input> [reference] [candidate]\n"
+        "   --benchmark [architecture ...]\n"
+        "   --export-projection <model_directory> [float32|float16] [messages_file]\n"
+        "   --compare-sessions <model_directory> [conversation_file]\n"
+        "   --cascade <messages_file> <model_directory> <threshold> [<model_directory> <threshold> ...] <model_directory>\n"
     )
     sys.exit()
 
@@ -63,11 +114,326 @@ def _test_model(argv=None):
         print(dltc.predict_from_text(input_text))
 
 
-def _train_model(argv=None):
+def _inspect_model(argv=None):
+    """
+    Displays the size, vocabulary, parameters, memory use and prediction
+    latency of a built model and writes them next to the model directory
+
+    :param argv:
+    :return:
+    """
+    directory_model_input = os.path.join(os.getcwd(), argv[2])
+
+    if not os.path.exists(directory_model_input):
+        print("\nERROR: The directory '{0}' does not exist".format(directory_model_input))
+        sys.exit()
+
+    texts = None
+    if len(argv) > 3:
+        if not os.path.exists(argv[3]):
+            print("\nERROR: The file '{0}' does not exist".format(argv[3]))
+            sys.exit()
+        with open(argv[3], 'r', encoding='utf8') as f:
+            texts = [line.rstrip('\r\n') for line in f if line.strip()]
+
+    print("Inspecting model")
+    report = ClusterInspector(directory_model_input).inspect(texts=texts)
+    print_inspection(report)
+
+    report_path = "{0}_inspection.json".format(directory_model_input.rstrip(os.sep))
+    with open(report_path, 'w', encoding='utf8') as f:
+        json.dump(report, f, indent=4)
+    print("Created file '{0}'".format(report_path))
+
+
+def _classify(argv=None):
+    """
+    Classifies newline-delimited text or JSONL records from a file or stdin
+    and writes the results as JSONL to a file or stdout
+
+    :param argv:
+    :return:
+    """
+    directory_model_input = os.path.join(os.getcwd(), argv[2])
+
+    if not os.path.exists(directory_model_input):
+        print("\nERROR: The directory '{0}' does not exist".format(directory_model_input))
+        sys.exit()
+
+    input_path = argv[3] if len(argv) > 3 and argv[3] != '-' else None
+    output_path = argv[4] if len(argv) > 4 and argv[4] != '-' else None
+
+    if input_path and not os.path.exists(input_path):
+        print("\nERROR: The file '{0}' does not exist".format(input_path))
+        sys.exit()
+
+    input_stream = open(input_path, 'r', encoding='utf8') if input_path else sys.stdin
+    output_stream = open(output_path, 'w', encoding='utf8') if output_path else sys.stdout
+
+    try:
+        with StreamClassifier(directory_model_input) as classifier:
+            classifier.classify(input_stream, output_stream)
+    finally:
+        if input_path:
+            input_stream.close()
+        if output_path:
+            output_stream.close()
+
+
+def _evaluate(argv=None):
+    """
+    Evaluates a built model on a held-out source directory, displays the
+    metrics and writes them next to the source directory. Exits with status 1
+    when the macro F1 is below the optional minimum
+
+    :param argv:
+    :return:
+    """
+    directory_model_input = os.path.join(os.getcwd(), argv[2])
+    directory_structure_input = os.path.join(os.getcwd(), argv[3])
+
+    for directory in (directory_model_input, directory_structure_input):
+        if not os.path.exists(directory):
+            print("\nERROR: The directory '{0}' does not exist".format(directory))
+            sys.exit()
+
+    print("Loading model")
+    with Evaluator(directory_model_input) as evaluator:
+        print("Evaluating model")
+        report = evaluator.evaluate(directory_structure_input)
+
+    print_report(report)
+
+    report_path = "{0}_evaluation.json".format(directory_structure_input.rstrip(os.sep))
+    with open(report_path, 'w', encoding='utf8') as f:
+        json.dump(report, f, indent=4)
+    print("Created file '{0}'".format(report_path))
+
+    if len(argv) > 4 and report['macro_f1'] < float(argv[4]):
+        print("\nERROR: The macro F1 {0:.4f} is below the minimum of {1}".format(
+            report['macro_f1'], argv[4]))
+        sys.exit(1)
+
+
+def _compare_tokenizers(argv=None):
+    """
+    Tokenizes every sample of the source directory with two tokenizer backends
+    and displays how closely the candidate reproduces the reference
+
+    :param argv:
+    :return:
+    """
+    directory_structure_input = os.path.join(os.getcwd(), argv[2])
+
+    if not os.path.exists(directory_structure_input):
+        print("\nERROR: The directory '{0}' does not exist".format(directory_structure_input))
+        sys.exit()
+
+    reference = argv[3] if len(argv) > 3 else 'nltk'
+    candidate = argv[4] if len(argv) > 4 else 'regex'
+
+    configuration = Configuration(directory_structure_input)
+    texts = (line for label in configuration.classifier_labels()
+             for line in configuration.classifier_contents(label))
+    report = compare_tokenizers(texts, reference=reference, candidate=candidate)
+
+    print(
+        "\n--- Tokenizer Comparison ({0} -> {1}) ---\n\n"
+        "   Samples             : {2}\n"
+        "   Identical samples   : {3:.2%}\n"
+        "   Token agreement     : {4:.2%}\n".format(
+            reference,
+            candidate,
+            report['documents'],
+            report['identical_documents'],
+            report['token_agreement']
+        )
+    )
+    print("   Missing tokens      : {0}".format(
+        ', '.join("{0} ({1})".format(t, c) for t, c in report['missing_tokens'])))
+    print("   Extra tokens        : {0}\n".format(
+        ', '.join("{0} ({1})".format(t, c) for t, c in report['extra_tokens'])))
+
+
+def _benchmark(argv=None):
+    """
+    Measures the training and prediction throughput of the architectures on
+    random input and displays them side by side
+
+    :param argv:
+    :return:
+    """
+    architectures = argv[2:] or BENCHMARK_ARCHITECTURES
+    print_benchmark(benchmark_architectures(architectures))
+
+
+def _export_projection(argv=None):
+    """
+    Builds the projection tables of a 'cnn' model, compares their predictions
+    and latency with the network and keeps them in the model directory when
+    they agree. Exits with status 1 and removes the tables when they do not
+
+    :param argv:
+    :return:
+    """
+    directory_model_input = os.path.join(os.getcwd(), argv[2])
+
+    if not os.path.exists(directory_model_input):
+        print("\nERROR: The directory '{0}' does not exist".format(directory_model_input))
+        sys.exit()
+
+    dtype = argv[3] if len(argv) > 3 else PROJECTION_DTYPE
+    if dtype not in ('float32', 'float16'):
+        print("\nERROR: Unknown table type '{0}', expected float32 or float16".format(dtype))
+        sys.exit()
+
+    texts = None
+    if len(argv) > 4:
+        if not os.path.exists(argv[4]):
+            print("\nERROR: The file '{0}' does not exist".format(argv[4]))
+            sys.exit()
+        with open(argv[4], 'r', encoding='utf8') as f:
+            texts = [line.rstrip('\r\n') for line in f if line.strip()]
+
+    print("Loading model")
+    dltc = DLTC()
+    dltc.load_model_cluster(directory_model_input, warmup=False, projection=False)
+
+    print("Building projection tables ({0})".format(dtype))
+    projection_path = DLTC.cluster_files(directory_model_input)['projection']
+    try:
+        dltc.projection = dltc.export_projection_tables(projection_path, dtype=dtype)
+    except ValueError as e:
+        print("\nERROR: {0}".format(e))
+        sys.exit()
+    print("Created file '{0}'".format(projection_path))
+
+    print("Comparing the tables with the network")
+    report = compare_projection(dltc, texts or generate_messages(dltc.word2vec_model))
+    print_projection_report(report)
+
+    report_path = "{0}_projection.json".format(directory_model_input.rstrip(os.sep))
+    with open(report_path, 'w', encoding='utf8') as f:
+        json.dump(report, f, indent=4)
+    print("Created file '{0}'".format(report_path))
+
+    tolerance = PROJECTION_HALF_TOLERANCE if dtype == 'float16' else PROJECTION_TOLERANCE
+    if report['max_abs_error'] > tolerance:
+        os.remove(projection_path)
+        print("\nERROR: The tables differ from the network by {0:.2e}, more than {1}, "
+              "removed '{2}'".format(report['max_abs_error'], tolerance, projection_path))
+        sys.exit(1)
+
+
+def _compare_sessions(argv=None):
+    """
+    Classifies a conversation (one message per line) message by message with
+    a session of an 'rnn' model and with the whole network, and displays the
+    difference of the scores and the time of an update of both
+
+    :param argv:
+    :return:
+    """
+    directory_model_input = os.path.join(os.getcwd(), argv[2])
+
+    if not os.path.exists(directory_model_input):
+        print("\nERROR: The directory '{0}' does not exist".format(directory_model_input))
+        sys.exit()
+
+    messages = None
+    if len(argv) > 3:
+        if not os.path.exists(argv[3]):
+            print("\nERROR: The file '{0}' does not exist".format(argv[3]))
+            sys.exit()
+        with open(argv[3], 'r', encoding='utf8') as f:
+            messages = [line.rstrip('\r\n') for line in f if line.strip()]
+
+    print("Loading model")
+    dltc = DLTC()
+    dltc.load_model_cluster(directory_model_input)
+
+    print("Comparing sessions with the network")
+    try:
+        report = compare_sessions(dltc, messages or generate_messages(
+            dltc.word2vec_model, length=SESSION_MESSAGE_LENGTH))
+    except ValueError as e:
+        print("\nERROR: {0}".format(e))
+        sys.exit()
+
+    print(
+        "\n--- Conversation Sessions ---\n\n"
+        "   Messages        : {messages} ({words} words)\n"
+        "   Max abs. error  : {max_abs_error:.2e}\n"
+        "   Update          : {network_update_ms:.2f}ms -> {session_update_ms:.2f}ms "
+        "({speedup:.1f}x), the network re-tokenizing the conversation\n"
+        "   Network only    : {network_tokens_ms:.2f}ms -> {session_update_ms:.2f}ms "
+        "({tokens_speedup:.1f}x), the network on the same tokens\n"
+        "   Padding replay  : {padding_ms:.2f}ms of an update, {padding_steps:.0f} GRU steps "
+        "on average\n".format(**report)
+    )
+
+
+def _cascade(argv=None):
+    """
+    Classifies messages with a cascade of models, cheapest first, and displays
+    the escalation rate of every stage, the agreement with the last stage and
+    the effective latency
+
+    :param argv:
+    :return:
+    """
+    if len(argv) < 6 or len(argv) % 2:
+        print("\nERROR: Expected a messages file followed by model directories "
+              "separated by thresholds")
+        sys.exit()
+
+    if not os.path.exists(argv[2]):
+        print("\nERROR: The file '{0}' does not exist".format(argv[2]))
+        sys.exit()
+
+    directories = [os.path.join(os.getcwd(), directory) for directory in argv[3::2]]
+    for directory in directories:
+        if not os.path.exists(directory):
+            print("\nERROR: The directory '{0}' does not exist".format(directory))
+            sys.exit()
+
+    try:
+        thresholds = [float(threshold) for threshold in argv[4::2]]
+    except ValueError:
+        print("\nERROR: The thresholds must be numbers between 0.5 and 1")
+        sys.exit()
+
+    with open(argv[2], 'r', encoding='utf8') as f:
+        texts = [line.rstrip('\r\n') for line in f if line.strip()]
+
+    stages = []
+    for directory in directories:
+        print("Loading model '{0}'".format(directory))
+        dltc = DLTC()
+        dltc.load_model_cluster(directory)
+        stages.append(dltc)
+
+    try:
+        cascade = CascadePredictor(stages, thresholds)
+    except ValueError as e:
+        print("\nERROR: {0}".format(e))
+        sys.exit()
+
+    report = compare_cascade(cascade, texts)
+    print_cascade_report(report)
+
+    report_path = "{0}_cascade.json".format(directories[-1].rstrip(os.sep))
+    with open(report_path, 'w', encoding='utf8') as f:
+        json.dump(report, f, indent=4)
+    print("Created file '{0}'".format(report_path))
+
+
+def _train_model(argv=None, resume=False):
     """
     Trains the model from the source directory
 
     :param argv:
+    :param resume: continue from the last checkpoint of an interrupted build
     :return:
     """
     directory_structure_input = os.path.join(os.getcwd(), argv[2])
@@ -80,7 +446,93 @@ def _train_model(argv=None):
     _model_info(argv)
 
     print("\n\n----- Model Training Started -----\n")
-    configuration.train_model()
+    configuration.train_model(resume=resume)
+
+
+def _sweep(argv=None):
+    """
+    Trains every combination of the hyperparameter grid defined in the
+    source directory and displays the leaderboard
+
+    :param argv:
+    :return:
+    """
+    directory_structure_input = os.path.join(os.getcwd(), argv[2])
+
+    if not os.path.exists(directory_structure_input):
+        print("\nERROR: The directory '{0}' does not exist".format(directory_structure_input))
+        sys.exit()
+
+    configuration = Configuration(directory_structure_input)
+    _model_info(argv)
+
+    print("\n\n----- Hyperparameter Sweep Started -----\n")
+    Sweep(configuration).run()
+
+
+def _cross_validate(argv=None):
+    """
+    Trains and evaluates k folds of the data of a source directory on
+    features built once and displays the per-fold and aggregate metrics
+
+    :param argv:
+    :return:
+    """
+    directory_structure_input = os.path.join(os.getcwd(), argv[2])
+
+    if not os.path.exists(directory_structure_input):
+        print("\nERROR: The directory '{0}' does not exist".format(directory_structure_input))
+        sys.exit()
+
+    try:
+        folds = int(argv[3]) if len(argv) > 3 else CROSS_VALIDATION_FOLDS
+        processes = int(argv[4]) if len(argv) > 4 else CROSS_VALIDATION_PROCESSES
+    except ValueError:
+        print("\nERROR: The number of folds and processes must be integers")
+        sys.exit()
+
+    if folds < 2 or processes < 1:
+        print("\nERROR: Cross-validation needs at least 2 folds and 1 process")
+        sys.exit()
+
+    configuration = Configuration(directory_structure_input)
+    _model_info(argv)
+
+    print("\n\n----- Cross-Validation Started -----\n")
+    report = CrossValidation(configuration, folds=folds, processes=processes).run()
+    print_cross_validation(report)
+
+
+def _distill(argv=None):
+    """
+    Trains a small student model on the outputs of a built model over the
+    data of its source directory and displays the agreement and the speedup
+
+    :param argv:
+    :return:
+    """
+    directory_model_input = os.path.join(os.getcwd(), argv[2])
+    directory_structure_input = os.path.join(os.getcwd(), argv[3])
+
+    for directory in (directory_model_input, directory_structure_input):
+        if not os.path.exists(directory):
+            print("\nERROR: The directory '{0}' does not exist".format(directory))
+            sys.exit()
+
+    architecture = argv[4] if len(argv) > 4 else DISTILLATION_ARCHITECTURE
+    unlabeled_files = [os.path.join(os.getcwd(), f) for f in argv[5:]]
+
+    for unlabeled_file in unlabeled_files:
+        if not os.path.exists(unlabeled_file):
+            print("\nERROR: The file '{0}' does not exist".format(unlabeled_file))
+            sys.exit()
+
+    configuration = Configuration(directory_structure_input)
+
+    print("\n\n----- Distillation Started -----\n")
+    report = Distiller(directory_model_input, configuration, architecture=architecture,
+                       unlabeled_files=unlabeled_files).run()
+    print_distillation_report(report)
 
 
 def _model_info(argv=None):
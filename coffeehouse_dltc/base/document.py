@@ -3,9 +3,10 @@ from __future__ import print_function, unicode_literals
 import io
 import os
 import nltk
-import string
 
-from nltk.tokenize import WordPunctTokenizer, sent_tokenize, word_tokenize
+from nltk.tokenize import WordPunctTokenizer
+
+from coffeehouse_dltc.base.tokenizer import get_tokenizer
 
 nltk.download('punkt', quiet=True)  # make sure it's downloaded before using
 
@@ -13,8 +14,9 @@ nltk.download('punkt', quiet=True)  # make sure it's downloaded before using
 class Document(object):
     """ Class representing a document that the keywords are extracted from """
 
-    def __init__(self, doc_id, filepath, text=None):
+    def __init__(self, doc_id, filepath, text=None, tokenizer=None):
         self.doc_id = doc_id
+        self.tokenizer = get_tokenizer(tokenizer)
 
         if text:
             self.text = text
@@ -40,14 +42,16 @@ class Document(object):
         lowercase = [t.lower() for t in tokens]
         return set(lowercase) - {',', '.', '!', ';', ':', '-', '', None}
 
-    def get_all_words(self):
-        """ Return all words tokenized, in lowercase and without punctuation """
-        return [w.lower() for w in word_tokenize(self.text)
-                if w not in string.punctuation]
+    def get_all_words(self, limit=None):
+        """ Return all words tokenized, in lowercase and without punctuation,
+         only the first limit words if a limit is given """
+        return self.tokenizer.tokenize(self.text, limit=limit)
 
     def read_sentences(self):
-        lines = self.text.split('\n')
-        raw = [sentence for inner_list in lines
-               for sentence in sent_tokenize(inner_list)]
-        return [[w.lower() for w in word_tokenize(s) if w not in string.punctuation]
-                for s in raw]
+        return self.tokenizer.sentences(self.text)
+
+
+def tokenize(text, tokenizer=None, limit=None):
+    """ Tokenize a string the same way as Document.get_all_words, without
+     building a Document. Used where only the tokens are needed. """
+    return get_tokenizer(tokenizer).tokenize(text, limit=limit)
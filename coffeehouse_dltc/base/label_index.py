@@ -0,0 +1,335 @@
+from __future__ import unicode_literals, division
+
+import io
+import os
+from collections import Counter, defaultdict
+
+import numpy as np
+import scipy.sparse as sp
+
+# Loaded indexes, keyed by path and invalidated when the file changes
+_cache = {}
+
+
+class LabelIndex(object):
+    """ The labels of every document of a data directory, built once so the
+     .lab files do not have to be re-opened. The postings are kept as a sparse
+     documents x labels matrix in CSR form (one row per document, sorted by
+     document id) along with the label counts and the label co-occurrence. """
+
+    def __init__(self, labels, documents, indptr, indices):
+        """
+        Public Constructor
+
+        :param labels: list of the labels, the position is the label id
+        :param documents: sorted array of the document ids (file names without extension)
+        :param indptr: CSR row pointers, the labels of the i-th document are
+        indices[indptr[i]:indptr[i + 1]]
+        :param indices: CSR label ids
+        """
+        self.labels = list(labels)
+        self.label_ids = {label: i for i, label in enumerate(self.labels)}
+        self.documents = np.asarray(documents, dtype=np.str_)
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.indices = np.asarray(indices, dtype=np.int32)
+
+        self.postings = sp.csr_matrix(
+            (np.ones(len(self.indices), dtype=np.int32), self.indices, self.indptr),
+            shape=(len(self.documents), len(self.labels)))
+        self.counts = np.asarray(self.postings.sum(axis=0)).ravel().astype(np.int64)
+
+        # Label x label counts of the documents sharing both labels, the
+        # diagonal is dropped as it equals the counts
+        cooccurrence = (self.postings.T * self.postings).tocsr()
+        cooccurrence.setdiag(0)
+        cooccurrence.eliminate_zeros()
+        self.cooccurrence = cooccurrence
+
+    @classmethod
+    def from_postings(cls, postings):
+        """
+        Build an index from the labels of every document
+        :param postings: iterable of tuples (document id, iterable of labels)
+
+        :return: LabelIndex object
+        """
+        postings = sorted((doc, sorted(set(labels))) for doc, labels in postings)
+        labels = sorted({label for _, doc_labels in postings for label in doc_labels})
+        label_ids = {label: i for i, label in enumerate(labels)}
+
+        indptr = np.zeros(len(postings) + 1, dtype=np.int64)
+        indices = []
+        for i, (_, doc_labels) in enumerate(postings):
+            indices.extend(label_ids[label] for label in doc_labels)
+            indptr[i + 1] = len(indices)
+
+        return cls(labels, [doc for doc, _ in postings], indptr, indices)
+
+    @classmethod
+    def from_directory(cls, data_dir):
+        """
+        Build an index by reading every .lab file of a directory once
+        :param data_dir: path to the directory with .lab files
+
+        :return: LabelIndex object
+        """
+        def postings():
+            for filename in os.listdir(data_dir):
+                if filename.endswith('.lab'):
+                    with io.open(os.path.join(data_dir, filename), 'r') as f:
+                        yield filename[:-4], [line.rstrip('\n') for line in f]
+
+        return cls.from_postings(postings())
+
+    @classmethod
+    def from_ingestion(cls, ingestion_index):
+        """
+        Build the index of a model structure from its ingestion results without
+        reading the .lab files, every document of a classification file
+        carries the label of that file
+        :param ingestion_index: dictionary of the results of ingest_classification by label
+
+        :return: LabelIndex object
+        """
+        return cls.from_postings(
+            ("{0}_{1}".format(label, i), (label,))
+            for label, result in ingestion_index.items()
+            for i in range(result['documents'])
+        )
+
+    @classmethod
+    def load(cls, filepath):
+        """
+        Load an index saved with save
+        :param filepath: path of the .npz file
+
+        :return: LabelIndex object
+        """
+        with np.load(filepath) as data:
+            return cls(data['labels'].tolist(), data['documents'], data['indptr'], data['indices'])
+
+    def save(self, filepath):
+        """
+        Save the index as an uncompressed .npz file
+        :param filepath: path of the .npz file
+
+        :return: None
+        """
+        with open(filepath, 'wb') as f:
+            np.savez(f, labels=np.asarray(self.labels, dtype=np.str_), documents=self.documents,
+                     indptr=self.indptr, indices=self.indices)
+
+    def __len__(self):
+        return len(self.documents)
+
+    def __contains__(self, doc):
+        return self._rows([doc])[0] >= 0
+
+    def _rows(self, docs):
+        """ The row of every document id, -1 for documents which are not indexed """
+        docs = np.asarray(docs, dtype=np.str_)
+        if not len(self.documents):
+            return np.full(len(docs), -1, dtype=np.int64)
+
+        rows = np.searchsorted(self.documents, docs)
+        rows[rows == len(self.documents)] = 0
+        return np.where(self.documents[rows] == docs, rows, -1)
+
+    def answers(self, doc, filtered_by=None):
+        """
+        The labels of a document
+        :param doc: the document id (file name without extension)
+        :param filtered_by: a set of labels the answers are restricted to
+
+        :return: set of labels
+        """
+        row = self._rows([doc])[0]
+        if row < 0:
+            raise ValueError("The document " + doc + " is not indexed")
+
+        answers = {self.labels[i] for i in self.indices[self.indptr[row]:self.indptr[row + 1]]}
+        if filtered_by:
+            answers = {kw for kw in answers if kw in filtered_by}
+
+        return answers
+
+    def all_answers(self, filtered_by=None):
+        """
+        The labels of every document, like utils.get_all_answers
+        :param filtered_by: a set of labels the answers are restricted to
+
+        :return: dictionary of the form e.g. {'101231': set('lab1', 'lab2') etc.}
+        """
+        answers = {}
+        for row, doc in enumerate(self.documents.tolist()):
+            doc_labels = {self.labels[i] for i in self.indices[self.indptr[row]:self.indptr[row + 1]]}
+            if filtered_by:
+                doc_labels = {kw for kw in doc_labels if kw in filtered_by}
+            answers[doc] = doc_labels
+
+        return answers
+
+    def label_distribution(self, filtered_by=None):
+        """
+        The distribution of the labels, like utils.calculate_label_distribution
+        :param filtered_by: a set of labels that defines the vocabulary
+
+        :return: dictionary of the form {14: ['lab1', 'lab2']}, which means
+                 that both lab1 and lab2 were labels in 14 documents
+        """
+        histogram = defaultdict(list)
+        for label, count in zip(self.labels, self.counts.tolist()):
+            if count and (not filtered_by or label in filtered_by):
+                histogram[count].append(label)
+
+        return histogram
+
+    def number_of_labels_distribution(self, filtered_by=None):
+        """
+        How many documents have 1 label, 2 labels etc.
+        :param filtered_by: a set of labels that defines the vocabulary
+
+        :return: items of a Counter mapping the number of labels to the number of documents
+        """
+        postings = self.postings
+        if filtered_by:
+            postings = postings[:, self._label_mask(filtered_by)]
+
+        return Counter(np.diff(postings.tocsr().indptr).tolist()).items()
+
+    def count(self, label):
+        """
+        The number of documents with a label
+        :param label: the label
+
+        :return: integer, 0 for unknown labels
+        """
+        label_id = self.label_ids.get(label)
+        return int(self.counts[label_id]) if label_id is not None else 0
+
+    def cooccurrence_count(self, label_a, label_b):
+        """
+        The number of documents carrying both labels
+        :param label_a: the first label
+        :param label_b: the second label
+
+        :return: integer, 0 for unknown labels
+        """
+        if label_a == label_b:
+            return self.count(label_a)
+
+        if label_a not in self.label_ids or label_b not in self.label_ids:
+            return 0
+
+        return int(self.cooccurrence[self.label_ids[label_a], self.label_ids[label_b]])
+
+    def cooccurring(self, label, n=None):
+        """
+        The labels found together with a label, most frequent first
+        :param label: the label
+        :param n: the number of labels to return, None returns all of them
+
+        :return: list of tuples (label, number of documents carrying both)
+        """
+        label_id = self.label_ids.get(label)
+        if label_id is None:
+            return []
+
+        row = self.cooccurrence.getrow(label_id)
+        pairs = sorted(zip(row.indices.tolist(), row.data.tolist()), key=lambda p: (-p[1], p[0]))
+        return [(self.labels[i], int(count)) for i, count in pairs[:n]]
+
+    def top_labels(self, n):
+        """
+        Return the n most popular labels
+        :param n: number of labels to return
+
+        :return: list of strings, most frequent first
+        """
+        order = np.lexsort((np.arange(len(self.labels)), -self.counts))
+        return [self.labels[i] for i in order[:n]]
+
+    def postings_count(self, docs=None):
+        """
+        The number of (document, label) pairs
+        :param docs: document ids to count, None counts every document
+
+        :return: integer
+        """
+        if docs is None:
+            return len(self.indices)
+
+        rows = self._rows(docs)
+        rows = rows[rows >= 0]
+        return int(np.sum(self.indptr[rows + 1] - self.indptr[rows]))
+
+    def targets(self, docs, label_indices, sparse=True):
+        """
+        The target matrix of documents for a label vocabulary
+        :param docs: iterable of document ids (file names without extension)
+        :param label_indices: dictionary mapping the labels to their column,
+        labels which are not part of it are left out
+        :param sparse: return a scipy CSR matrix instead of a dense array
+
+        :return: boolean matrix of shape (len(docs), len(label_indices))
+        """
+        docs = list(docs)
+        rows = self._rows(docs)
+        if np.any(rows < 0):
+            raise ValueError("The document " + docs[int(np.argmax(rows < 0))] + " is not indexed")
+
+        columns = np.full(len(self.labels), -1, dtype=np.int64)
+        for label, column in label_indices.items():
+            if label in self.label_ids:
+                columns[self.label_ids[label]] = column
+
+        targets = self.postings[rows].tocoo()
+        mask = columns[targets.col] >= 0
+        targets = sp.csr_matrix(
+            (np.ones(int(mask.sum()), dtype=np.bool_), (targets.row[mask], columns[targets.col[mask]])),
+            shape=(len(docs), len(label_indices)))
+
+        return targets if sparse else targets.toarray()
+
+    def _label_mask(self, filtered_by):
+        """ The ids of the labels which are part of filtered_by """
+        return np.array([label in filtered_by for label in self.labels], dtype=np.bool_)
+
+
+def label_index_path(data_dir):
+    """
+    The path of the label index of a data directory, the index of
+    '{structure}/model_data' is '{structure}/model_data.label_index.npz'
+    :param data_dir: path to the directory with the .lab files
+
+    :return: the path of the .npz file
+    """
+    return "{0}.label_index.npz".format(data_dir.rstrip(os.sep))
+
+
+def load_label_index(data_dir, documents=None):
+    """
+    Load the label index of a data directory, an index is only loaded again
+    once its file changed
+    :param data_dir: path to the directory with the .lab files
+    :param documents: the expected number of documents, an index of a
+    different size is considered stale
+
+    :return: LabelIndex object or None when there is no (valid) index
+    """
+    filepath = label_index_path(data_dir)
+    try:
+        mtime = os.path.getmtime(filepath)
+    except OSError:
+        return None
+
+    cached = _cache.get(filepath)
+    if cached is None or cached[0] != mtime:
+        cached = (mtime, LabelIndex.load(filepath))
+        _cache[filepath] = cached
+
+    label_index = cached[1]
+    if documents is not None and len(label_index) != documents:
+        return None
+
+    return label_index
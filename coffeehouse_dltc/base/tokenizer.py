@@ -0,0 +1,189 @@
+from __future__ import print_function, unicode_literals, division
+
+import re
+import string
+from collections import Counter
+
+from nltk.tokenize import sent_tokenize, word_tokenize
+
+from coffeehouse_dltc.config import TOKENIZER
+
+
+class NltkTokenizer(object):
+    """ The reference tokenizer, Punkt sentence splitting followed by the
+     Treebank word tokenizer. Punctuation is removed and tokens are lowercased. """
+
+    name = 'nltk'
+
+    def tokenize(self, text, limit=None):
+        """
+        Return all words tokenized, in lowercase and without punctuation
+        :param text: the text to tokenize
+        :param limit: only return the first N tokens, None returns all of them
+
+        :return: list of tokens
+        """
+        words = [w.lower() for w in word_tokenize(text) if w not in string.punctuation]
+        return words[:limit] if limit is not None else words
+
+    def sentences(self, text):
+        """
+        Split the text into sentences of tokens, lines are never merged
+        :param text: the text to tokenize
+
+        :return: list of lists of tokens
+        """
+        lines = text.split('\n')
+        raw = [sentence for inner_list in lines
+               for sentence in sent_tokenize(inner_list)]
+        return [[w.lower() for w in word_tokenize(s) if w not in string.punctuation]
+                for s in raw]
+
+
+class RegexTokenizer(object):
+    """ A single precompiled regular expression approximating the output of
+     NltkTokenizer: contractions are split ("don't" -> "do", "n't"), double
+     quotes become `` and '', runs of periods, double dashes and backticks are
+     kept, hyphens stay attached to words, numbers keep their separators and
+     the remaining punctuation is removed. Tokens are
+     produced lazily so tokenizing can stop once enough tokens were found. """
+
+    name = 'regex'
+
+    _word = r"[^\s;@#$%&?!()\[\]{}<>\",:.'`*\u2012-\u2015\u00ab\u00bb\u201c\u201d\u2018\u2019\u201e-]+"
+    _contraction = r"(?:n't|'s|'m|'d|'ll|'re|'ve)(?!\w)"
+
+    token_re = re.compile(
+        r"""
+          (?P<ellipsis>\.{{2,}})
+        | (?P<dash>--)
+        | (?P<backticks>``)
+        | (?P<quote>"|'')
+        | (?P<stem>\w+?(?={contraction})|(?:can(?=not\b)|gon(?=na\b)|got(?=ta\b)|wan(?=na\b)|gim(?=me\b)|lem(?=me\b)))
+        | (?P<contraction>(?<=\w){contraction})
+        | (?P<word>(?:{word}|-(?!-))(?:{word}|-(?!-)|(?:['.]|[:,](?=\d)){word})*)
+        | (?P<other>\S)
+        """.format(word=_word, contraction=_contraction),
+        re.VERBOSE | re.IGNORECASE | re.UNICODE
+    )
+    sentence_re = re.compile(r'(?<=[.!?])\s+', re.UNICODE)
+    opening_quote_re = re.compile(r'[\s(\[{<]', re.UNICODE)
+
+    def tokenize(self, text, limit=None):
+        """
+        Return all words tokenized, in lowercase and without punctuation
+        :param text: the text to tokenize
+        :param limit: stop once N tokens were produced, None returns all of them
+
+        :return: list of tokens
+        """
+        words = []
+        if limit is not None and limit <= 0:
+            return words
+
+        punctuation = string.punctuation
+        for match in self.token_re.finditer(text):
+            token = match.group()
+
+            if match.lastgroup == 'quote':
+                start = match.start()
+                if start == 0 or self.opening_quote_re.match(text[start - 1]):
+                    token = '``'
+                else:
+                    token = "''"
+            elif token in punctuation:
+                continue
+
+            words.append(token.lower())
+            if limit is not None and len(words) >= limit:
+                break
+
+        return words
+
+    def sentences(self, text):
+        """
+        Split the text into sentences of tokens, lines are never merged
+        :param text: the text to tokenize
+
+        :return: list of lists of tokens
+        """
+        return [self.tokenize(sentence)
+                for line in text.split('\n')
+                for sentence in self.sentence_re.split(line)
+                if sentence.strip()]
+
+
+TOKENIZERS = {
+    NltkTokenizer.name: NltkTokenizer,
+    RegexTokenizer.name: RegexTokenizer,
+}
+
+_instances = {}
+
+
+def get_tokenizer(tokenizer=None):
+    """
+    Get a tokenizer backend by name
+    :param tokenizer: name of the backend ('nltk' or 'regex'), a tokenizer
+    object which is returned as is, or None for the default backend
+
+    :return: tokenizer object
+    """
+    if tokenizer is None:
+        tokenizer = TOKENIZER
+
+    if not isinstance(tokenizer, str):
+        return tokenizer
+
+    if tokenizer not in TOKENIZERS:
+        raise ValueError("Unknown tokenizer: {}".format(tokenizer))
+
+    if tokenizer not in _instances:
+        _instances[tokenizer] = TOKENIZERS[tokenizer]()
+
+    return _instances[tokenizer]
+
+
+def compare_tokenizers(texts, reference='nltk', candidate='regex', limit=None):
+    """
+    Measure how closely a tokenizer backend reproduces another one
+    :param texts: iterable of strings, e.g. the lines of a corpus
+    :param reference: name of the reference backend
+    :param candidate: name of the backend being compared
+    :param limit: only compare the first N tokens of every text
+
+    :return: dictionary with the number of documents, the ratio of documents
+    tokenized identically, the ratio of reference tokens also produced by the
+    candidate and the most frequent differences
+    """
+    reference = get_tokenizer(reference)
+    candidate = get_tokenizer(candidate)
+
+    documents = identical = 0
+    reference_tokens = matched_tokens = 0
+    missing, extra = Counter(), Counter()
+
+    for text in texts:
+        expected = reference.tokenize(text, limit=limit)
+        produced = candidate.tokenize(text, limit=limit)
+
+        documents += 1
+        if expected == produced:
+            identical += 1
+            reference_tokens += len(expected)
+            matched_tokens += len(expected)
+            continue
+
+        expected_counts, produced_counts = Counter(expected), Counter(produced)
+        reference_tokens += len(expected)
+        matched_tokens += sum((expected_counts & produced_counts).values())
+        missing.update(expected_counts - produced_counts)
+        extra.update(produced_counts - expected_counts)
+
+    return {
+        'documents': documents,
+        'identical_documents': identical / documents if documents else 1.0,
+        'token_agreement': matched_tokens / reference_tokens if reference_tokens else 1.0,
+        'missing_tokens': missing.most_common(20),
+        'extra_tokens': extra.most_common(20),
+    }
@@ -1,15 +1,18 @@
 from __future__ import print_function, unicode_literals
+import gzip
+import io
+import multiprocessing
 import os
 import six
 import numpy as np
-from functools import reduce
+from functools import partial, reduce
 
 from gensim.models import Word2Vec
 from sklearn.preprocessing import StandardScaler
 
 from coffeehouse_dltc.base.document import Document
 from coffeehouse_dltc.config import EMBEDDING_SIZE, WORD2VEC_WORKERS, MIN_WORD_COUNT, \
-    WORD2VEC_CONTEXT
+    WORD2VEC_CONTEXT, SCALER_FIT_MODE, WORD2VEC_CHUNK_SIZE, PRETRAINED_MODE, PRETRAINED_EPOCHS
 from coffeehouse_dltc.utils import get_documents, save_to_disk
 
 
@@ -56,13 +59,25 @@ def compute_word2vec_for_phrase(phrase, model):
     return result
 
 
-def fit_scaler(data_dir, word2vec_model, batch_size=1024, persist_to_path=None):
-    """ Get all the word2vec vectors in a 2D matrix and fit the scaler on it.
-     This scaler can be used afterwards for normalizing feature matrices. """
+def fit_scaler(data_dir, word2vec_model, batch_size=1024, persist_to_path=None,
+               mode=SCALER_FIT_MODE, tokenizer=None):
+    """ Fit the scaler on the word2vec vectors of every token in the corpus.
+     This scaler can be used afterwards for normalizing feature matrices.
+     In 'vocabulary' mode the statistics are computed in closed form from the
+     vocabulary counts, 'corpus' mode re-reads the documents with the given
+     tokenizer backend and fits the scaler on one vector per token occurrence. """
     if type(word2vec_model) == str:
         word2vec_model = Word2Vec.load(word2vec_model)
 
-    doc_generator = get_documents(data_dir)
+    if mode == 'vocabulary':
+        scaler = fit_scaler_from_vocabulary(word2vec_model)
+        if persist_to_path:
+            save_to_disk(persist_to_path, scaler)
+        return scaler
+    elif mode != 'corpus':
+        raise ValueError("Unknown scaler fit mode: {}".format(mode))
+
+    doc_generator = get_documents(data_dir, tokenizer=tokenizer)
     scaler = StandardScaler(copy=False)
 
     no_more_samples = False
@@ -92,29 +107,213 @@ def fit_scaler(data_dir, word2vec_model, batch_size=1024, persist_to_path=None):
     return scaler
 
 
-def train_word2vec(doc_directory, vec_dim=EMBEDDING_SIZE):
+def fit_scaler_from_vocabulary(word2vec_model):
+    """
+    Fit a StandardScaler from the vocabulary of a word2vec model. Every word
+    vector is weighted by the number of times the word occurs in the corpus,
+    which gives the statistics of one vector per token occurrence in O(vocab)
+    :param word2vec_model: trained gensim word2vec object
+
+    :return: fitted StandardScaler object
+    """
+    vectors = np.asarray(word2vec_model.wv.vectors, dtype=np.float64)
+    counts = np.zeros(vectors.shape[0], dtype=np.float64)
+    for vocab in word2vec_model.wv.vocab.values():
+        counts[vocab.index] = vocab.count
+
+    total = counts.sum()
+    mean = counts.dot(vectors) / total
+    var = counts.dot((vectors - mean) ** 2) / total
+
+    scale = np.sqrt(var)
+    scale[scale == 0.0] = 1.0
+
+    scaler = StandardScaler(copy=False)
+    scaler.mean_ = mean
+    scaler.var_ = var
+    scaler.scale_ = scale
+    scaler.n_samples_seen_ = int(total)
+    print("Fitted to {} vectors".format(int(total)))
+
+    return scaler
+
+
+def write_line_sentence_corpus(doc_directory, output_path, workers=WORD2VEC_WORKERS,
+                               tokenizer=None):
+    """
+    Tokenize the documents once and write them as a line-sentence file, one
+    sentence per line with the tokens separated by spaces. The documents are
+    tokenized in parallel processes.
+    :param doc_directory: directory with the documents
+    :param output_path: path of the corpus file to write
+    :param workers: number of tokenization processes
+    :param tokenizer: name of the tokenizer backend, None uses the default one
+
+    :return: number of sentences written
+    """
+    files = sorted({filename[:-4] for filename in os.listdir(doc_directory)})
+    filepaths = [os.path.join(doc_directory, fname + '.txt') for fname in files]
+
+    sentence_count = 0
+    # Spawned, the caller usually already holds a TensorFlow session whose
+    # threads a forked child would inherit in an unknown state
+    pool = multiprocessing.get_context('spawn').Pool(workers)
+    try:
+        with io.open(output_path, 'w', encoding='utf-8') as f:
+            read_sentences = partial(_read_sentences, tokenizer=tokenizer)
+            for sentences in pool.imap(read_sentences, filepaths, chunksize=WORD2VEC_CHUNK_SIZE):
+                for sentence in sentences:
+                    if sentence:
+                        f.write(' '.join(sentence) + '\n')
+                        sentence_count += 1
+    finally:
+        pool.close()
+        pool.join()
+
+    print("Wrote {0} sentences to '{1}'".format(sentence_count, output_path))
+    return sentence_count
+
+
+def _read_sentences(filepath, tokenizer=None):
+    """ Tokenize a document into sentences, runs inside the worker processes """
+    return Document(0, filepath, tokenizer=tokenizer).read_sentences()
+
+
+def pretrained_vector_size(filepath):
+    """
+    Read the dimensionality of a pretrained vectors file from its header
+    :param filepath: path of a word2vec text or binary file, optionally gzipped
+
+    :return: int
+    """
+    opener = gzip.open if filepath.endswith('.gz') else io.open
+    with opener(filepath, 'rb') as f:
+        header = f.readline().split()
+
+    if len(header) != 2:
+        raise ValueError("'{0}' is not in the word2vec format, the first line has to "
+                         "hold the number of words and the vector size".format(filepath))
+
+    return int(header[1])
+
+
+def is_binary_vectors(filepath):
+    """ Whether a pretrained vectors file is in the binary word2vec format, by its extension """
+    name = filepath[:-3] if filepath.endswith('.gz') else filepath
+    return name.endswith('.bin')
+
+
+def warm_start_word2vec(model, pretrained, mode=PRETRAINED_MODE, epochs=PRETRAINED_EPOCHS,
+                        binary=None, **source):
+    """
+    Initialize the vectors of a Word2Vec object whose vocabulary is built from
+    pretrained vectors and train it. The file is streamed and only the words of
+    the vocabulary are kept, the other vectors of the file are never loaded.
+    Words missing from the file keep their random initialization.
+    :param model: Word2Vec object with a built vocabulary
+    :param pretrained: path of a word2vec text or binary file, optionally gzipped
+    :param mode: 'frozen' keeps the pretrained vectors and only trains the missing
+    words, 'fine_tune' trains every vector starting from the pretrained ones
+    :param epochs: passes over the corpus, frozen vectors are not trained at all
+    when every word of the vocabulary was found
+    :param binary: whether the file is in the binary format, None decides by the extension
+    :param source: the corpus, corpus_file=path or sentences=iterable
+
+    :return: the Word2Vec object
+    """
+    if mode not in ('frozen', 'fine_tune'):
+        raise ValueError("Unknown pretrained vectors mode: {0}".format(mode))
+
+    vector_size = pretrained_vector_size(pretrained)
+    if vector_size != model.vector_size:
+        raise ValueError("The pretrained vectors have {0} dimensions but vec_dim is {1}".format(
+            vector_size, model.vector_size))
+
+    # A lock factor of 0 stops training from updating the vector of a word
+    model.intersect_word2vec_format(
+        pretrained, lockf=0.0,
+        binary=is_binary_vectors(pretrained) if binary is None else binary)
+    found = int(np.sum(model.trainables.vectors_lockf == 0.0))
+    print("Initialized {0} of {1} words from '{2}'".format(found, len(model.wv.vocab), pretrained))
+
+    if mode == 'fine_tune':
+        model.trainables.vectors_lockf[:] = 1.0
+    elif found == len(model.wv.vocab):
+        return model
+
+    model.train(
+        total_examples=model.corpus_count,
+        total_words=model.corpus_total_words,
+        epochs=epochs,
+        **source
+    )
+
+    return model
+
+
+def train_word2vec(doc_directory, vec_dim=EMBEDDING_SIZE, workers=WORD2VEC_WORKERS,
+                   corpus_file=None, tokenizer=None, pretrained=None,
+                   pretrained_mode=PRETRAINED_MODE, pretrained_epochs=PRETRAINED_EPOCHS,
+                   pretrained_binary=None):
     """
     Train the Word2Vec object iteratively, loading stuff to memory one by one.
     :param doc_directory: directory with the documents
     :param vec_dim: the dimensionality of the vector that's being built
+    :param workers: number of worker threads training the model
+    :param corpus_file: path of a line-sentence file, see write_line_sentence_corpus.
+    When given gensim reads the file directly in every worker thread instead of
+    being fed by a single Python iterator, which scales with the number of cores.
+    The file is written first if it does not exist.
+    :param tokenizer: name of the tokenizer backend, None uses the default one
+    :param pretrained: path of a pretrained vectors file the vectors are
+    initialized from, see warm_start_word2vec. None trains them from scratch
+    :param pretrained_mode: 'frozen' or 'fine_tune'
+    :param pretrained_epochs: passes over the corpus after the initialization
+    :param pretrained_binary: whether the pretrained file is binary, None
+    decides by the extension
 
     :return: Word2Vec object
     """
-    class SentenceIterator(object):
-        def __init__(self, dirname):
-            self.dirname = dirname
+    if pretrained:
+        if corpus_file and not os.path.exists(corpus_file):
+            write_line_sentence_corpus(doc_directory, corpus_file, workers=workers,
+                                       tokenizer=tokenizer)
+        source = dict(corpus_file=corpus_file) if corpus_file else \
+            dict(sentences=_SentenceIterator(doc_directory, tokenizer))
+
+        model = Word2Vec(
+            workers=workers,
+            size=vec_dim,
+            min_count=MIN_WORD_COUNT,
+            window=WORD2VEC_CONTEXT,
+        )
+        model.build_vocab(**source)
+        warm_start_word2vec(model, pretrained, mode=pretrained_mode, epochs=pretrained_epochs,
+                            binary=pretrained_binary, **source)
+        model.init_sims(replace=True)
+
+        return model
+
+    if corpus_file:
+        if not os.path.exists(corpus_file):
+            write_line_sentence_corpus(doc_directory, corpus_file, workers=workers,
+                                       tokenizer=tokenizer)
 
-        def __iter__(self):
-            files = {filename[:-4] for filename in os.listdir(self.dirname)}
-            for doc_id, fname in enumerate(files):
-                d = Document(doc_id, os.path.join(self.dirname, fname + '.txt'))
-                for sentence in d.read_sentences():
-                    yield sentence
+        model = Word2Vec(
+            corpus_file=corpus_file,
+            workers=workers,
+            size=vec_dim,
+            min_count=MIN_WORD_COUNT,
+            window=WORD2VEC_CONTEXT,
+        )
+        model.init_sims(replace=True)
+
+        return model
 
     # Initialize and train the model
     model = Word2Vec(
-        SentenceIterator(doc_directory),
-        workers=WORD2VEC_WORKERS,
+        _SentenceIterator(doc_directory, tokenizer),
+        workers=workers,
         size=vec_dim,
         min_count=MIN_WORD_COUNT,
         window=WORD2VEC_CONTEXT,
@@ -125,3 +324,20 @@ def train_word2vec(doc_directory, vec_dim=EMBEDDING_SIZE):
     model.init_sims(replace=True)
 
     return model
+
+
+class _SentenceIterator(object):
+    """ Iterates over the sentences of the documents of a directory, can be
+     iterated several times as gensim does for every epoch """
+
+    def __init__(self, dirname, tokenizer=None):
+        self.dirname = dirname
+        self.tokenizer = tokenizer
+
+    def __iter__(self):
+        files = {filename[:-4] for filename in os.listdir(self.dirname)}
+        for doc_id, fname in enumerate(files):
+            d = Document(doc_id, os.path.join(self.dirname, fname + '.txt'),
+                         tokenizer=self.tokenizer)
+            for sentence in d.read_sentences():
+                yield sentence
@@ -0,0 +1,107 @@
+from __future__ import print_function, unicode_literals, division
+
+import time
+
+import numpy as np
+
+from coffeehouse_dltc.config import SAMPLE_LENGTH, EMBEDDING_SIZE, CLASSIFY_BATCH_SIZE, \
+    BENCHMARK_ARCHITECTURES, BENCHMARK_BATCHES
+from coffeehouse_dltc.main import DLTC
+from coffeehouse_dltc.nn.models import get_nn_model
+
+
+def benchmark_architecture(architecture, embedding_size=EMBEDDING_SIZE, output_length=2,
+                           batch_size=CLASSIFY_BATCH_SIZE, batches=BENCHMARK_BATCHES,
+                           threads=None):
+    """
+    Measure the training and prediction throughput of an architecture on
+    random input, every architecture runs on its own graph and session
+    :param architecture: string defining the NN architecture e.g. 'cnn'
+    :param embedding_size: dimensionality of the word vectors
+    :param output_length: number of labels
+    :param batch_size: number of documents per batch
+    :param batches: number of batches timed for training and for prediction
+    :param threads: threads TensorFlow may use per operation, None uses all cores
+
+    :return: dictionary with the parameter count and the measurements
+    """
+    random_state = np.random.RandomState(0)
+    x_matrix = random_state.standard_normal(
+        (batch_size, SAMPLE_LENGTH, embedding_size)).astype(np.float32)
+    y_matrix = random_state.rand(batch_size, output_length) > 0.5
+
+    dltc = DLTC(intra_op_threads=threads, inter_op_threads=1 if threads else None)
+    with dltc.as_default():
+        dltc.keras_model = get_nn_model(architecture, embedding=embedding_size,
+                                        output_length=output_length)
+        inputs = [x_matrix] * len(dltc.keras_model.inputs)
+
+        dltc.keras_model.train_on_batch(inputs, y_matrix)
+        start = time.time()
+        for _ in range(batches):
+            dltc.keras_model.train_on_batch(inputs, y_matrix)
+        training_time = (time.time() - start) / batches
+
+    # Prediction goes through the same compiled function as serving
+    dltc._predict_matrix(x_matrix)
+    start = time.time()
+    for _ in range(batches):
+        dltc._predict_matrix(x_matrix)
+    batch_time = (time.time() - start) / batches
+
+    single = x_matrix[:1]
+    dltc._predict_matrix(single)
+    start = time.time()
+    for _ in range(batches):
+        dltc._predict_matrix(single)
+    single_time = (time.time() - start) / batches
+
+    parameters = int(dltc.keras_model.count_params())
+    dltc.session.close()
+
+    return {
+        'architecture': architecture,
+        'parameters': parameters,
+        'batch_size': batch_size,
+        'training_throughput': batch_size / training_time,
+        'prediction_throughput': batch_size / batch_time,
+        'batch_ms': batch_time * 1000,
+        'single_ms': single_time * 1000,
+    }
+
+
+def benchmark_architectures(architectures=BENCHMARK_ARCHITECTURES, **kwargs):
+    """
+    Benchmark several architectures with the same settings
+    :param architectures: iterable of architecture names
+    :param kwargs: arguments passed to benchmark_architecture
+
+    :return: list of dictionaries returned by benchmark_architecture
+    """
+    results = []
+    for architecture in architectures:
+        print("Benchmarking '{0}'".format(architecture))
+        results.append(benchmark_architecture(architecture, **kwargs))
+
+    return results
+
+
+def print_benchmark(results):
+    """
+    Print benchmark results in a readable form, the speedup is relative to
+    the first architecture
+    :param results: list of dictionaries returned by benchmark_architecture
+
+    :return: None
+    """
+    print(
+        "\n--- Architecture Benchmark ---\n\n"
+        "   ARCHITECTURE  PARAMETERS  TRAIN/S     PREDICT/S   BATCH       SINGLE    SPEEDUP"
+    )
+    baseline = results[0]['prediction_throughput'] if results else 0.0
+    for result in results:
+        print("   {architecture:<12}  {parameters:<10}  {training_throughput:<10.0f}  "
+              "{prediction_throughput:<10.0f}  {batch_ms:>7.2f}ms  {single_ms:>6.2f}ms  "
+              "{0:>6.1f}x".format(result['prediction_throughput'] / baseline if baseline else 0.0,
+                                  **result))
+    print()
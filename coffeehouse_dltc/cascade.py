@@ -0,0 +1,268 @@
+from __future__ import print_function, unicode_literals, division
+
+import threading
+import time
+
+import numpy as np
+
+from coffeehouse_dltc.base.document import tokenize
+from coffeehouse_dltc.config import CASCADE_THRESHOLD, CLASSIFY_BATCH_SIZE
+
+
+class CascadePredictor(object):
+    """ Classifies documents with an ordered list of model clusters, from the
+     cheapest to the most accurate. Every stage only sees the documents the
+     previous stages were unsure about. A document is settled by a stage when
+     the score of every label is at least its threshold away from the
+     undecided middle, i.e. each score is >= threshold or <= 1 - threshold.
+     The last stage settles every document it receives. A document is only
+     tokenized for the stages it reaches, the tokens are reused by the later
+     stages with the same tokenizer and only extended when a stage reads more
+     words than the document was tokenized for. """
+
+    def __init__(self, stages, thresholds=None):
+        """
+        Public Constructor
+
+        :param stages: list of DLTC objects with a loaded model cluster, cheapest first,
+        all of them trained on the same labels
+        :param thresholds: the confidence every stage but the last needs to settle
+        a document, one per stage but the last. None uses CASCADE_THRESHOLD for all
+        """
+        if len(stages) < 2:
+            raise ValueError("A cascade needs at least 2 stages")
+
+        if thresholds is None:
+            thresholds = [CASCADE_THRESHOLD] * (len(stages) - 1)
+        if len(thresholds) != len(stages) - 1:
+            raise ValueError("A cascade of {0} stages needs {1} thresholds".format(
+                len(stages), len(stages) - 1))
+        for threshold in thresholds:
+            if not 0.5 <= threshold <= 1.0:
+                raise ValueError("The thresholds have to be between 0.5 and 1")
+
+        self.stages = list(stages)
+        self.thresholds = list(thresholds)
+        self.labels = list(self.stages[0].labels)
+
+        # The columns of every stage in the label order of the first stage
+        self.columns = []
+        for dltc in self.stages:
+            if sorted(dltc.labels) != sorted(self.labels):
+                raise ValueError("Every stage of a cascade has to be trained on the same labels")
+            self.columns.append([list(dltc.labels).index(label) for label in self.labels])
+
+        self.sample_lengths = [dltc._input_shape()[0] for dltc in self.stages]
+
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """
+        Forget the statistics recorded so far
+
+        :return: None
+        """
+        with self.lock:
+            self.documents = 0
+            self.tokenize_time = 0.0
+            self.stage_documents = [0] * len(self.stages)
+            self.stage_settled = [0] * len(self.stages)
+            self.stage_time = [0.0] * len(self.stages)
+
+    def predict_from_text(self, text):
+        """
+        Predict labels for a given string of text
+        :param text: string or unicode with the text
+        :return: dictionary of labels and confidence intervals
+        """
+        return self.predict_from_texts([text])[0]
+
+    def predict_from_texts(self, texts, batch_size=CLASSIFY_BATCH_SIZE):
+        """
+        Predict labels for many strings of text
+        :param texts: iterable of strings
+        :param batch_size: number of documents sent to the first stage at once
+        :return: list with a dictionary of labels and confidence intervals per text
+        """
+        texts = list(texts)
+        results = []
+        for i in range(0, len(texts), batch_size):
+            scores, _ = self.predict(texts[i:i + batch_size])
+            results.extend(dict(zip(self.labels, y_predicted)) for y_predicted in scores)
+
+        return results
+
+    def predict(self, texts):
+        """
+        Run a batch of documents through the cascade
+        :param texts: list of strings
+
+        :return: tuple (numpy array of shape (documents, labels) in the order
+        of self.labels, numpy array with the stage which settled every document)
+        """
+        # For every tokenizer the tokens of every document and the limit they were produced with
+        token_lists, limits = {}, {}
+        tokenize_time = 0.0
+
+        scores = np.zeros((len(texts), len(self.labels)), dtype=np.float32)
+        settled_by = np.full(len(texts), len(self.stages) - 1, dtype=np.int32)
+        pending = np.arange(len(texts))
+        stage_documents = [0] * len(self.stages)
+        stage_settled = [0] * len(self.stages)
+        stage_time = [0.0] * len(self.stages)
+
+        for stage, dltc in enumerate(self.stages):
+            if not len(pending):
+                break
+
+            start = time.time()
+            tokens = self._tokens(texts, pending, dltc.tokenizer, self.sample_lengths[stage],
+                                  token_lists, limits)
+            tokenize_time += time.time() - start
+
+            start = time.time()
+            y_predicted = dltc.predict_tokens(tokens)[:, self.columns[stage]]
+            stage_time[stage] = time.time() - start
+            stage_documents[stage] = len(pending)
+
+            if stage < len(self.thresholds):
+                threshold = self.thresholds[stage]
+                settled = np.all((y_predicted >= threshold) | (y_predicted <= 1.0 - threshold),
+                                 axis=1)
+            else:
+                settled = np.ones(len(pending), dtype=np.bool_)
+
+            scores[pending[settled]] = y_predicted[settled]
+            settled_by[pending[settled]] = stage
+            stage_settled[stage] = int(np.sum(settled))
+            pending = pending[~settled]
+
+        with self.lock:
+            self.documents += len(texts)
+            self.tokenize_time += tokenize_time
+            for stage in range(len(self.stages)):
+                self.stage_documents[stage] += stage_documents[stage]
+                self.stage_settled[stage] += stage_settled[stage]
+                self.stage_time[stage] += stage_time[stage]
+
+        return scores, settled_by
+
+    @staticmethod
+    def _tokens(texts, pending, tokenizer, sample_length, token_lists, limits):
+        """
+        The tokens of the pending documents for a stage, documents are only
+        tokenized again when they were cut short of the words the stage reads
+        :param texts: list of strings of the batch
+        :param pending: indices of the documents the stage receives
+        :param tokenizer: name of the tokenizer of the stage
+        :param sample_length: number of words the stage reads per document
+        :param token_lists: the tokens produced so far per tokenizer, updated
+        :param limits: the limit of the tokens produced so far per tokenizer, updated
+
+        :return: list of token lists, one per pending document
+        """
+        tokens = token_lists.setdefault(tokenizer, [None] * len(texts))
+        limit = limits.setdefault(tokenizer, [0] * len(texts))
+
+        for i in pending:
+            words = tokens[i]
+            if words is None or (limit[i] < sample_length and len(words) >= limit[i]):
+                text = texts[i]
+                tokens[i] = tokenize(text, tokenizer, sample_length) if text else []
+                limit[i] = sample_length
+
+        return [tokens[i][:sample_length] for i in pending]
+
+    def stats(self):
+        """
+        The statistics of the documents classified so far
+
+        :return: dictionary with the share of documents every stage settled,
+        the escalation rate of every stage and the effective latency per document
+        """
+        with self.lock:
+            documents = max(1, self.documents)
+            stages = []
+            for stage in range(len(self.stages)):
+                seen = self.stage_documents[stage]
+                stages.append({
+                    'threshold': self.thresholds[stage] if stage < len(self.thresholds) else None,
+                    'documents': seen,
+                    'settled': self.stage_settled[stage],
+                    'share': self.stage_settled[stage] / documents,
+                    'escalation_rate': (seen - self.stage_settled[stage]) / seen if seen else 0.0,
+                    'time': self.stage_time[stage],
+                    'latency_ms': self.stage_time[stage] / seen * 1000 if seen else 0.0,
+                })
+
+            return {
+                'documents': self.documents,
+                'stages': stages,
+                'escalation_rate': self.stage_documents[1] / documents,
+                'effective_latency_ms': (self.tokenize_time + sum(self.stage_time)) /
+                documents * 1000,
+            }
+
+
+def compare_cascade(cascade, texts, batch_size=CLASSIFY_BATCH_SIZE):
+    """
+    Classify messages with a cascade and with its last stage alone, to measure
+    how often the cascade agrees with the last stage and what it saves
+    :param cascade: CascadePredictor object
+    :param texts: list of messages
+    :param batch_size: number of messages per batch
+
+    :return: dictionary with the statistics of the cascade, the agreement with
+    the last stage and the latency of both
+    """
+    last = cascade.stages[-1]
+    sample_length, _ = last._input_shape()
+    batches = [texts[i:i + batch_size] for i in range(0, len(texts), batch_size)]
+
+    cascade.reset()
+    y_cascade = np.concatenate([cascade.predict(batch)[0] for batch in batches])
+    report = cascade.stats()
+
+    start = time.time()
+    y_last = []
+    for batch in batches:
+        tokens = [tokenize(text, last.tokenizer, sample_length) if text else [] for text in batch]
+        y_last.append(last.predict_tokens(tokens)[:, cascade.columns[-1]])
+    report['last_stage_latency_ms'] = (time.time() - start) / max(1, len(texts)) * 1000
+    y_last = np.concatenate(y_last)
+
+    report['batch_size'] = batch_size
+    report['top_label_agreement'] = float(np.mean(
+        np.argmax(y_cascade, axis=1) == np.argmax(y_last, axis=1)))
+    report['label_agreement'] = float(np.mean((y_cascade >= 0.5) == (y_last >= 0.5)))
+    report['speedup'] = report['last_stage_latency_ms'] / report['effective_latency_ms'] \
+        if report['effective_latency_ms'] else 0.0
+
+    return report
+
+
+def print_cascade_report(report):
+    """
+    Print a comparison of a cascade with its last stage
+    :param report: dictionary returned by compare_cascade
+
+    :return: None
+    """
+    print(
+        "\n--- Cascade ---\n\n"
+        "   STAGE  THRESHOLD  DOCUMENTS  SETTLED   ESCALATED  LATENCY"
+    )
+    for stage, result in enumerate(report['stages']):
+        threshold = "{0:.3f}".format(result['threshold']) if result['threshold'] else '-'
+        print("   {0:<5}  {1:<9}  {documents:<9}  {share:<8.1%}  {escalation_rate:<9.1%}  "
+              "{latency_ms:.3f}ms".format(stage, threshold, **result))
+
+    print(
+        "\n   Messages        : {documents}\n"
+        "   Escalation rate : {escalation_rate:.1%}\n"
+        "   Agreement       : {top_label_agreement:.4f} (top label), {label_agreement:.4f} "
+        "(labels at 0.5) with the last stage\n"
+        "   Latency         : {last_stage_latency_ms:.3f}ms -> {effective_latency_ms:.3f}ms "
+        "per message ({speedup:.1f}x), batches of {batch_size}\n".format(**report)
+    )
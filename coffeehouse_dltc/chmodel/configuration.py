@@ -1,9 +1,22 @@
 import os
 import json
+import multiprocessing
 import shutil
+from array import array
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from os import path
 
 from coffeehouse_dltc import DLTC
+from coffeehouse_dltc.base.word2vec import write_line_sentence_corpus
+from coffeehouse_dltc.base.label_index import LabelIndex, label_index_path, load_label_index
+from coffeehouse_dltc.chmodel.ingestion import ingest_classification, iterate_lines, count_lines
+from coffeehouse_dltc.chmodel.planner import plan_training, print_plan, choose_sample_length, \
+    print_sample_length
+from coffeehouse_dltc.chmodel.pipeline import Pipeline, print_pipeline
+from coffeehouse_dltc.config import CHECKPOINT_PERIOD, EARLY_STOPPING_MONITOR, SPLIT_SEED, \
+    SCALER_FIT_MODE, WORD2VEC_WORKERS, WORD2VEC_INPUT, INGESTION_WORKERS, TOKENIZER, TRAINING_MODE, \
+    DEDUP_MODE, DEDUP_THRESHOLD, SPARSE_TARGETS, SPARSE_TARGETS_MIN_LABELS, PRETRAINED_MODE, \
+    PRETRAINED_EPOCHS, SAMPLE_LENGTH, SAMPLE_LENGTH_PERCENTILE, PIPELINE_WORKERS
 
 
 class Configuration(object):
@@ -37,18 +50,21 @@ class Configuration(object):
                 self.src, classification_method['f']
             )
 
+        # Line counts and byte offsets recorded by the last create_structure
+        self.ingestion_index = {}
+
     def classifier_range(self, classification_name):
         """
-        Determines the range of the classifier
+        Determines the range of the classifier, the count recorded while
+        creating the structure is used when available
 
         :param classification_name:
         :return: Integer of the amount of data the classifier contains
         """
         if classification_name in self.classifications:
-            with open(self.classifications[classification_name], 'r', encoding="utf8") as f:
-                for i, l in enumerate(f):
-                    pass
-            return i + 1
+            if classification_name in self.ingestion_index:
+                return self.ingestion_index[classification_name]['documents']
+            return count_lines(self.classifications[classification_name])
         else:
             raise ValueError(
                 "The classification label '{0}' is not defined in the configuration".format(
@@ -56,14 +72,15 @@ class Configuration(object):
 
     def classifier_contents(self, classification_name):
         """
-        Returns the contents of the classifier
+        Returns the contents of the classifier, streamed line by line so files
+        larger than the memory can be read. Files ending with .gz, .bz2 or .xz
+        are decompressed on the fly
 
         :param classification_name:
-        :return: Contents of the classifier split into a list type
+        :return: Generator of the lines of the classifier
         """
         if classification_name in self.classifications:
-            with open(self.classifications[classification_name], 'r', encoding="utf8") as f:
-                return f.read().splitlines()
+            return (line for _, line in iterate_lines(self.classifications[classification_name]))
         else:
             raise ValueError(
                 "The classification label '{0}' is not defined in the configuration".format(
@@ -80,6 +97,75 @@ class Configuration(object):
             classifier_labels.append(classifier_name)
         return classifier_labels
 
+    def corpus_file(self, directory_structure):
+        """
+        The line-sentence file the word vectors are trained from
+
+        :param directory_structure: the path of the model structure directory
+        :return: the path of the file, None when training from an iterator
+        """
+        word2vec_input = self.configuration['training_properties'].get(
+            'word2vec_input', WORD2VEC_INPUT)
+
+        if word2vec_input == 'corpus_file':
+            return path.join(directory_structure, "model_data.sentences")
+        elif word2vec_input == 'iterator':
+            return None
+        else:
+            raise ValueError("Unknown word2vec input: {0}".format(word2vec_input))
+
+    def sample_length(self, directory_structure):
+        """
+        The number of words the network reads per document, set in the training
+        properties or chosen from the token counts of the corpus when 'auto'
+
+        :param directory_structure: the path of the model structure directory
+        :return: int
+        """
+        training_properties = self.configuration['training_properties']
+        sample_length = training_properties.get('sample_length', SAMPLE_LENGTH)
+
+        if sample_length == 'auto':
+            choice = choose_sample_length(
+                path.join(directory_structure, 'model_data'),
+                percentile=training_properties.get('sample_length_percentile',
+                                                   SAMPLE_LENGTH_PERCENTILE),
+                tokenizer=training_properties.get('tokenizer', TOKENIZER),
+                seed=training_properties.get('split_seed', SPLIT_SEED)
+            )
+            print_sample_length(choice)
+            return choice['sample_length']
+
+        if not isinstance(sample_length, int) or sample_length < 1:
+            raise ValueError("sample_length must be a positive integer or 'auto'")
+
+        return sample_length
+
+    def pretrained_vectors(self):
+        """
+        The settings of the pretrained vectors the word vectors are initialized from
+
+        :return: dictionary of keyword arguments for DLTC.train_word2vec, empty
+        when the vectors are trained from scratch
+        """
+        training_properties = self.configuration['training_properties']
+        pretrained = training_properties.get('pretrained_vectors')
+        if not pretrained:
+            return {}
+
+        # Relative paths are relative to the source directory
+        pretrained = path.join(self.src, pretrained)
+        if not path.exists(pretrained):
+            raise FileNotFoundError("The pretrained vectors file '{0}' was not found".format(
+                pretrained))
+
+        return {
+            'pretrained': pretrained,
+            'pretrained_mode': training_properties.get('pretrained_mode', PRETRAINED_MODE),
+            'pretrained_epochs': training_properties.get('pretrained_epochs', PRETRAINED_EPOCHS),
+            'pretrained_binary': training_properties.get('pretrained_binary'),
+        }
+
     def create_structure(self):
         """
         Creates the model structure which allows training to be simplified
@@ -104,85 +190,306 @@ class Configuration(object):
                 f.write("%s\n" % item)
             f.close()
 
+        training_properties = self.configuration['training_properties']
+        dedup = training_properties.get('dedup', DEDUP_MODE)
+        dedup_threshold = training_properties.get('dedup_threshold', DEDUP_THRESHOLD)
+
         print("Processing classifiers")
-        for classifier_name, classifier_data_file in self.classifications.items():
-            contents = self.classifier_contents(classifier_name)
-            print("Processing label '{0}'".format(classifier_name))
-
-            current_value = 0
-            for value in contents:
-                content_file_path = "{0}_{1}.txt".format(classifier_name, current_value)
-                label_file_path = "{0}_{1}.lab".format(classifier_name, current_value)
-                with open(path.join(data_path, content_file_path), "w+", encoding="utf8") as content_file:
-                    content_file.write(value)
-                    content_file.close()
-                with open(path.join(data_path, label_file_path), "w+", encoding="utf8") as label_file:
-                    label_file.write(classifier_name)
-                    label_file.close()
-                current_value += 1
-            print("Processed label '{0}'".format(classifier_name))
+        self.ingestion_index = {}
+        workers = min(len(self.classifications), INGESTION_WORKERS) or 1
+        # The pipeline may be running other stages in threads, forking would copy
+        # their locks in whatever state they are, spawned workers start clean
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+            futures = []
+            for classifier_name, classifier_data_file in self.classifications.items():
+                print("Processing label '{0}'".format(classifier_name))
+                offsets_path = path.join(temporary_path, "model_data.{0}.offsets".format(classifier_name))
+                weights_path = path.join(temporary_path, "model_data.{0}.weights".format(classifier_name))
+                futures.append(executor.submit(
+                    ingest_classification, classifier_name, classifier_data_file,
+                    data_path, offsets_path, dedup, dedup_threshold, weights_path))
+
+            for future in as_completed(futures):
+                result = future.result()
+                self.ingestion_index[result['label']] = result
+                print("Processed label '{0}' ({1} lines, {2} documents, {3} exact and {4} near "
+                      "duplicates removed, {5} bytes)".format(
+                          result['label'], result['lines'], result['documents'],
+                          result['exact_duplicates'], result['near_duplicates'], result['bytes']))
+
+        lines = sum(result['lines'] for result in self.ingestion_index.values())
+        documents = sum(result['documents'] for result in self.ingestion_index.values())
+        if dedup != 'none':
+            print("Deduplication ({0}) kept {1} of {2} lines, the corpus shrank by {3:.1%}".format(
+                dedup, documents, lines, 1 - documents / lines if lines else 0.0))
+
+        index_file_path = path.join(temporary_path, "model_data.index")
+        with open(index_file_path, 'w', encoding='utf8') as f:
+            json.dump(self.ingestion_index, f, ensure_ascii=False, indent=4)
+
+        label_index = LabelIndex.from_ingestion(self.ingestion_index)
+        label_index.save(label_index_path(data_path))
+        print("Indexed {0} labels of {1} documents".format(len(label_index.labels), len(label_index)))
 
         print("Structure created at '{0}'".format(temporary_path))
         return temporary_path
 
-    def train_model(self):
+    def sample_weights(self, directory_structure):
+        """
+        The number of source lines every document of the structure stands for,
+        written by create_structure
+
+        :param directory_structure: the path of the model structure directory
+        :return: dictionary mapping the document ids to their weight, documents
+        of structures created without weights are left out and weigh 1
+        """
+        with open(path.join(directory_structure, "model_data.index"), 'r', encoding='utf8') as f:
+            ingestion_index = json.load(f)
+
+        sample_weights = {}
+        for label, result in ingestion_index.items():
+            if not result.get('weights') or not path.exists(result['weights']):
+                continue
+            weights = array('I')
+            with open(result['weights'], 'rb') as f:
+                weights.frombytes(f.read())
+            for i, weight in enumerate(weights):
+                sample_weights["{0}_{1}".format(label, i)] = float(weight)
+
+        return sample_weights
+
+    def train_model(self, resume=False):
         """
         Starts the process of training the model by creating a model structure
         and creating the necessary models for classification
 
+        :param resume: continue an interrupted build from its last checkpoint
+        instead of starting over
         :return: None
         """
-        directory_structure = self.create_structure()
-
-        print("Preparing output directory")
+        training_properties = self.configuration['training_properties']
+        directory_structure = "{0}_data".format(self.src)
+        checkpoint_path = "{0}_checkpoint".format(self.src)
+
+        checkpoint_embeddings_path = path.join(checkpoint_path, "{0}.che".format(
+            self.configuration['model']['model_name']))
+        checkpoint_scaler_path = path.join(checkpoint_path, "{0}.chs".format(
+            self.configuration['model']['model_name']))
+
+        if resume and not (path.exists(path.join(directory_structure, 'model_data')) and
+                           path.exists(checkpoint_embeddings_path) and
+                           path.exists(checkpoint_scaler_path)):
+            print("No checkpoint found at '{0}', starting a new build".format(checkpoint_path))
+            resume = False
+
+        model_name = self.configuration['model']['model_name']
         output_path = "{0}_build".format(self.src)
+        embeddings_path = path.join(output_path, "{0}.che".format(model_name))
+        scaler_path = path.join(output_path, "{0}.chs".format(model_name))
+        model_file_path = path.join(output_path, "{0}.chm".format(model_name))
+        labels_file_path = path.join(output_path, "{0}.chl".format(model_name))
+        cluster_file_path = path.join(output_path, "{0}.chc".format(model_name))
+
+        tokenizer = training_properties.get('tokenizer', TOKENIZER)
+        split_seed = training_properties.get('split_seed', SPLIT_SEED)
+
+        # The stages take the results of the stages they depend on as arguments
+        def structure():
+            if resume:
+                return directory_structure
+            if path.exists(checkpoint_path):
+                shutil.rmtree(checkpoint_path)
+            os.mkdir(checkpoint_path)
+            print("Created directory '{0}'".format(checkpoint_path))
+            return self.create_structure()
+
+        def output():
+            print("Preparing output directory")
+            if path.exists(output_path):
+                shutil.rmtree(output_path)
+            os.mkdir(output_path)
+            return output_path
+
+        def corpus(structure):
+            corpus_file = self.corpus_file(structure)
+            if corpus_file and not resume and not path.exists(corpus_file):
+                print("Writing the tokenized corpus")
+                write_line_sentence_corpus(
+                    path.join(structure, 'model_data'), corpus_file,
+                    workers=training_properties.get('word2vec_workers', WORD2VEC_WORKERS),
+                    tokenizer=tokenizer)
+            return corpus_file
+
+        def samples(structure):
+            return len({filename[:-4] for filename in os.listdir(path.join(structure, 'model_data'))})
+
+        def label_index(structure, samples):
+            data_path = path.join(structure, 'model_data')
+            index = load_label_index(data_path, documents=samples)
+            if index is None:
+                print("Indexing the labels of '{0}'".format(data_path))
+                index = LabelIndex.from_directory(data_path)
+                index.save(label_index_path(data_path))
+            return index
+
+        def sample_length(structure):
+            return self.sample_length(structure)
+
+        def sample_weights(structure):
+            if not training_properties.get('dedup_weights', False):
+                return None
+            return self.sample_weights(structure)
+
+        def plan(structure, samples, label_index, sample_length):
+            sparse_targets = training_properties.get('sparse_targets', SPARSE_TARGETS)
+            if sparse_targets == 'auto':
+                sparse_targets = len(self.classifier_labels()) >= SPARSE_TARGETS_MIN_LABELS
+
+            training_plan = plan_training(
+                samples,
+                training_properties['vec_dim'],
+                len(self.classifier_labels()),
+                path.join(structure, 'features'),
+                memory_budget=training_properties.get('memory_budget'),
+                mode=training_properties.get('training_mode', TRAINING_MODE),
+                sample_length=sample_length,
+                postings=label_index.postings_count() if sparse_targets else None
+            )
+            print_plan(training_plan)
+            return training_plan
+
+        def dltc():
+            # Created once the ingestion workers were forked, never before
+            print("Initializing CoffeeHouse DLTC Server")
+            # noinspection SpellCheckingInspection
+            return DLTC(tokenizer=tokenizer)
+
+        def word2vec(dltc, structure, corpus):
+            if resume:
+                print("Loading word to vectors model from checkpoint")
+                dltc.load_word2vec_model(checkpoint_embeddings_path)
+            else:
+                print("Creating word to vectors model")
+                dltc.train_word2vec(
+                    path.join(structure, 'model_data'),
+                    vec_dim=training_properties['vec_dim'],
+                    workers=training_properties.get('word2vec_workers', WORD2VEC_WORKERS),
+                    corpus_file=corpus,
+                    **self.pretrained_vectors()
+                )
+
+        def scaler(dltc, structure):
+            if resume:
+                print("Loading scalers from checkpoint")
+                dltc.load_scaler(checkpoint_scaler_path)
+            else:
+                print("Fitting Scalers")
+                dltc.fit_scaler(
+                    path.join(structure, 'model_data'),
+                    mode=training_properties.get('scaler_fit', SCALER_FIT_MODE)
+                )
+
+        def checkpoint(dltc):
+            # The network checkpoints are only valid for these exact vectors
+            if not resume:
+                dltc.save_word2vec_model(checkpoint_embeddings_path)
+                dltc.save_scaler(checkpoint_scaler_path)
+
+        def save_vectors(dltc):
+            dltc.save_word2vec_model(embeddings_path)
+            print("Created file '{0}'".format(embeddings_path))
+            dltc.save_scaler(scaler_path)
+            print("Created file '{0}'".format(scaler_path))
+
+        def save_labels():
+            with open(labels_file_path, 'w', encoding='utf-8') as f:
+                json.dump(self.classifier_labels(), f, ensure_ascii=False, indent=4)
+            print("Created file '{0}'".format(labels_file_path))
+
+        def features(dltc, structure, plan, label_index, sample_length, sample_weights):
+            # Streaming builds the features of every batch while training
+            if plan['mode'] == 'streaming':
+                return None
+
+            print("Building features ({0})".format(plan['mode']))
+            return dltc.build_features(
+                path.join(structure, 'model_data'),
+                self.classifier_labels(),
+                test_ratio=training_properties['test_ratio'],
+                split_seed=split_seed,
+                feature_dir=plan['feature_dir'] if plan['mode'] == 'memmap' else None,
+                sample_weights=sample_weights,
+                label_index=label_index,
+                sparse_targets=plan['sparse_targets'],
+                sample_length=sample_length
+            )
+
+        def train(dltc, structure, plan, features, label_index, sample_length, sample_weights):
+            print("Training model ({0})".format(plan['mode']))
+            data_path = path.join(structure, 'model_data')
+            train_kwargs = dict(
+                nn_model=training_properties['architecture'],
+                batch_size=training_properties['batch_size'],
+                epochs=training_properties['epoch'],
+                test_ratio=training_properties['test_ratio'],
+                verbose=2,
+                checkpoint_dir=checkpoint_path,
+                checkpoint_period=training_properties.get('checkpoint_period', CHECKPOINT_PERIOD),
+                resume=resume,
+                early_stopping_patience=training_properties.get('early_stopping_patience'),
+                early_stopping_monitor=training_properties.get('early_stopping_monitor',
+                                                               EARLY_STOPPING_MONITOR),
+                early_stopping_min_delta=training_properties.get('early_stopping_min_delta', 0.0),
+                split_seed=split_seed,
+                sample_weights=sample_weights,
+                label_index=label_index,
+                sparse_targets=plan['sparse_targets'],
+                sample_length=sample_length
+            )
+            if plan['mode'] == 'streaming':
+                dltc.batch_train(data_path, self.classifier_labels(), **train_kwargs)
+            else:
+                dltc.train(data_path, self.classifier_labels(),
+                           feature_dir=plan['feature_dir'] if plan['mode'] == 'memmap' else None,
+                           features=features, **train_kwargs)
+
+        def save_model(dltc):
+            dltc.save_model(model_file_path)
+            print("Created file '{0}'".format(model_file_path))
+            dltc.save_cluster_config(cluster_file_path)
+            print("Created file '{0}'".format(cluster_file_path))
+
+        def cleanup(structure):
+            print("Cleaning up")
+            if path.exists(structure):
+                shutil.rmtree(structure)
+            if path.exists(checkpoint_path):
+                shutil.rmtree(checkpoint_path)
+
+        pipeline = Pipeline(training_properties.get('pipeline_workers', PIPELINE_WORKERS))
+        pipeline.add('structure', structure)
+        pipeline.add('output', output)
+        pipeline.add('corpus', corpus, ['structure'])
+        pipeline.add('samples', samples, ['structure'])
+        pipeline.add('label_index', label_index, ['structure', 'samples'])
+        pipeline.add('sample_length', sample_length, ['structure'])
+        pipeline.add('sample_weights', sample_weights, ['structure'])
+        pipeline.add('plan', plan, ['structure', 'samples', 'label_index', 'sample_length'])
+        pipeline.add('dltc', dltc, after=['structure'])
+        pipeline.add('word2vec', word2vec, ['dltc', 'structure', 'corpus'])
+        pipeline.add('scaler', scaler, ['dltc', 'structure'], after=['word2vec'])
+        pipeline.add('checkpoint', checkpoint, ['dltc'], after=['scaler'])
+        pipeline.add('save_vectors', save_vectors, ['dltc'], after=['scaler', 'output'])
+        pipeline.add('save_labels', save_labels, after=['output'])
+        pipeline.add('features', features, ['dltc', 'structure', 'plan', 'label_index',
+                                            'sample_length', 'sample_weights'], after=['scaler'])
+        pipeline.add('train', train, ['dltc', 'structure', 'plan', 'features', 'label_index',
+                                      'sample_length', 'sample_weights'])
+        pipeline.add('save_model', save_model, ['dltc'], after=['train', 'output'])
+        pipeline.add('cleanup', cleanup, ['structure'],
+                     after=['checkpoint', 'save_vectors', 'save_labels', 'save_model'])
+        pipeline.run()
+        print_pipeline(pipeline)
 
-        embeddings_path = path.join(output_path, "{0}.che".format(self.configuration['model']['model_name']))
-        scaler_path = path.join(output_path, "{0}.chs".format(self.configuration['model']['model_name']))
-        model_file_path = path.join(output_path, "{0}.chm".format(self.configuration['model']['model_name']))
-        labels_file_path = path.join(output_path, "{0}.chl".format(self.configuration['model']['model_name']))
-
-        if path.exists(output_path):
-            shutil.rmtree(output_path)
-
-        os.mkdir(output_path)
-
-        print("Initializing CoffeeHouse DLTC Server")
-        # noinspection SpellCheckingInspection
-        dltc = DLTC()
-
-        print("Creating word to vectors model")
-        dltc.train_word2vec(
-            path.join(directory_structure, 'model_data'),
-            vec_dim=self.configuration['training_properties']['vec_dim']
-        )
-
-        print("Fitting Scalers")
-        dltc.fit_scaler(path.join(directory_structure, 'model_data'))
-
-        print("Training model")
-        dltc.train(
-            path.join(directory_structure, 'model_data'),
-            self.classifier_labels(),
-            nn_model=self.configuration['training_properties']['architecture'],
-            batch_size=self.configuration['training_properties']['batch_size'],
-            epochs=self.configuration['training_properties']['epoch'],
-            test_ratio=self.configuration['training_properties']['test_ratio'],
-            verbose=2
-        )
-
-        print("Saving data to disk")
-        dltc.save_word2vec_model(embeddings_path)
-        print("Created file '{0}'".format(embeddings_path))
-        dltc.save_scaler(scaler_path)
-        print("Created file '{0}'".format(scaler_path))
-        dltc.save_model(model_file_path)
-        print("Created file '{0}'".format(model_file_path))
-        with open(labels_file_path, 'w', encoding='utf-8') as f:
-            json.dump(self.classifier_labels(), f, ensure_ascii=False, indent=4)
-        print("Created file '{0}'".format(labels_file_path))
-
-        print("Cleaning up")
-        if path.exists(directory_structure):
-            shutil.rmtree(directory_structure)
         print("Model created at '{0}".format(output_path))
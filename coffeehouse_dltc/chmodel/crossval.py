@@ -0,0 +1,337 @@
+from __future__ import print_function, unicode_literals, division
+
+import json
+import multiprocessing
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor
+from os import path
+
+import numpy as np
+import scipy.sparse as sp
+
+from coffeehouse_dltc.base.label_index import LabelIndex, label_index_path, load_label_index
+from coffeehouse_dltc.config import CROSS_VALIDATION_FOLDS, CROSS_VALIDATION_PROCESSES, \
+    CROSS_VALIDATION_THREADS, SPLIT_SEED, SCALER_FIT_MODE, WORD2VEC_WORKERS, TOKENIZER, \
+    SPARSE_TARGETS, SPARSE_TARGETS_MIN_LABELS, EVALUATION_THRESHOLD, CLASSIFY_BATCH_SIZE
+from coffeehouse_dltc.main import DLTC
+from coffeehouse_dltc.nn.input_data import build_x_and_y_memmap, stratified_folds, \
+    get_sample_weights, FeatureSequence
+from coffeehouse_dltc.nn.metrics import ClassificationMetrics
+from coffeehouse_dltc.nn.models import get_nn_model
+from coffeehouse_dltc.nn.session import configure_threads, thread_environment
+from coffeehouse_dltc.nn.vectorizer import WordVectorizer
+
+
+class CrossValidation(object):
+    """ Estimates the quality of a configuration with stratified k-fold
+     cross-validation. The structure, the tokenized corpus, the word vectors,
+     the scaler and the feature matrix are built once for all the folds. The
+     features are written to a memory-mapped file every fold process maps,
+     so the folds share the pages of one copy and select their training and
+     test samples by index. The word vectors and the scaler are unsupervised
+     and fitted on the whole corpus, the network of every fold only sees its
+     training samples. """
+
+    def __init__(self, configuration, folds=CROSS_VALIDATION_FOLDS,
+                 processes=CROSS_VALIDATION_PROCESSES, threads=CROSS_VALIDATION_THREADS):
+        """
+        Public Constructor
+
+        :param configuration: Configuration object of the source directory
+        :param folds: the number of folds, at least 2
+        :param processes: number of folds trained in parallel processes
+        :param threads: threads TensorFlow may use per operation in every
+        process, None uses all cores
+        """
+        if folds < 2:
+            raise ValueError("Cross-validation needs at least 2 folds")
+
+        self.configuration = configuration
+        self.training_properties = configuration.configuration['training_properties']
+        self.folds = folds
+        self.processes = processes
+        self.threads = threads
+        self.tokenizer = self.training_properties.get('tokenizer', TOKENIZER)
+        self.output_path = "{0}_cross_validation".format(configuration.src)
+
+    def run(self):
+        """
+        Build the shared artifacts, train and evaluate every fold and write the report
+
+        :return: dictionary with the per-fold and aggregate metrics and the timings
+        """
+        start = time.time()
+        if path.exists(self.output_path):
+            shutil.rmtree(self.output_path)
+        os.mkdir(self.output_path)
+
+        timings = {}
+        stage = time.time()
+        directory_structure = self.configuration.create_structure()
+        timings['structure'] = time.time() - stage
+
+        artifacts = self._prepare_artifacts(directory_structure, timings)
+
+        tasks = []
+        for fold in range(self.folds):
+            task = dict(artifacts)
+            task.update(fold=fold, threads=self.threads, tokenizer=self.tokenizer,
+                        architecture=self.training_properties['architecture'],
+                        batch_size=self.training_properties['batch_size'],
+                        epochs=self.training_properties['epoch'],
+                        seed=self.training_properties.get('split_seed', SPLIT_SEED))
+            tasks.append(task)
+
+        print("Training {0} folds over {1} processes".format(self.folds, self.processes))
+        stage = time.time()
+        results = []
+        context = multiprocessing.get_context('spawn')
+        with thread_environment(self.threads), \
+                ProcessPoolExecutor(max_workers=self.processes, mp_context=context,
+                                    initializer=configure_threads,
+                                    initargs=(self.threads, 1)) as executor:
+            for result in executor.map(_run_fold, tasks):
+                print("Fold {fold}: {train_samples} training and {test_samples} test samples "
+                      "accuracy={accuracy:.4f} macro_f1={macro_f1:.4f} "
+                      "training_time={training_time:.1f}s".format(**result))
+                results.append(result)
+        timings['folds'] = time.time() - stage
+
+        report = self._report(results, timings, time.time() - start)
+        report_path = "{0}_cross_validation.json".format(self.configuration.src)
+        with open(report_path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=4)
+        print("Created file '{0}'".format(report_path))
+
+        print("Cleaning up")
+        shutil.rmtree(directory_structure)
+        shutil.rmtree(self.output_path)
+
+        return report
+
+    def _prepare_artifacts(self, directory_structure, timings):
+        """
+        Train the word vectors and the scaler, build the feature matrix into a
+        .npy file the folds memory-map and assign the samples to the folds
+
+        :param directory_structure: the structure created by the configuration
+        :param timings: dictionary the duration of every stage is added to
+        :return: dictionary of paths and settings shared by the folds
+        """
+        data_dir = path.join(directory_structure, 'model_data')
+        filenames = sorted({filename[:-4] for filename in os.listdir(data_dir)})
+        labels = self.configuration.classifier_labels()
+
+        label_index = load_label_index(data_dir, documents=len(filenames))
+        if label_index is None:
+            label_index = LabelIndex.from_directory(data_dir)
+            label_index.save(label_index_path(data_dir))
+
+        sparse_targets = self.training_properties.get('sparse_targets', SPARSE_TARGETS)
+        if sparse_targets == 'auto':
+            sparse_targets = len(labels) >= SPARSE_TARGETS_MIN_LABELS
+
+        sample_length = self.configuration.sample_length(directory_structure)
+
+        print("Creating word to vectors model")
+        stage = time.time()
+        dltc = DLTC(tokenizer=self.tokenizer)
+        dltc.train_word2vec(
+            data_dir,
+            vec_dim=self.training_properties['vec_dim'],
+            workers=self.training_properties.get('word2vec_workers', WORD2VEC_WORKERS),
+            corpus_file=self.configuration.corpus_file(directory_structure),
+            **self.configuration.pretrained_vectors()
+        )
+        timings['word2vec'] = time.time() - stage
+
+        print("Fitting Scalers")
+        stage = time.time()
+        dltc.fit_scaler(data_dir, mode=self.training_properties.get('scaler_fit',
+                                                                    SCALER_FIT_MODE))
+        timings['scaler'] = time.time() - stage
+
+        artifacts = {
+            'labels': labels,
+            'vec_dim': self.training_properties['vec_dim'],
+            'sample_length': sample_length,
+            'y_path': path.join(self.output_path, 'y.npz' if sparse_targets else 'y.npy'),
+            'folds_path': path.join(self.output_path, 'folds.npy'),
+            'weights_path': None,
+        }
+
+        print("Building feature matrix")
+        stage = time.time()
+        [x_matrix], y_matrix = build_x_and_y_memmap(
+            filenames, data_dir, self.output_path, 'all',
+            label_indices={lab: i for i, lab in enumerate(labels)},
+            word2vec_model=dltc.word2vec_model,
+            scaler=dltc.scaler,
+            nn_model=None,
+            vectorizer=WordVectorizer(dltc.word2vec_model, dltc.scaler),
+            tokenizer=self.tokenizer,
+            label_index=label_index,
+            sparse_targets=sparse_targets,
+            sample_length=sample_length,
+        )
+        artifacts['x_path'] = x_matrix.filename
+        del x_matrix
+        if sparse_targets:
+            sp.save_npz(artifacts['y_path'], y_matrix)
+        else:
+            np.save(artifacts['y_path'], y_matrix)
+        timings['features'] = time.time() - stage
+
+        np.save(artifacts['folds_path'], stratified_folds(
+            filenames, data_dir, self.folds,
+            seed=self.training_properties.get('split_seed', SPLIT_SEED),
+            label_index=label_index))
+
+        if self.training_properties.get('dedup_weights', False):
+            sample_weights = self.configuration.sample_weights(directory_structure)
+            artifacts['weights_path'] = path.join(self.output_path, 'weights.npy')
+            np.save(artifacts['weights_path'], get_sample_weights(filenames, sample_weights))
+
+        return artifacts
+
+    def _report(self, results, timings, total_time):
+        """
+        Aggregate the fold results. The time of independent runs is estimated
+        as k times the shared preparation plus the training of every fold
+
+        :param results: list of dictionaries returned by _run_fold
+        :param timings: dictionary with the duration of every shared stage
+        :param total_time: the wall time of the cross-validation
+        :return: dictionary which can be serialized to JSON
+        """
+        results = sorted(results, key=lambda r: r['fold'])
+        preparation_time = sum(timings[stage] for stage in
+                               ('structure', 'word2vec', 'scaler', 'features'))
+        independent_time = self.folds * preparation_time + \
+            sum(result['training_time'] + result['evaluation_time'] for result in results)
+
+        aggregate = {}
+        for metric in ('accuracy', 'macro_f1'):
+            values = [result[metric] for result in results]
+            aggregate[metric] = {'mean': float(np.mean(values)), 'std': float(np.std(values))}
+
+        aggregate['labels'] = {}
+        for label in results[0]['labels']:
+            values = [result['labels'][label]['f1'] for result in results]
+            aggregate['labels'][label] = {'f1_mean': float(np.mean(values)),
+                                          'f1_std': float(np.std(values))}
+
+        return {
+            'folds': self.folds,
+            'processes': self.processes,
+            'architecture': self.training_properties['architecture'],
+            'fold_results': results,
+            'aggregate': aggregate,
+            'timings': timings,
+            'total_time': total_time,
+            'independent_time': independent_time,
+            'time_saved': independent_time - total_time,
+        }
+
+
+def print_cross_validation(report):
+    """
+    Print a cross-validation report in a readable form
+    :param report: dictionary returned by CrossValidation.run
+
+    :return: None
+    """
+    print(
+        "\n--- Cross-Validation ({0} folds, {1}) ---\n\n"
+        "   FOLD  TRAIN     TEST      ACCURACY  MACRO_F1  TRAINING_TIME".format(
+            report['folds'], report['architecture'])
+    )
+    for result in report['fold_results']:
+        print("   {fold:<4}  {train_samples:<8}  {test_samples:<8}  {accuracy:<8.4f}  "
+              "{macro_f1:<8.4f}  {training_time:>12.1f}s".format(**result))
+
+    aggregate = report['aggregate']
+    print(
+        "\n   Accuracy        : {0:.4f} +/- {1:.4f}\n"
+        "   Macro F1        : {2:.4f} +/- {3:.4f}\n".format(
+            aggregate['accuracy']['mean'], aggregate['accuracy']['std'],
+            aggregate['macro_f1']['mean'], aggregate['macro_f1']['std'])
+    )
+    print("   LABEL                 F1 MEAN  F1 STD")
+    for label, metrics in aggregate['labels'].items():
+        print("   {0:<20}  {f1_mean:<7.4f}  {f1_std:<6.4f}".format(label, **metrics))
+
+    timings = report['timings']
+    print(
+        "\n   Shared stages   : structure {0:.1f}s, word2vec {1:.1f}s, scaler {2:.1f}s, "
+        "features {3:.1f}s\n"
+        "   Folds           : {4:.1f}s\n"
+        "   Total           : {5:.1f}s, independent runs would take about {6:.1f}s "
+        "(saved {7:.1f}s)\n".format(
+            timings['structure'], timings['word2vec'], timings['scaler'], timings['features'],
+            timings['folds'], report['total_time'], report['independent_time'],
+            report['time_saved'])
+    )
+
+
+def _run_fold(task):
+    """
+    Train and evaluate a single fold, runs inside a worker process
+
+    :param task: dictionary of the fold number, the settings and the artifact paths
+    :return: dictionary with the fold measurements
+    """
+    labels = task['labels']
+    x_matrix = np.load(task['x_path'], mmap_mode='r')
+    y_matrix = sp.load_npz(task['y_path']) if task['y_path'].endswith('.npz') \
+        else np.load(task['y_path'])
+    folds = np.load(task['folds_path'])
+    sample_weights = np.load(task['weights_path']) if task['weights_path'] else None
+
+    train_indices = np.flatnonzero(folds != task['fold'])
+    test_indices = np.flatnonzero(folds == task['fold'])
+
+    dltc = DLTC(intra_op_threads=task['threads'], inter_op_threads=1,
+                tokenizer=task['tokenizer'])
+    with dltc.as_default():
+        dltc.keras_model = get_nn_model(
+            task['architecture'],
+            embedding=task['vec_dim'],
+            output_length=len(labels),
+            sample_length=task['sample_length']
+        )
+        x_inputs = [x_matrix] * len(dltc.keras_model.inputs)
+
+        start = time.time()
+        dltc.keras_model.fit_generator(
+            FeatureSequence(x_inputs, y_matrix, batch_size=task['batch_size'],
+                            sample_weights=sample_weights, seed=task['seed'] + task['fold'],
+                            indices=train_indices),
+            epochs=task['epochs'],
+            shuffle=True,
+            verbose=0,
+        )
+        training_time = time.time() - start
+
+    start = time.time()
+    metrics = ClassificationMetrics(labels)
+    test_sequence = FeatureSequence(x_inputs, y_matrix, batch_size=CLASSIFY_BATCH_SIZE,
+                                    shuffle=False, indices=test_indices)
+    for i in range(len(test_sequence)):
+        x_batch, y_batch = test_sequence[i][:2]
+        metrics.update(y_batch, dltc._predict_matrix(x_batch[0]))
+    evaluation_time = time.time() - start
+
+    report = metrics.report(EVALUATION_THRESHOLD)
+    return {
+        'fold': task['fold'],
+        'train_samples': int(len(train_indices)),
+        'test_samples': int(len(test_indices)),
+        'accuracy': report['accuracy'],
+        'macro_f1': report['macro_f1'],
+        'labels': report['labels'],
+        'training_time': training_time,
+        'evaluation_time': evaluation_time,
+    }
@@ -0,0 +1,154 @@
+from __future__ import unicode_literals, division
+
+import hashlib
+import re
+import zlib
+from array import array
+
+import numpy as np
+
+from coffeehouse_dltc.config import DEDUP_THRESHOLD, DEDUP_PERMUTATIONS, DEDUP_BANDS, \
+    DEDUP_SHINGLE_SIZE
+
+DEDUP_MODES = ('none', 'exact', 'near')
+
+_whitespace_re = re.compile(r'\s+', re.UNICODE)
+
+
+def normalize(text):
+    """
+    Normalize a message before it is compared, case and runs of whitespace
+    are ignored
+    :param text: the message
+
+    :return: the normalized message
+    """
+    return _whitespace_re.sub(' ', text).strip().lower()
+
+
+class Deduplicator(object):
+    """ Detects duplicate messages in a stream, keeping the first message of
+     every cluster as its representative. Exact duplicates are found from a
+     hash of the normalized message. Near duplicates are found with MinHash
+     signatures of the character shingles and banded locality sensitive
+     hashing, candidates sharing a band are confirmed when the share of equal
+     signature values reaches the threshold. Memory grows with the number of
+     representatives, 4 bytes per permutation and a 16 byte hash each. """
+
+    def __init__(self, mode='exact', threshold=DEDUP_THRESHOLD, permutations=DEDUP_PERMUTATIONS,
+                 bands=DEDUP_BANDS, shingle_size=DEDUP_SHINGLE_SIZE, seed=1):
+        """
+        Public Constructor
+
+        :param mode: 'exact' or 'near', 'near' also removes exact duplicates
+        :param threshold: estimated Jaccard similarity of the shingles above
+        which two messages are near duplicates
+        :param permutations: number of hash functions of the signatures
+        :param bands: number of LSH bands, must divide permutations
+        :param shingle_size: number of characters per shingle
+        :param seed: seed of the hash functions
+        """
+        if mode not in ('exact', 'near'):
+            raise ValueError("Unknown deduplication mode: {}".format(mode))
+
+        if permutations % bands:
+            raise ValueError("The number of bands must divide the number of permutations")
+
+        self.mode = mode
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = permutations // bands
+        self.shingle_size = shingle_size
+
+        # Multiply-shift hashing, (a * x + b) mod 2^64 keeping the high 32 bits
+        random_state = np.random.RandomState(seed)
+        self.a = random_state.randint(0, 2 ** 62, permutations).astype(np.uint64) * np.uint64(2) \
+            + np.uint64(1)
+        self.b = random_state.randint(0, 2 ** 62, permutations).astype(np.uint64)
+
+        self.hashes = {}
+        self.buckets = [{} for _ in range(bands)]
+        self.signatures = np.zeros((1024, permutations), dtype=np.uint32)
+        self.weights = array('I')
+
+        self.exact_duplicates = 0
+        self.near_duplicates = 0
+
+    def check(self, text):
+        """
+        Check a message against the messages seen so far, a message which is
+        not a duplicate becomes the representative of a new cluster
+        :param text: the message
+
+        :return: tuple (kind, index) where kind is None for a new representative,
+        'exact' or 'near', and index is the index of the representative
+        """
+        normalized = normalize(text)
+        digest = hashlib.blake2b(normalized.encode('utf8'), digest_size=16).digest()
+
+        index = self.hashes.get(digest)
+        if index is not None:
+            self.weights[index] += 1
+            self.exact_duplicates += 1
+            return 'exact', index
+
+        signature = None
+        if self.mode == 'near' and normalized:
+            signature = self.signature(normalized)
+            index = self._find_near_duplicate(signature)
+            if index is not None:
+                self.weights[index] += 1
+                self.near_duplicates += 1
+                return 'near', index
+
+        index = len(self.weights)
+        self.hashes[digest] = index
+        self.weights.append(1)
+        if signature is not None:
+            self._add_signature(index, signature)
+
+        return None, index
+
+    def signature(self, normalized):
+        """
+        The MinHash signature of the character shingles of a normalized message
+        :param normalized: the normalized message
+
+        :return: numpy array of uint32 of length permutations
+        """
+        size = self.shingle_size
+        shingles = {normalized[i:i + size]
+                    for i in range(max(1, len(normalized) - size + 1))}
+        values = np.fromiter((zlib.crc32(s.encode('utf8')) for s in shingles),
+                             dtype=np.uint64, count=len(shingles))
+
+        hashed = (self.a[:, np.newaxis] * values[np.newaxis, :] + self.b[:, np.newaxis]) \
+            >> np.uint64(32)
+        return hashed.min(axis=1).astype(np.uint32)
+
+    def _band_keys(self, signature):
+        """ The LSH bucket key of every band of a signature """
+        return [signature[i * self.rows:(i + 1) * self.rows].tobytes() for i in range(self.bands)]
+
+    def _find_near_duplicate(self, signature):
+        """ The representative sharing a band and enough signature values, None if there is none """
+        candidates = set()
+        for band, key in enumerate(self._band_keys(signature)):
+            candidates.update(self.buckets[band].get(key, ()))
+
+        for index in sorted(candidates):
+            if np.mean(self.signatures[index] == signature) >= self.threshold:
+                return index
+
+        return None
+
+    def _add_signature(self, index, signature):
+        """ Store the signature of a representative and index its bands """
+        if index >= len(self.signatures):
+            grown = np.zeros((len(self.signatures) * 2, self.signatures.shape[1]), dtype=np.uint32)
+            grown[:len(self.signatures)] = self.signatures
+            self.signatures = grown
+        self.signatures[index] = signature
+
+        for band, key in enumerate(self._band_keys(signature)):
+            self.buckets[band].setdefault(key, []).append(index)
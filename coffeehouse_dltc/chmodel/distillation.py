@@ -0,0 +1,302 @@
+from __future__ import print_function, unicode_literals, division
+
+import json
+import os
+import shutil
+import time
+from os import path
+
+import numpy as np
+
+from coffeehouse_dltc.base.document import tokenize
+from coffeehouse_dltc.chmodel.ingestion import count_lines, iterate_lines
+from coffeehouse_dltc.config import BATCH_SIZE, SPLIT_SEED, FEATURE_CHUNK_SIZE, INSPECT_SAMPLES, \
+    DISTILLATION_ARCHITECTURE, DISTILLATION_EPOCHS, DISTILLATION_TEST_RATIO
+from coffeehouse_dltc.main import DLTC
+from coffeehouse_dltc.nn.models import get_nn_model
+
+
+class Distiller(object):
+    """ Trains a small student network on the soft sigmoid outputs of a built
+     model cluster (the teacher). The student reuses the word vectors, the
+     scaler and the tokenizer of the teacher, so only the network is replaced
+     and the result is a normal model cluster. """
+
+    def __init__(self, teacher_directory, configuration, architecture=DISTILLATION_ARCHITECTURE,
+                 unlabeled_files=None, epochs=DISTILLATION_EPOCHS, batch_size=BATCH_SIZE,
+                 test_ratio=DISTILLATION_TEST_RATIO, seed=SPLIT_SEED):
+        """
+        Public Constructor
+
+        :param teacher_directory: the directory of the built teacher model cluster
+        :param configuration: Configuration object of the source directory the
+        teacher was trained from, its .dat files are the transfer corpus
+        :param architecture: the student architecture e.g. 'mlp' or 'narrow-cnn'
+        :param unlabeled_files: paths of additional text files (one message per
+        line, optionally compressed) added to the transfer corpus
+        :param epochs: number of epochs to train the student
+        :param batch_size: size of one batch
+        :param test_ratio: the ratio of messages withheld to measure the agreement
+        :param seed: seed of the shuffle deciding which messages are withheld
+        """
+        self.teacher_directory = teacher_directory
+        self.configuration = configuration
+        self.architecture = architecture
+        self.unlabeled_files = list(unlabeled_files or [])
+        self.epochs = epochs
+        self.batch_size = batch_size
+        self.test_ratio = test_ratio
+        self.seed = seed
+
+        for filepath in self.unlabeled_files:
+            if not path.exists(filepath):
+                raise FileNotFoundError("The unlabeled file '{0}' was not found".format(filepath))
+
+        self.teacher = DLTC()
+        self.teacher.load_model_cluster(teacher_directory)
+
+        self.work_path = "{0}_distillation".format(configuration.src)
+        self.output_path = "{0}_student_build".format(teacher_directory.rstrip(os.sep)[:-6])
+
+    def run(self):
+        """
+        Build the transfer set, train the student, measure it against the
+        teacher and save it as a model cluster
+
+        :return: dictionary with the agreement and the speedup of the student
+        """
+        if path.exists(self.work_path):
+            shutil.rmtree(self.work_path)
+        os.mkdir(self.work_path)
+
+        print("Scoring the transfer corpus with the teacher")
+        transfer = self._build_transfer_set()
+        print("Transfer set: {0} training and {1} held-out messages".format(
+            len(transfer['y_train']), len(transfer['y_test'])))
+
+        student = DLTC(tokenizer=self.teacher.tokenizer)
+        student.labels = self.teacher.labels
+        student.word2vec_model = self.teacher.word2vec_model
+        student.scaler = self.teacher.scaler
+
+        print("Training the '{0}' student".format(self.architecture))
+        sample_length, embedding_size = self.teacher._input_shape()
+        with student.as_default():
+            student.keras_model = get_nn_model(
+                self.architecture,
+                embedding=embedding_size,
+                output_length=len(self.teacher.labels),
+                sample_length=sample_length
+            )
+            inputs = len(student.keras_model.inputs)
+
+            start = time.time()
+            student.keras_model.fit(
+                [transfer['x_train']] * inputs,
+                transfer['y_train'],
+                batch_size=self.batch_size,
+                epochs=self.epochs,
+                validation_data=([transfer['x_test']] * inputs, transfer['y_test']),
+                shuffle='batch',
+                verbose=2,
+            )
+            training_time = time.time() - start
+
+        report = self._measure(student, transfer)
+        report['architecture'] = self.architecture
+        report['training_time'] = training_time
+        report['teacher_directory'] = self.teacher_directory
+        report['model_directory'] = self.output_path
+
+        self._save_cluster(student)
+        report_path = "{0}_distillation.json".format(self.output_path)
+        with open(report_path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=4)
+        print("Created file '{0}'".format(report_path))
+
+        print("Cleaning up")
+        shutil.rmtree(self.work_path)
+
+        return report
+
+    def _sources(self):
+        """
+        The files of the transfer corpus
+
+        :return: list of paths, the labeled .dat files followed by the unlabeled files
+        """
+        return [self.configuration.classifications[label]
+                for label in self.configuration.classifier_labels()] + self.unlabeled_files
+
+    def _build_transfer_set(self):
+        """
+        Vectorize every message of the transfer corpus and score it with the
+        teacher in chunks, the matrices are written to memory-mapped files so
+        the corpus does not have to fit in memory
+
+        :return: dictionary with the train and test matrices and a sample of
+        held-out messages for the latency measurement
+        """
+        sources = self._sources()
+        total = sum(count_lines(source) for source in sources)
+        if total < 2:
+            raise ValueError("The transfer corpus needs at least 2 messages")
+
+        random_state = np.random.RandomState(self.seed)
+        withheld = np.zeros(total, dtype=np.bool_)
+        test_count = min(max(1, int(round(total * self.test_ratio))), total - 1)
+        withheld[random_state.permutation(total)[:test_count]] = True
+        # Keras only shuffles memory-mapped inputs in batch sized blocks, the train
+        # rows are written in a random order so that a block mixes the labels
+        train_order = random_state.permutation(total - test_count)
+        positions = np.where(withheld, np.cumsum(withheld) - 1,
+                             train_order[np.cumsum(~withheld) - 1])
+
+        sample_length, embedding_size = self.teacher._input_shape()
+        label_count = len(self.teacher.labels)
+        train_count = total - test_count
+
+        matrices = {}
+        for name, count in (('train', train_count), ('test', test_count)):
+            matrices['x_' + name] = np.lib.format.open_memmap(
+                path.join(self.work_path, "{0}_x.npy".format(name)), mode='w+',
+                dtype=np.float32, shape=(count, sample_length, embedding_size))
+            matrices['y_' + name] = np.zeros((count, label_count), dtype=np.float32)
+
+        sample_texts = []
+        vectorizer = self.teacher._get_vectorizer()
+
+        def flush(texts, indices):
+            x_chunk = np.zeros((len(texts), sample_length, embedding_size), dtype=np.float32)
+            for i, text in enumerate(texts):
+                words = tokenize(text, self.teacher.tokenizer, sample_length) if text else []
+                vectorizer.transform(words, sample_length, out=x_chunk[i])
+            y_chunk = self.teacher._predict_matrix(x_chunk)
+
+            indices = np.asarray(indices)
+            chunk_withheld = withheld[indices]
+            for name, mask in (('test', chunk_withheld), ('train', ~chunk_withheld)):
+                rows = positions[indices[mask]]
+                if len(rows):
+                    matrices['x_' + name][rows] = x_chunk[mask]
+                    matrices['y_' + name][rows] = y_chunk[mask]
+
+        index = 0
+        texts, indices = [], []
+        for source in sources:
+            for _, text in iterate_lines(source):
+                if text and withheld[index] and len(sample_texts) < INSPECT_SAMPLES:
+                    sample_texts.append(text)
+                texts.append(text)
+                indices.append(index)
+                index += 1
+
+                if len(texts) == FEATURE_CHUNK_SIZE:
+                    flush(texts, indices)
+                    texts, indices = [], []
+        if texts:
+            flush(texts, indices)
+
+        for name in ('train', 'test'):
+            matrices['x_' + name].flush()
+            matrices['x_' + name] = np.load(
+                path.join(self.work_path, "{0}_x.npy".format(name)), mmap_mode='r')
+
+        matrices['sample_texts'] = sample_texts
+        return matrices
+
+    def _measure(self, student, transfer):
+        """
+        Compare the student with the teacher on the held-out messages
+
+        :param student: the trained student DLTC
+        :param transfer: dictionary returned by _build_transfer_set
+        :return: dictionary with the agreement and the speedup
+        """
+        x_test, y_teacher = transfer['x_test'], transfer['y_test']
+
+        y_student = np.concatenate([
+            student._predict_matrix(np.asarray(x_test[i:i + self.batch_size]))
+            for i in range(0, len(x_test), self.batch_size)])
+
+        agreement = float(np.mean(np.argmax(y_student, axis=1) == np.argmax(y_teacher, axis=1)))
+        label_agreement = float(np.mean((y_student >= 0.5) == (y_teacher >= 0.5)))
+        mean_absolute_error = float(np.mean(np.abs(y_student - y_teacher)))
+
+        batch = np.asarray(x_test[:self.batch_size])
+        batched = {}
+        for name, dltc in (('teacher', self.teacher), ('student', student)):
+            dltc._predict_matrix(batch)
+            start = time.time()
+            for _ in range(10):
+                dltc._predict_matrix(batch)
+            batched[name] = (time.time() - start) / 10
+
+        student.warmup()
+        single = {}
+        for name, dltc in (('teacher', self.teacher), ('student', student)):
+            start = time.time()
+            for text in transfer['sample_texts']:
+                dltc.predict_from_text(text)
+            single[name] = (time.time() - start) / max(1, len(transfer['sample_texts']))
+
+        return {
+            'samples': int(len(y_teacher)),
+            'agreement': agreement,
+            'label_agreement': label_agreement,
+            'mean_absolute_error': mean_absolute_error,
+            'teacher_parameters': int(self.teacher.keras_model.count_params()),
+            'student_parameters': int(student.keras_model.count_params()),
+            'batch_size': int(len(batch)),
+            'teacher_batch_ms': batched['teacher'] * 1000,
+            'student_batch_ms': batched['student'] * 1000,
+            'batch_speedup': batched['teacher'] / batched['student'] if batched['student'] else 0.0,
+            'teacher_single_ms': single['teacher'] * 1000,
+            'student_single_ms': single['student'] * 1000,
+            'single_speedup': single['teacher'] / single['student'] if single['student'] else 0.0,
+        }
+
+    def _save_cluster(self, student):
+        """
+        Save the student as a model cluster next to the teacher
+
+        :param student: the trained student DLTC
+        :return: None
+        """
+        if path.exists(self.output_path):
+            shutil.rmtree(self.output_path)
+        os.mkdir(self.output_path)
+
+        cluster_files = DLTC.cluster_files(self.output_path)
+        student.save_word2vec_model(cluster_files['embeddings'])
+        student.save_scaler(cluster_files['scaler'])
+        student.save_model(cluster_files['model'])
+        with open(cluster_files['labels'], 'w', encoding='utf-8') as f:
+            json.dump(student.labels, f, ensure_ascii=False, indent=4)
+        student.save_cluster_config(cluster_files['cluster'])
+
+        for component in ('embeddings', 'scaler', 'model', 'labels', 'cluster'):
+            print("Created file '{0}'".format(cluster_files[component]))
+        print("Student model created at '{0}'".format(self.output_path))
+
+
+def print_distillation_report(report):
+    """
+    Print a distillation report in a readable form
+    :param report: dictionary returned by Distiller.run
+
+    :return: None
+    """
+    print(
+        "\n--- Distillation Report ---\n\n"
+        "   Student         : {architecture} ({student_parameters} parameters, "
+        "teacher {teacher_parameters})\n"
+        "   Held-out        : {samples}\n"
+        "   Agreement       : {agreement:.4f} (top label), {label_agreement:.4f} "
+        "(labels at 0.5)\n"
+        "   Mean abs. error : {mean_absolute_error:.4f}\n"
+        "   Batch of {batch_size:<6} : {teacher_batch_ms:.2f}ms -> {student_batch_ms:.2f}ms "
+        "({batch_speedup:.1f}x)\n"
+        "   Single message  : {teacher_single_ms:.2f}ms -> {student_single_ms:.2f}ms "
+        "({single_speedup:.1f}x)\n".format(**report)
+    )
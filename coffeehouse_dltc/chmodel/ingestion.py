@@ -0,0 +1,134 @@
+from __future__ import unicode_literals
+
+import bz2
+import gzip
+import io
+import lzma
+import os
+from array import array
+
+from coffeehouse_dltc.chmodel.dedup import Deduplicator
+from coffeehouse_dltc.config import INGESTION_BUFFER_SIZE, DEDUP_THRESHOLD
+
+COMPRESSED_OPENERS = {
+    '.gz': gzip.open,
+    '.bz2': bz2.open,
+    '.xz': lzma.open,
+}
+
+
+def open_classification_file(filepath):
+    """
+    Open a classification file for binary reading, .gz, .bz2 and .xz files
+    are decompressed on the fly
+    :param filepath: path to the .dat file
+
+    :return: binary file object
+    """
+    opener = COMPRESSED_OPENERS.get(os.path.splitext(filepath)[1].lower())
+    if opener:
+        return opener(filepath, 'rb')
+
+    return io.open(filepath, 'rb')
+
+
+def iterate_lines(filepath):
+    """
+    Stream the lines of a classification file with constant memory
+    :param filepath: path to the .dat file, optionally compressed
+
+    :return: generator of tuples (byte offset, line) where the offset is the
+    position of the line in the decompressed stream
+    """
+    offset = 0
+    with open_classification_file(filepath) as f:
+        for raw_line in f:
+            yield offset, raw_line.decode('utf8').rstrip('\r\n')
+            offset += len(raw_line)
+
+
+def count_lines(filepath):
+    """
+    Count the lines of a classification file without decoding them
+    :param filepath: path to the .dat file, optionally compressed
+
+    :return: the number of lines
+    """
+    count = 0
+    with open_classification_file(filepath) as f:
+        for _ in f:
+            count += 1
+
+    return count
+
+
+def ingest_classification(label, source_path, data_path, offsets_path, dedup='none',
+                          dedup_threshold=DEDUP_THRESHOLD, weights_path=None):
+    """
+    Write every line of a classification file as a document of the model
+    structure in a single pass. The byte offset of every document is appended
+    to offsets_path as unsigned 64 bit integers in native byte order, so it can
+    be read back with numpy.fromfile(offsets_path, dtype=numpy.uint64)
+    :param label: the label of the classification
+    :param source_path: path to the .dat file, optionally compressed
+    :param data_path: the model_data directory of the structure
+    :param offsets_path: path of the offsets file to write
+    :param dedup: 'none' writes every line, 'exact' skips lines equal to an
+    earlier line once case and whitespace are ignored, 'near' also skips lines
+    which are near duplicates of an earlier line
+    :param dedup_threshold: similarity above which two lines are near duplicates
+    :param weights_path: path of the file the number of lines every document
+    stands for is written to, as unsigned 32 bit integers in native byte order
+
+    :return: dictionary with the label, the source, the number of lines, the
+    number of documents written, the duplicates removed and the number of
+    (decompressed) bytes read
+    """
+    offsets = array('Q')
+    count = 0
+    lines = 0
+    offset = 0
+    deduplicator = Deduplicator(dedup, threshold=dedup_threshold) if dedup != 'none' else None
+
+    with open_classification_file(source_path) as source, open(offsets_path, 'wb') as offsets_file:
+        for raw_line in source:
+            value = raw_line.decode('utf8').rstrip('\r\n')
+            lines += 1
+
+            if deduplicator is not None and deduplicator.check(value)[0] is not None:
+                offset += len(raw_line)
+                continue
+
+            content_file_path = "{0}_{1}.txt".format(label, count)
+            label_file_path = "{0}_{1}.lab".format(label, count)
+            with open(os.path.join(data_path, content_file_path), "w", encoding="utf8") as content_file:
+                content_file.write(value)
+            with open(os.path.join(data_path, label_file_path), "w", encoding="utf8") as label_file:
+                label_file.write(label)
+
+            offsets.append(offset)
+            if len(offsets) == INGESTION_BUFFER_SIZE:
+                offsets_file.write(offsets.tobytes())
+                offsets = array('Q')
+
+            offset += len(raw_line)
+            count += 1
+
+        offsets_file.write(offsets.tobytes())
+
+    if weights_path:
+        weights = deduplicator.weights if deduplicator is not None else array('I', [1] * count)
+        with open(weights_path, 'wb') as weights_file:
+            weights_file.write(weights.tobytes())
+
+    return {
+        'label': label,
+        'source': source_path,
+        'lines': lines,
+        'documents': count,
+        'exact_duplicates': deduplicator.exact_duplicates if deduplicator is not None else 0,
+        'near_duplicates': deduplicator.near_duplicates if deduplicator is not None else 0,
+        'bytes': offset,
+        'offsets': offsets_path,
+        'weights': weights_path,
+    }
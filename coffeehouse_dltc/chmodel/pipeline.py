@@ -0,0 +1,148 @@
+from __future__ import print_function, unicode_literals, division
+
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from coffeehouse_dltc.config import PIPELINE_WORKERS
+
+
+class Pipeline(object):
+    """ Runs the stages of a build as a dependency graph. A stage starts as
+     soon as the stages it depends on finished, up to max_workers stages run
+     at once in threads. The heavy stages spend their time in gensim,
+     TensorFlow, numpy or worker processes, which release the GIL, so the
+     wall time of a build approaches its longest chain of dependent stages
+     instead of the sum of all of them. The first failing stage stops the
+     scheduling of new stages and its error is raised once the running ones
+     returned. """
+
+    def __init__(self, max_workers=PIPELINE_WORKERS):
+        """
+        Public Constructor
+
+        :param max_workers: number of stages run at once, 1 runs them one after
+        another in the order they were added
+        """
+        self.max_workers = max(1, max_workers)
+        self.stages = {}
+        self.order = []
+        self.results = {}
+        self.timings = {}
+        self.wall_time = None
+
+    def add(self, name, function, dependencies=(), after=()):
+        """
+        Add a stage, its dependencies have to be added first
+        :param name: the name of the stage, a valid Python identifier
+        :param function: called with the results of the dependencies as keyword
+        arguments named after them
+        :param dependencies: names of the stages which have to finish first and
+        whose results the function takes
+        :param after: names of the stages which have to finish first, their
+        results are not passed
+
+        :return: None
+        """
+        if name in self.stages:
+            raise ValueError("The stage '{0}' was already added".format(name))
+        for dependency in tuple(dependencies) + tuple(after):
+            if dependency not in self.stages:
+                raise ValueError("The stage '{0}' depends on the unknown stage '{1}'".format(
+                    name, dependency))
+
+        self.stages[name] = (function, tuple(dependencies), tuple(after))
+        self.order.append(name)
+
+    def run(self):
+        """
+        Run every stage
+
+        :return: dictionary with the result of every stage
+        """
+        start = time.time()
+        pending = list(self.order)
+        running = {}
+        error = None
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while pending or running:
+                if error is None:
+                    for name in [name for name in pending if self._ready(name)]:
+                        if len(running) >= self.max_workers:
+                            break
+                        pending.remove(name)
+                        running[executor.submit(self._run_stage, name)] = name
+
+                if not running:
+                    break
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        self.results[name] = future.result()
+                    except Exception as e:
+                        if error is None:
+                            print("Stage '{0}' failed, waiting for the running stages".format(name))
+                            error = e
+
+        if error is not None:
+            raise error
+
+        self.wall_time = time.time() - start
+        return self.results
+
+    def _ready(self, name):
+        """ Whether all the dependencies of a stage finished """
+        _, dependencies, after = self.stages[name]
+        return all(dependency in self.results for dependency in dependencies + after)
+
+    def _run_stage(self, name):
+        """ Run a stage with the results of its dependencies, runs in a worker thread """
+        function, dependencies, _ = self.stages[name]
+        start = time.time()
+        result = function(**{dependency: self.results[dependency] for dependency in dependencies})
+        self.timings[name] = (start, time.time())
+        return result
+
+    def critical_path(self):
+        """
+        The longest chain of dependent stages of the last run, the bound of
+        the wall time however many workers are used
+
+        :return: tuple (list of stage names, duration in seconds)
+        """
+        longest = {}
+        for name in self.order:
+            _, dependencies, after = self.stages[name]
+            duration = self.timings[name][1] - self.timings[name][0]
+            previous = max((longest[dependency] for dependency in dependencies + after),
+                           key=lambda chain: chain[1], default=([], 0.0))
+            longest[name] = (previous[0] + [name], previous[1] + duration)
+
+        return max(longest.values(), key=lambda chain: chain[1])
+
+
+def print_pipeline(pipeline):
+    """
+    Print the duration of every stage of a finished pipeline
+    :param pipeline: Pipeline object which ran
+
+    :return: None
+    """
+    start = min(pipeline.timings[name][0] for name in pipeline.order)
+    print("\n--- Build Pipeline ({0} workers) ---\n".format(pipeline.max_workers))
+    print("   STAGE                 START     DURATION")
+    for name in pipeline.order:
+        started, finished = pipeline.timings[name]
+        print("   {0:<20}  {1:>7.1f}s  {2:>8.1f}s".format(name, started - start, finished - started))
+
+    path, duration = pipeline.critical_path()
+    stage_time = sum(finished - started for started, finished in
+                     (pipeline.timings[name] for name in pipeline.order))
+    print(
+        "\n   Wall time       : {0:.1f}s\n"
+        "   Sum of stages   : {1:.1f}s\n"
+        "   Critical path   : {2:.1f}s ({3})\n".format(
+            pipeline.wall_time, stage_time, duration, ' -> '.join(path))
+    )
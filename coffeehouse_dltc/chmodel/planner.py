@@ -0,0 +1,289 @@
+from __future__ import print_function, unicode_literals, division
+
+import io
+import os
+import shutil
+
+import random
+
+import numpy as np
+
+from coffeehouse_dltc.base.document import Document
+from coffeehouse_dltc.config import SAMPLE_LENGTH, MEMORY_BUDGET_FRACTION, DISK_HEADROOM, \
+    SAMPLE_LENGTH_PERCENTILE, SAMPLE_LENGTH_DOCUMENTS, SAMPLE_LENGTH_MULTIPLE, \
+    SAMPLE_LENGTH_MIN, SAMPLE_LENGTH_MAX, SPLIT_SEED
+
+TRAINING_MODES = ('memory', 'memmap', 'streaming')
+
+SIZE_SUFFIXES = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+
+
+def parse_size(size):
+    """
+    Parse a size in bytes, given as a number or a string with a K, M, G or T
+    suffix such as '512M' or '8G'
+    :param size: the size to parse
+
+    :return: the size in bytes as an integer
+    """
+    if isinstance(size, (int, float)):
+        return int(size)
+
+    value = size.strip().upper().rstrip('B')
+    multiplier = 1
+    if value and value[-1] in SIZE_SUFFIXES:
+        multiplier = SIZE_SUFFIXES[value[-1]]
+        value = value[:-1]
+
+    try:
+        return int(float(value) * multiplier)
+    except ValueError:
+        raise ValueError("Invalid size: {}".format(size))
+
+
+def detect_memory_budget(fraction=MEMORY_BUDGET_FRACTION):
+    """
+    Detect how much memory the features may use, a fraction of the memory
+    available to the process. The cgroup limit is honored when running in a container
+    :param fraction: the share of the available memory given to the features
+
+    :return: tuple (budget in bytes, description of the source) or
+    (None, reason) when the available memory can not be detected
+    """
+    available = _meminfo_available()
+    limit = _cgroup_limit()
+
+    if available is None and limit is None:
+        return None, 'not detected'
+
+    if limit is not None and (available is None or limit < available):
+        return int(limit * fraction), 'cgroup limit x {0}'.format(fraction)
+
+    return int(available * fraction), 'available memory x {0}'.format(fraction)
+
+
+def choose_sample_length(data_dir, percentile=SAMPLE_LENGTH_PERCENTILE, tokenizer=None,
+                         documents=SAMPLE_LENGTH_DOCUMENTS, seed=SPLIT_SEED,
+                         minimum=SAMPLE_LENGTH_MIN, maximum=SAMPLE_LENGTH_MAX):
+    """
+    Choose the number of words the network reads per document from the token
+    counts of the corpus, so short messages are not padded to a length only
+    long documents reach. A random sample of the documents is tokenized, no
+    further than maximum words
+    :param data_dir: directory with the '.txt' files
+    :param percentile: the share of the documents, in percent, which are read
+    in full
+    :param tokenizer: name of the tokenizer backend, None uses the default one
+    :param documents: number of documents tokenized at most
+    :param seed: seed of the sample of the documents
+    :param minimum: the shortest length chosen, at least the widest convolution
+    :param maximum: the longest length chosen
+
+    :return: dictionary with the chosen 'sample_length' and the token counts it
+    was chosen from
+    """
+    files = sorted({filename[:-4] for filename in os.listdir(data_dir)})
+    if len(files) > documents:
+        files = sorted(random.Random(seed).sample(files, documents))
+
+    lengths = np.array([len(Document(0, os.path.join(data_dir, fname + '.txt'),
+                                     tokenizer=tokenizer).get_all_words(limit=maximum))
+                        for fname in files], dtype=np.int64)
+    if not len(lengths):
+        raise ValueError("There are no documents in '{0}' to choose a sample length from".format(
+            data_dir))
+
+    length = int(np.ceil(np.percentile(lengths, percentile)))
+    length = -(-length // SAMPLE_LENGTH_MULTIPLE) * SAMPLE_LENGTH_MULTIPLE
+    length = min(max(length, minimum), maximum)
+
+    return {
+        'sample_length': length,
+        'percentile': percentile,
+        'documents': int(len(lengths)),
+        'p50': float(np.percentile(lengths, 50)),
+        'p90': float(np.percentile(lengths, 90)),
+        'p99': float(np.percentile(lengths, 99)),
+        'max': int(lengths.max()),
+        'truncated': float(np.mean(lengths > length)),
+        'padding': float(1.0 - np.mean(np.minimum(lengths, length)) / length),
+    }
+
+
+def print_sample_length(choice):
+    """
+    Print how a sample length was chosen
+    :param choice: dictionary returned by choose_sample_length
+
+    :return: None
+    """
+    print(
+        "\n--- Sample Length ---\n\n"
+        "   Documents       : {documents}\n"
+        "   Tokens          : p50 {p50:.0f}, p90 {p90:.0f}, p99 {p99:.0f}, max {max}\n"
+        "   Sample length   : {sample_length} (p{percentile} rounded up)\n"
+        "   Truncated       : {truncated:.1%} of the documents\n"
+        "   Padding         : {padding:.1%} of the positions\n".format(**choice)
+    )
+
+
+def estimate_feature_bytes(samples, vec_dim, labels, sample_length=SAMPLE_LENGTH, postings=None):
+    """
+    Estimate the size of the feature matrices of a corpus
+    :param samples: number of documents
+    :param vec_dim: dimensionality of the word vectors
+    :param labels: number of labels
+    :param sample_length: number of words kept per document
+    :param postings: number of (document, label) pairs when the targets are
+    kept sparse, None estimates a dense y matrix
+
+    :return: size in bytes of the X (float32) and y (bool, or CSR) matrices
+    """
+    x_bytes = samples * sample_length * vec_dim * np.dtype(np.float32).itemsize
+    if postings is None:
+        y_bytes = samples * labels * np.dtype(np.bool_).itemsize
+    else:
+        y_bytes = (samples + 1) * np.dtype(np.int32).itemsize + \
+            postings * (np.dtype(np.int32).itemsize + np.dtype(np.bool_).itemsize)
+    return x_bytes + y_bytes
+
+
+def plan_training(samples, vec_dim, labels, feature_dir, memory_budget=None,
+                  mode='auto', sample_length=SAMPLE_LENGTH, postings=None):
+    """
+    Decide how the features are held during training. 'memory' builds the
+    matrices in memory, 'memmap' builds them once into memory-mapped files
+    in feature_dir and 'streaming' rebuilds every batch from the documents in
+    every epoch, which needs neither memory nor disk for the features
+    :param samples: number of documents
+    :param vec_dim: dimensionality of the word vectors
+    :param labels: number of labels
+    :param feature_dir: directory the memory-mapped features would be written to
+    :param memory_budget: memory the features may use in bytes (or a string
+    such as '8G'), None detects it
+    :param mode: 'auto' or one of TRAINING_MODES to force a mode
+    :param sample_length: number of words kept per document
+    :param postings: number of (document, label) pairs when the targets are
+    kept sparse, None plans for a dense y matrix
+
+    :return: dictionary describing the decision
+    """
+    if mode != 'auto' and mode not in TRAINING_MODES:
+        raise ValueError("Unknown training mode: {0}, expected 'auto' or one of {1}".format(
+            mode, ', '.join(TRAINING_MODES)))
+
+    if memory_budget is None:
+        budget, budget_source = detect_memory_budget()
+    else:
+        budget, budget_source = parse_size(memory_budget), 'configured'
+
+    feature_bytes = estimate_feature_bytes(samples, vec_dim, labels, sample_length, postings)
+    disk_free = _disk_free(feature_dir)
+
+    if mode != 'auto':
+        reason = 'forced by the training properties'
+    elif budget is None or feature_bytes <= budget:
+        mode = 'memory'
+        reason = 'the features fit in the memory budget' if budget is not None \
+            else 'the memory budget could not be detected'
+    elif disk_free is not None and feature_bytes * DISK_HEADROOM <= disk_free:
+        mode = 'memmap'
+        reason = 'the features exceed the memory budget but fit on disk'
+    else:
+        mode = 'streaming'
+        reason = 'the features exceed the memory budget and the free disk space'
+
+    return {
+        'mode': mode,
+        'reason': reason,
+        'samples': samples,
+        'vec_dim': vec_dim,
+        'labels': labels,
+        'sparse_targets': postings is not None,
+        'sample_length': sample_length,
+        'feature_bytes': feature_bytes,
+        'memory_budget': budget,
+        'memory_budget_source': budget_source,
+        'disk_free': disk_free,
+        'feature_dir': feature_dir,
+    }
+
+
+def print_plan(plan):
+    """
+    Print a training plan in a readable form
+    :param plan: dictionary returned by plan_training
+
+    :return: None
+    """
+    print(
+        "\n--- Training Plan ---\n\n"
+        "   Samples         : {0}\n"
+        "   Features        : {1} ({0} x {2} x {3} float32)\n"
+        "   Targets         : {9} labels, {10}\n"
+        "   Memory budget   : {4} ({5})\n"
+        "   Free disk       : {6}\n"
+        "   Mode            : {7}, {8}\n".format(
+            plan['samples'],
+            _gigabytes(plan['feature_bytes']),
+            plan['sample_length'],
+            plan['vec_dim'],
+            _gigabytes(plan['memory_budget']),
+            plan['memory_budget_source'],
+            _gigabytes(plan['disk_free']),
+            plan['mode'],
+            plan['reason'],
+            plan['labels'],
+            'sparse' if plan['sparse_targets'] else 'dense',
+        )
+    )
+
+
+def _gigabytes(size):
+    """ Format a size in bytes for the plan """
+    if size is None:
+        return 'n/a'
+    return '{0:.2f} GB'.format(size / 1024 ** 3)
+
+
+def _meminfo_available():
+    """ MemAvailable of /proc/meminfo in bytes, None where it is not available """
+    try:
+        with io.open('/proc/meminfo', 'r') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except (IOError, OSError, ValueError):
+        pass
+
+    return None
+
+
+def _cgroup_limit():
+    """ The memory limit of the cgroup (v2 or v1) in bytes, None when unlimited """
+    for limit_path in ('/sys/fs/cgroup/memory.max',
+                       '/sys/fs/cgroup/memory/memory.limit_in_bytes'):
+        try:
+            with io.open(limit_path, 'r') as f:
+                value = f.read().strip()
+        except (IOError, OSError):
+            continue
+
+        # v1 reports "unlimited" as a huge page-aligned number
+        if value.isdigit() and int(value) < 2 ** 60:
+            return int(value)
+        return None
+
+    return None
+
+
+def _disk_free(directory):
+    """ Free space of the file system of a directory (or its closest existing parent) """
+    directory = os.path.abspath(directory)
+    while not os.path.exists(directory):
+        parent = os.path.dirname(directory)
+        if parent == directory:
+            return None
+        directory = parent
+
+    return shutil.disk_usage(directory).free
@@ -0,0 +1,288 @@
+from __future__ import print_function, unicode_literals, division
+
+import io
+import itertools
+import json
+import multiprocessing
+import os
+import random
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor
+from os import path
+
+import numpy as np
+
+from coffeehouse_dltc.main import DLTC
+from coffeehouse_dltc.config import SWEEP_PROCESSES, SWEEP_THREADS, SWEEP_TEST_RATIO, \
+    SWEEP_LATENCY_SAMPLES, SPLIT_SEED, SCALER_FIT_MODE, WORD2VEC_WORKERS, TOKENIZER, \
+    EVALUATION_THRESHOLD
+from coffeehouse_dltc.nn.input_data import build_x_and_y, stratified_split
+from coffeehouse_dltc.nn.metrics import ClassificationMetrics
+from coffeehouse_dltc.nn.models import get_nn_model
+from coffeehouse_dltc.nn.session import configure_threads, thread_environment
+from coffeehouse_dltc.nn.vectorizer import WordVectorizer
+
+SWEEP_PARAMETERS = ('architecture', 'vec_dim', 'batch_size', 'epoch')
+
+
+class Sweep(object):
+    """ Trains every combination of a hyperparameter grid and ranks the results.
+     The structure and the tokenized corpus file are built once, the word
+     vectors, the scaler and the feature matrices once per vec_dim and shared
+     by all the trials using it. """
+
+    def __init__(self, configuration):
+        """
+        Public Constructor
+
+        :param configuration: Configuration object of the source directory
+        """
+        self.configuration = configuration
+        self.training_properties = configuration.configuration['training_properties']
+
+        if 'sweep' not in configuration.configuration:
+            raise ValueError("The configuration does not define a 'sweep' section")
+
+        self.sweep = configuration.configuration['sweep']
+        self.grid = self.sweep.get('grid', {})
+
+        for parameter in self.grid:
+            if parameter not in SWEEP_PARAMETERS:
+                raise ValueError("Unknown sweep parameter '{0}', expected one of {1}".format(
+                    parameter, ', '.join(SWEEP_PARAMETERS)))
+
+        self.processes = self.sweep.get('processes', SWEEP_PROCESSES)
+        self.threads = self.sweep.get('threads', SWEEP_THREADS)
+        self.test_ratio = self.training_properties.get('test_ratio') or SWEEP_TEST_RATIO
+        self.tokenizer = self.training_properties.get('tokenizer', TOKENIZER)
+        self.output_path = "{0}_sweep".format(configuration.src)
+        self.split_seed = self.training_properties.get('split_seed', SPLIT_SEED)
+        self.sample_length = None
+
+    def trials(self):
+        """
+        Expand the grid into the list of trials, parameters which are not part
+        of the grid are taken from the training properties
+
+        :return: list of dictionaries with the trial parameters
+        """
+        values = []
+        for parameter in SWEEP_PARAMETERS:
+            if parameter in self.grid:
+                values.append(list(self.grid[parameter]))
+            else:
+                values.append([self.training_properties[parameter]])
+
+        return [dict(zip(SWEEP_PARAMETERS, combination))
+                for combination in itertools.product(*values)]
+
+    def run(self):
+        """
+        Run the sweep and write the leaderboard
+
+        :return: list of trial results sorted from best to worst
+        """
+        trials = self.trials()
+        print("Sweeping {0} trials over {1} processes".format(len(trials), self.processes))
+
+        if path.exists(self.output_path):
+            shutil.rmtree(self.output_path)
+        os.mkdir(self.output_path)
+
+        directory_structure = self.configuration.create_structure()
+        data_dir = path.join(directory_structure, 'model_data')
+        train_files, test_files = stratified_split(
+            {filename[:-4] for filename in os.listdir(data_dir)}, data_dir, self.test_ratio,
+            seed=self.split_seed)
+        labels = self.configuration.classifier_labels()
+        self.sample_length = self.configuration.sample_length(directory_structure)
+
+        # Build the artifacts every trial with the same vec_dim depends on
+        artifacts = {}
+        for vec_dim in sorted({trial['vec_dim'] for trial in trials}):
+            artifacts[vec_dim] = self._prepare_artifacts(
+                data_dir, vec_dim, labels, train_files, test_files)
+
+        for trial_id, trial in enumerate(trials):
+            trial['trial'] = trial_id
+            trial.update(artifacts[trial['vec_dim']])
+            trial['labels'] = labels
+            trial['threads'] = self.threads
+            trial['tokenizer'] = self.tokenizer
+            trial['sample_length'] = self.sample_length
+
+        results = []
+        context = multiprocessing.get_context('spawn')
+        with thread_environment(self.threads), \
+                ProcessPoolExecutor(max_workers=self.processes, mp_context=context,
+                                    initializer=configure_threads,
+                                    initargs=(self.threads, 1)) as executor:
+            for result in executor.map(_run_trial, trials):
+                print("Trial {trial}: {architecture} vec_dim={vec_dim} batch_size={batch_size} "
+                      "epoch={epoch} macro_f1={macro_f1:.4f} accuracy={accuracy:.4f} "
+                      "training_time={training_time:.1f}s "
+                      "latency={latency_ms:.2f}ms".format(**result))
+                results.append(result)
+
+        results.sort(key=lambda r: (-r['macro_f1'], r['latency_ms'], r['training_time']))
+        self._write_leaderboard(results)
+
+        print("Cleaning up")
+        shutil.rmtree(directory_structure)
+        for artifact in artifacts.values():
+            shutil.rmtree(artifact['artifact_path'])
+
+        return results
+
+    def _prepare_artifacts(self, data_dir, vec_dim, labels, train_files, test_files):
+        """
+        Train the word vectors and the scaler for a vec_dim and build the
+        train and test matrices into .npy files the trials can memory-map
+
+        :return: dictionary of paths to the artifacts
+        """
+        artifact_path = path.join(self.output_path, "vec_{0}".format(vec_dim))
+        os.mkdir(artifact_path)
+
+        print("Creating word to vectors model (vec_dim={0})".format(vec_dim))
+        dltc = DLTC(tokenizer=self.tokenizer)
+        dltc.train_word2vec(
+            data_dir,
+            vec_dim=vec_dim,
+            workers=self.training_properties.get('word2vec_workers', WORD2VEC_WORKERS),
+            corpus_file=self.configuration.corpus_file(path.dirname(data_dir)),
+            **self.configuration.pretrained_vectors()
+        )
+        print("Fitting Scalers")
+        dltc.fit_scaler(data_dir, mode=self.training_properties.get('scaler_fit',
+                                                                    SCALER_FIT_MODE))
+
+        artifacts = {
+            'artifact_path': artifact_path,
+            'data_dir': data_dir,
+            'embeddings_path': path.join(artifact_path, 'embeddings.che'),
+            'scaler_path': path.join(artifact_path, 'scaler.chs'),
+            'x_train_path': path.join(artifact_path, 'x_train.npy'),
+            'y_train_path': path.join(artifact_path, 'y_train.npy'),
+            'x_test_path': path.join(artifact_path, 'x_test.npy'),
+            'y_test_path': path.join(artifact_path, 'y_test.npy'),
+            'test_files': test_files[:SWEEP_LATENCY_SAMPLES],
+        }
+        dltc.save_word2vec_model(artifacts['embeddings_path'])
+        dltc.save_scaler(artifacts['scaler_path'])
+
+        print("Building feature matrices (vec_dim={0})".format(vec_dim))
+        kwargs = dict(
+            label_indices={lab: i for i, lab in enumerate(labels)},
+            word2vec_model=dltc.word2vec_model,
+            scaler=dltc.scaler,
+            nn_model=None,
+            vectorizer=WordVectorizer(dltc.word2vec_model, dltc.scaler),
+            tokenizer=self.tokenizer,
+            sample_length=self.sample_length,
+        )
+        # The trials shuffle the memory-mapped rows in batch sized blocks, the train
+        # rows are written in a random order so that a block mixes the labels
+        train_files = list(train_files)
+        random.Random(self.split_seed).shuffle(train_files)
+        for files, x_path, y_path in ((train_files, 'x_train_path', 'y_train_path'),
+                                      (test_files, 'x_test_path', 'y_test_path')):
+            [x_matrix], y_matrix = build_x_and_y(files, data_dir, **kwargs)
+            np.save(artifacts[x_path], x_matrix)
+            np.save(artifacts[y_path], y_matrix)
+
+        return artifacts
+
+    def _write_leaderboard(self, results):
+        """
+        Print the leaderboard and write it to leaderboard.json
+
+        :param results: list of trial results sorted from best to worst
+        :return: None
+        """
+        leaderboard_path = path.join(self.output_path, 'leaderboard.json')
+        with open(leaderboard_path, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=4)
+
+        print(
+            "\n--- Sweep Leaderboard ---\n\n"
+            "   RANK  ARCHITECTURE  VEC_DIM  BATCH_SIZE  EPOCH  MACRO_F1  ACCURACY  TRAINING_TIME"
+            "  LATENCY"
+        )
+        for rank, result in enumerate(results, 1):
+            print("   {0:<4}  {architecture:<12}  {vec_dim:<7}  {batch_size:<10}  {epoch:<5}  "
+                  "{macro_f1:<8.4f}  {accuracy:<8.4f}  {training_time:>12.1f}s  "
+                  "{latency_ms:>5.2f}ms".format(
+                      rank, **result))
+        print("\nLeaderboard written to '{0}'".format(leaderboard_path))
+
+
+def _run_trial(trial):
+    """
+    Train and measure a single trial, runs inside a worker process
+
+    :param trial: dictionary of the trial parameters and artifact paths
+    :return: dictionary with the trial parameters and its measurements
+    """
+    labels = trial['labels']
+    x_train = np.load(trial['x_train_path'], mmap_mode='r')
+    y_train = np.load(trial['y_train_path'])
+    x_test = np.load(trial['x_test_path'], mmap_mode='r')
+    y_test = np.load(trial['y_test_path'])
+
+    dltc = DLTC(intra_op_threads=trial['threads'], inter_op_threads=1,
+                tokenizer=trial['tokenizer'])
+    dltc.labels = labels
+    dltc.load_word2vec_model(trial['embeddings_path'])
+    dltc.load_scaler(trial['scaler_path'])
+
+    with dltc.as_default():
+        dltc.keras_model = get_nn_model(
+            trial['architecture'],
+            embedding=trial['vec_dim'],
+            output_length=len(labels),
+            sample_length=trial['sample_length']
+        )
+        inputs = len(dltc.keras_model.inputs)
+
+        start = time.time()
+        dltc.keras_model.fit(
+            [x_train] * inputs,
+            y_train,
+            batch_size=trial['batch_size'],
+            epochs=trial['epoch'],
+            validation_data=([x_test] * inputs, y_test),
+            shuffle='batch',
+            verbose=0,
+        )
+        training_time = time.time() - start
+
+        y_predicted = dltc.keras_model.predict([x_test] * inputs, batch_size=trial['batch_size'])
+
+    # The same multi-label evaluation as the cross validation
+    metrics = ClassificationMetrics(labels)
+    metrics.update(y_test, y_predicted)
+    report = metrics.report(EVALUATION_THRESHOLD)
+    dltc.warmup()
+
+    # End to end latency of a single message, including tokenization
+    latencies = []
+    for fname in trial['test_files']:
+        with io.open(path.join(trial['data_dir'], fname + '.txt'), 'r', encoding='utf-8') as f:
+            text = f.read() or ' '
+        start = time.time()
+        dltc.predict_from_text(text)
+        latencies.append(time.time() - start)
+
+    return {
+        'trial': trial['trial'],
+        'architecture': trial['architecture'],
+        'vec_dim': trial['vec_dim'],
+        'batch_size': trial['batch_size'],
+        'epoch': trial['epoch'],
+        'macro_f1': report['macro_f1'],
+        'accuracy': report['accuracy'],
+        'training_time': training_time,
+        'latency_ms': float(np.median(latencies)) * 1000 if latencies else 0.0,
+    }
@@ -0,0 +1,187 @@
+from __future__ import print_function, unicode_literals, division
+
+import json
+import multiprocessing
+import sys
+import time
+from collections import deque
+from functools import partial
+
+from coffeehouse_dltc.base.document import tokenize
+from coffeehouse_dltc.config import CLASSIFY_BATCH_SIZE, CLASSIFY_WORKERS, \
+    CLASSIFY_CHUNK_SIZE, CLASSIFY_PREFETCH
+from coffeehouse_dltc.main import DLTC
+
+
+class StreamClassifier(object):
+    """ Classifies newline-delimited text or JSONL records from a stream and
+     writes one JSON result per record, in input order. The input is read in
+     fixed size chunks, tokenization of the next chunks runs in worker processes
+     while the network scores the current one, so memory use only depends on
+     the chunk size and not on the size of the input. """
+
+    def __init__(self, model_directory, batch_size=CLASSIFY_BATCH_SIZE,
+                 workers=CLASSIFY_WORKERS, chunk_size=CLASSIFY_CHUNK_SIZE,
+                 prefetch=CLASSIFY_PREFETCH, top_n=None, text_field='text'):
+        """
+        Public Constructor
+
+        :param model_directory: the directory of the built model cluster
+        :param batch_size: number of documents sent to the network at once
+        :param workers: number of tokenization processes
+        :param chunk_size: number of records read from the input at once
+        :param prefetch: number of chunks tokenized ahead of the network
+        :param top_n: only output the N most likely labels, None outputs all of them
+        :param text_field: the field holding the text in JSONL records
+        """
+        self.batch_size = batch_size
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.prefetch = prefetch
+        self.top_n = top_n
+        self.text_field = text_field
+
+        # The workers are forked before the session of the cluster and its thread
+        # pools exist. TensorFlow is already imported at this point, the workers
+        # only tokenize and never use it
+        self.pool = multiprocessing.get_context('fork').Pool(workers)
+
+        try:
+            self.dltc = DLTC()
+            self.dltc.load_model_cluster(model_directory)
+        except Exception:
+            self.pool.terminate()
+            self.pool.join()
+            raise
+
+    def close(self):
+        """ Stop the tokenization workers """
+        self.pool.close()
+        self.pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def classify(self, input_stream, output_stream):
+        """
+        Classify every record of the input stream
+        :param input_stream: file object yielding one record per line
+        :param output_stream: file object the JSONL results are written to
+
+        :return: the number of records classified
+        """
+        total = 0
+        start = time.time()
+
+        for record_ids, y_predicted in self.score(self._read_records(input_stream)):
+            for record_id, scores in zip(record_ids, y_predicted):
+                ranked = sorted(zip(self.dltc.labels, scores.tolist()),
+                                key=lambda elem: elem[1], reverse=True)[:self.top_n]
+                result = {
+                    'labels': [label for label, _ in ranked],
+                    'scores': [score for _, score in ranked],
+                }
+                if record_id is not None:
+                    result['id'] = record_id
+                output_stream.write(json.dumps(result, ensure_ascii=False) + '\n')
+
+            total += len(record_ids)
+            if total % self.chunk_size < len(record_ids):
+                output_stream.flush()
+                print("Classified {0} records ({1:.0f}/s)".format(
+                    total, total / (time.time() - start)), file=sys.stderr)
+
+        output_stream.flush()
+        print("Classified {0} records in {1:.1f}s".format(total, time.time() - start),
+              file=sys.stderr)
+        return total
+
+    def score(self, records):
+        """
+        Score (key, text) records in batches, keeping the input order
+        :param records: iterable of (key, text) tuples, the key is passed through
+
+        :return: generator of tuples (list of keys, numpy array of shape
+        (batch, labels) with the confidence of every label in the order of dltc.labels)
+        """
+        pending = deque()
+        sample_length, _ = self.dltc._input_shape()
+        tokenize_texts = partial(_tokenize_texts, tokenizer=self.dltc.tokenizer,
+                                 limit=sample_length)
+
+        for chunk in _chunks(records, self.chunk_size):
+            texts = [text for _, text in chunk]
+            pending.append((chunk, self.pool.map_async(
+                tokenize_texts, _split(texts, self.workers))))
+
+            if len(pending) > self.prefetch:
+                for batch in self._score_chunk(*pending.popleft()):
+                    yield batch
+
+        while pending:
+            for batch in self._score_chunk(*pending.popleft()):
+                yield batch
+
+    def _score_chunk(self, chunk, async_result):
+        """
+        Wait for the tokens of a chunk and score them in batches
+
+        :param chunk: list of (key, text) tuples
+        :param async_result: AsyncResult of the tokenization of the chunk
+        :return: generator of tuples (list of keys, numpy array of scores)
+        """
+        tokens = [words for part in async_result.get() for words in part]
+
+        for i in range(0, len(tokens), self.batch_size):
+            keys = [key for key, _ in chunk[i:i + self.batch_size]]
+            yield keys, self.dltc.predict_tokens(tokens[i:i + self.batch_size])
+
+    def _read_records(self, input_stream):
+        """
+        Parse the input into (id, text) records. Lines which are JSON objects
+        are read as JSONL records, any other line is the text itself
+
+        :param input_stream: file object yielding one record per line
+        :return: generator of (id, text) tuples
+        """
+        for line in input_stream:
+            line = line.rstrip('\r\n')
+            record_id, text = None, line
+
+            if line.lstrip().startswith('{'):
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    record = None
+                if isinstance(record, dict):
+                    record_id = record.get('id')
+                    text = record.get(self.text_field) or ''
+
+            yield record_id, text
+
+
+def _chunks(items, size):
+    """ Group an iterable into lists of a fixed size """
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+
+    if chunk:
+        yield chunk
+
+
+def _split(items, parts):
+    """ Split a list into contiguous parts of about the same size """
+    size = max(1, -(-len(items) // parts))
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def _tokenize_texts(texts, tokenizer=None, limit=None):
+    """ Tokenize a list of texts, runs inside the worker processes """
+    return [tokenize(text, tokenizer, limit) if text else [] for text in texts]
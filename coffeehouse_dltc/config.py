@@ -14,4 +14,124 @@ BATCH_SIZE = 64
 EPOCHS = 1
 
 # Number of tokens to save from the abstract, zero padded
-SAMPLE_LENGTH = 200
\ No newline at end of file
+SAMPLE_LENGTH = 200
+# A sample_length of 'auto' covers this percentile of the token counts of up
+# to SAMPLE_LENGTH_DOCUMENTS documents, rounded up to a multiple of
+# SAMPLE_LENGTH_MULTIPLE and kept within the bounds
+SAMPLE_LENGTH_PERCENTILE = 95
+SAMPLE_LENGTH_DOCUMENTS = 5000
+SAMPLE_LENGTH_MULTIPLE = 8
+SAMPLE_LENGTH_MIN = 8
+SAMPLE_LENGTH_MAX = 1000
+
+# Checkpointing, save the model every N epochs and keep the last N files
+CHECKPOINT_PERIOD = 1
+CHECKPOINT_KEEP = 1
+
+# Early stopping
+EARLY_STOPPING_MONITOR = 'val_loss'
+
+# Hyperparameter sweep, number of trials run at once and threads per trial
+SWEEP_PROCESSES = 2
+SWEEP_THREADS = 1
+SWEEP_TEST_RATIO = 0.2
+SWEEP_LATENCY_SAMPLES = 100
+
+# Bulk classification, documents per network call, tokenization processes,
+# records read at once and chunks tokenized ahead of the network
+CLASSIFY_BATCH_SIZE = 256
+CLASSIFY_WORKERS = 4
+CLASSIFY_CHUNK_SIZE = 4096
+CLASSIFY_PREFETCH = 2
+
+# Evaluation, labels scored at or above the threshold are predicted and the
+# threshold curves are computed on a grid of 1 / EVALUATION_BINS
+EVALUATION_THRESHOLD = 0.5
+EVALUATION_BINS = 100
+
+# Seed of the shuffle deciding which samples are withheld for testing
+SPLIT_SEED = 0
+
+# 'vocabulary' fits the scaler from the word2vec counts, 'corpus' re-reads the documents
+SCALER_FIT_MODE = 'vocabulary'
+
+# 'corpus_file' tokenizes the documents once into a line-sentence file gensim
+# reads from every worker, 'iterator' feeds gensim from a single Python iterator
+WORD2VEC_INPUT = 'corpus_file'
+# Documents handed to a tokenization process at once
+WORD2VEC_CHUNK_SIZE = 64
+
+# Pretrained word vectors, 'frozen' or 'fine_tune' and the passes over the
+# corpus after the initialization
+PRETRAINED_MODE = 'fine_tune'
+PRETRAINED_EPOCHS = 1
+
+# Ingestion, labels processed in parallel and byte offsets buffered per write
+INGESTION_WORKERS = 4
+INGESTION_BUFFER_SIZE = 65536
+
+# Tokenizer backend, nltk (Punkt + Treebank) or regex (single precompiled expression)
+TOKENIZER = 'nltk'
+
+# Cluster inspection, number of messages timed and words per generated message
+INSPECT_SAMPLES = 200
+INSPECT_MESSAGE_LENGTH = 50
+
+# Training planner, share of the available memory the features may use, free disk
+# space required per byte of memory-mapped features and documents vectorized at once
+TRAINING_MODE = 'auto'
+MEMORY_BUDGET_FRACTION = 0.5
+DISK_HEADROOM = 1.1
+FEATURE_CHUNK_SIZE = 1024
+
+# Distillation, default student architecture, epochs and share of the transfer corpus
+# withheld to measure the agreement with the teacher
+DISTILLATION_ARCHITECTURE = 'mlp'
+DISTILLATION_EPOCHS = 10
+DISTILLATION_TEST_RATIO = 0.1
+
+# Architecture benchmark, architectures compared and batches timed per measurement
+BENCHMARK_ARCHITECTURES = ('cnn', 'rnn', 'cnn-lite', 'narrow-cnn', 'fasttext', 'mlp')
+BENCHMARK_BATCHES = 20
+
+# Deduplication during ingestion, none, exact or near (MinHash over character shingles)
+DEDUP_MODE = 'none'
+DEDUP_THRESHOLD = 0.8
+DEDUP_PERMUTATIONS = 64
+DEDUP_BANDS = 16
+DEDUP_SHINGLE_SIZE = 5
+
+# Label index and targets
+SPARSE_TARGETS = 'auto'
+SPARSE_TARGETS_MIN_LABELS = 256
+
+# CNN projection tables
+PROJECTION_DTYPE = 'float32'
+PROJECTION_TOLERANCE = 1e-4
+PROJECTION_HALF_TOLERANCE = 1e-2
+
+# Conversation sessions
+SESSION_IDLE_TIMEOUT = 1800
+SESSION_MAX_SESSIONS = 100000
+SESSION_MESSAGE_LENGTH = 8
+
+# Cross-validation
+CROSS_VALIDATION_FOLDS = 5
+CROSS_VALIDATION_PROCESSES = 1
+CROSS_VALIDATION_THREADS = None
+
+# Inference telemetry, upper bounds of the histogram buckets
+TELEMETRY_LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                             0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+TELEMETRY_TOKEN_BUCKETS = (0, 1, 2, 4, 8, 16, 32, 64, 128, 256, 512)
+TELEMETRY_BATCH_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 2048, 4096)
+TELEMETRY_OOV_BUCKETS = (0.0, 0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1.0)
+
+# Hot reload, seconds between two polls of a watched model directory
+RELOAD_POLL_INTERVAL = 5
+
+# Cascade, confidence a stage needs to settle a document instead of escalating it
+CASCADE_THRESHOLD = 0.9
+
+# Build pipeline, number of stages of a build run at once
+PIPELINE_WORKERS = 4
\ No newline at end of file
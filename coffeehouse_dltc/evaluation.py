@@ -0,0 +1,120 @@
+from __future__ import print_function, unicode_literals, division
+
+import time
+
+import numpy as np
+
+from coffeehouse_dltc.chmodel.configuration import Configuration
+from coffeehouse_dltc.classify import StreamClassifier
+from coffeehouse_dltc.config import CLASSIFY_BATCH_SIZE, CLASSIFY_WORKERS, \
+    EVALUATION_THRESHOLD
+from coffeehouse_dltc.nn.metrics import ClassificationMetrics
+
+
+class Evaluator(object):
+    """ Scores a held-out corpus through the batched classification pipeline
+     and accumulates the quality metrics of the model cluster. """
+
+    def __init__(self, model_directory, batch_size=CLASSIFY_BATCH_SIZE,
+                 workers=CLASSIFY_WORKERS):
+        """
+        Public Constructor
+
+        :param model_directory: the directory of the built model cluster
+        :param batch_size: number of documents sent to the network at once
+        :param workers: number of tokenization processes
+        """
+        self.classifier = StreamClassifier(model_directory, batch_size=batch_size,
+                                           workers=workers)
+        self.labels = self.classifier.dltc.labels
+
+    def close(self):
+        """ Stop the tokenization workers """
+        self.classifier.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def evaluate(self, source_directory, threshold=EVALUATION_THRESHOLD):
+        """
+        Evaluate the model cluster on a held-out source directory, which has the
+        same layout as the one the model was trained from (model.json and .dat files)
+        :param source_directory: the directory containing the held-out data
+        :param threshold: labels scored at or above the threshold are predicted
+
+        :return: dictionary with the metrics and the throughput
+        """
+        configuration = Configuration(source_directory)
+        label_indices = {label: i for i, label in enumerate(self.labels)}
+
+        for label in configuration.classifier_labels():
+            if label not in label_indices:
+                raise ValueError(
+                    "The label '{0}' of the held-out data is not known by the model".format(label))
+
+        metrics = ClassificationMetrics(self.labels)
+        start = time.time()
+
+        records = self._read_records(configuration, label_indices)
+        for keys, y_predicted in self.classifier.score(records):
+            y_true = np.zeros(y_predicted.shape, dtype=np.bool_)
+            y_true[np.arange(len(keys)), keys] = True
+            metrics.update(y_true, y_predicted)
+
+        elapsed = time.time() - start
+        report = metrics.report(threshold)
+        report['seconds'] = elapsed
+        report['throughput'] = metrics.samples / elapsed if elapsed else 0.0
+
+        return report
+
+    @staticmethod
+    def _read_records(configuration, label_indices):
+        """
+        Stream the held-out data as (label index, text) records
+
+        :param configuration: Configuration object of the held-out data
+        :param label_indices: dictionary mapping the labels to their column
+        :return: generator of (label index, text) tuples
+        """
+        for label in configuration.classifier_labels():
+            for line in configuration.classifier_contents(label):
+                yield label_indices[label], line
+
+
+def print_report(report):
+    """
+    Print an evaluation report in a readable form
+    :param report: dictionary returned by Evaluator.evaluate
+
+    :return: None
+    """
+    print(
+        "\n--- Model Evaluation ---\n\n"
+        "   Samples         : {0}\n"
+        "   Accuracy        : {1:.4f}\n"
+        "   Macro F1        : {2:.4f}\n"
+        "   Throughput      : {3:.0f} documents/s\n"
+        "   Threshold       : {4}\n".format(
+            report['samples'],
+            report['accuracy'],
+            report['macro_f1'],
+            report['throughput'],
+            report['threshold'],
+        )
+    )
+
+    print("   LABEL                 PRECISION  RECALL  F1      SUPPORT")
+    for label, metrics in report['labels'].items():
+        print("   {0:<20}  {precision:<9.4f}  {recall:<6.4f}  {f1:<6.4f}  {support}".format(
+            label, **metrics))
+
+    labels = report['confusion_matrix']['labels']
+    print("\n   Confusion matrix (rows: expected, columns: predicted)\n")
+    print("   {0:<20}  {1}".format('', '  '.join('{0:>10}'.format(l[:10]) for l in labels)))
+    for label, row in zip(labels, report['confusion_matrix']['matrix']):
+        print("   {0:<20}  {1}".format(label[:20], '  '.join('{0:>10}'.format(c) for c in row)))
+    print()
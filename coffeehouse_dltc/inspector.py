@@ -0,0 +1,293 @@
+from __future__ import print_function, unicode_literals, division
+
+import io
+import os
+import time
+
+import numpy as np
+from keras import backend as K
+
+from coffeehouse_dltc.config import CLASSIFY_BATCH_SIZE, INSPECT_SAMPLES, INSPECT_MESSAGE_LENGTH
+from coffeehouse_dltc.main import DLTC
+
+
+class ClusterInspector(object):
+    """ Loads a built model cluster component by component and reports the
+     numbers worker fleets are sized from: the size of every component on disk
+     and in memory, the load time, the parameters of every layer and the
+     single message and batched prediction latency. """
+
+    def __init__(self, model_directory):
+        """
+        Public Constructor
+
+        :param model_directory: the directory of the built model cluster
+        """
+        if not os.path.exists(model_directory):
+            raise FileNotFoundError("The model directory does not exist")
+
+        self.model_directory = model_directory
+        self.cluster_files = DLTC.cluster_files(model_directory)
+
+        for component in ('embeddings', 'scaler', 'model', 'labels'):
+            if not os.path.exists(self.cluster_files[component]):
+                raise FileNotFoundError("The {0} file was not found ('{1}')".format(
+                    component, self.cluster_files[component]))
+
+        self.dltc = None
+
+    def inspect(self, texts=None, samples=INSPECT_SAMPLES, batch_size=CLASSIFY_BATCH_SIZE):
+        """
+        Load the cluster and measure it
+        :param texts: messages the latency is measured on, None generates
+        messages from the vocabulary of the cluster
+        :param samples: number of messages timed one by one
+        :param batch_size: number of messages per batch for the batched latency
+
+        :return: dictionary which can be serialized to JSON
+        """
+        baseline_memory = _resident_memory()
+        components, load_time = self._load()
+        loaded_memory = _resident_memory()
+
+        start = time.time()
+        self.dltc.warmup()
+        warmup_time = time.time() - start
+        serving_memory = _resident_memory()
+
+        # The scaled vectors are only built by the first prediction
+        components['vectorizer']['memory'] = int(self.dltc._get_vectorizer().vectors.nbytes)
+
+        if texts is None:
+            texts = generate_messages(self.dltc.word2vec_model, samples)
+        texts = list(texts)[:samples] or [' ']
+
+        sample_length, embedding_size = self.dltc._input_shape()
+        layers = self._layers()
+
+        return {
+            'model_directory': self.model_directory,
+            'labels': self.dltc.labels,
+            'tokenizer': self.dltc.tokenizer,
+            'vocabulary_size': len(self.dltc.word2vec_model.wv.vocab),
+            'embedding_size': embedding_size,
+            'sample_length': sample_length,
+            'parameters': sum(layer['parameters'] for layer in layers),
+            'layers': layers,
+            'components': components,
+            'disk_size': sum(c['disk_size'] for c in components.values()),
+            'load_time': load_time,
+            'warmup_time': warmup_time,
+            'memory': {
+                'baseline': baseline_memory,
+                'loaded': _difference(loaded_memory, baseline_memory),
+                'per_worker': _difference(serving_memory, baseline_memory),
+                'process': serving_memory,
+            },
+            'latency': {
+                'single': self._single_latency(texts),
+                'batched': self._batched_latency(texts, batch_size),
+            },
+        }
+
+    def _load(self):
+        """
+        Load every component of the cluster, measuring the load time and the
+        growth of the resident memory of each of them
+
+        :return: tuple (dictionary of components, total load time in seconds)
+        """
+        self.dltc = DLTC()
+        components = {}
+
+        def load(component, loader):
+            memory = _resident_memory()
+            start = time.time()
+            loader(self.cluster_files[component])
+            components[component] = {
+                'path': self.cluster_files[component],
+                'disk_size': os.path.getsize(self.cluster_files[component]),
+                'load_time': time.time() - start,
+                'resident_memory': _difference(_resident_memory(), memory),
+            }
+
+        load('labels', self.dltc.load_labels)
+        if os.path.exists(self.cluster_files['cluster']):
+            load('cluster', self.dltc.load_cluster_config)
+        else:
+            self.dltc.tokenizer = 'nltk'
+        load('model', self.dltc.load_model)
+        load('embeddings', self.dltc.load_word2vec_model)
+        load('scaler', self.dltc.load_scaler)
+        if os.path.exists(self.cluster_files['projection']):
+            load('projection', self.dltc.load_projection_tables)
+            components['projection']['memory'] = int(self.dltc.projection.nbytes)
+
+        scaler = self.dltc.scaler
+        float_size = np.dtype(K.floatx()).itemsize
+        components['embeddings']['memory'] = int(self.dltc.word2vec_model.wv.vectors.nbytes)
+        components['scaler']['memory'] = int(sum(
+            getattr(scaler, attribute).nbytes for attribute in ('mean_', 'var_', 'scale_')
+            if getattr(scaler, attribute, None) is not None))
+        components['model']['memory'] = int(self.dltc.keras_model.count_params() * float_size)
+        components['vectorizer'] = {'path': None, 'disk_size': 0, 'load_time': 0.0,
+                                    'resident_memory': None, 'memory': 0}
+
+        return components, sum(c['load_time'] for c in components.values())
+
+    def _layers(self):
+        """
+        The parameter count of every layer of the network
+
+        :return: list of dictionaries in the order of the layers
+        """
+        return [{
+            'name': layer.name,
+            'type': layer.__class__.__name__,
+            'output_shape': str(layer.output_shape),
+            'parameters': int(layer.count_params()),
+        } for layer in self.dltc.keras_model.layers]
+
+    def _single_latency(self, texts):
+        """
+        End to end latency of one message at a time, including tokenization
+
+        :param texts: list of messages
+        :return: dictionary of latency statistics in milliseconds
+        """
+        latencies = []
+        for text in texts:
+            start = time.time()
+            self.dltc.predict_from_text(text)
+            latencies.append(time.time() - start)
+
+        return _latency_statistics(latencies, 1)
+
+    def _batched_latency(self, texts, batch_size):
+        """
+        Latency of a batch of messages through predict_from_texts, the messages
+        are repeated to fill the batches
+
+        :param texts: list of messages
+        :param batch_size: number of messages per batch
+        :return: dictionary of latency statistics in milliseconds per batch
+        """
+        batch = (texts * (batch_size // len(texts) + 1))[:batch_size]
+        batches = max(5, len(texts) // batch_size)
+
+        latencies = []
+        for _ in range(batches):
+            start = time.time()
+            self.dltc.predict_from_texts(batch, batch_size=batch_size)
+            latencies.append(time.time() - start)
+
+        statistics = _latency_statistics(latencies, batch_size)
+        statistics['batch_size'] = batch_size
+        return statistics
+
+
+def generate_messages(word2vec_model, samples=INSPECT_SAMPLES, length=INSPECT_MESSAGE_LENGTH):
+    """
+    Generate messages from the most frequent words of a vocabulary, used when
+    no messages are given
+
+    :param word2vec_model: the word2vec model of a cluster
+    :param samples: number of messages
+    :param length: number of words per message
+    :return: list of strings
+    """
+    words = word2vec_model.wv.index2word[:10000]
+    random_state = np.random.RandomState(0)
+    return [' '.join(random_state.choice(words, length)) for _ in range(samples)]
+
+
+def _latency_statistics(latencies, batch_size):
+    """ Summarize latencies in seconds as milliseconds and messages per second """
+    latencies = np.asarray(latencies) * 1000
+    return {
+        'samples': int(len(latencies)),
+        'mean_ms': float(np.mean(latencies)),
+        'p50_ms': float(np.percentile(latencies, 50)),
+        'p95_ms': float(np.percentile(latencies, 95)),
+        'p99_ms': float(np.percentile(latencies, 99)),
+        'throughput': float(batch_size * 1000 / np.mean(latencies)) if np.mean(latencies) else 0.0,
+    }
+
+
+def _resident_memory():
+    """ The resident memory of the process in bytes, None where /proc is not available """
+    try:
+        with io.open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError, ValueError, IndexError):
+        return None
+
+
+def _difference(after, before):
+    """ Subtract two memory measurements which may be unavailable """
+    if after is None or before is None:
+        return None
+    return after - before
+
+
+def _megabytes(size):
+    """ Format a size in bytes for the report """
+    if size is None:
+        return 'n/a'
+    return '{0:.1f} MB'.format(size / (1024 * 1024))
+
+
+def print_inspection(report):
+    """
+    Print an inspection report in a readable form
+    :param report: dictionary returned by ClusterInspector.inspect
+
+    :return: None
+    """
+    print(
+        "\n--- Model Cluster Inspection ---\n\n"
+        "   Labels          : {0}\n"
+        "   Tokenizer       : {1}\n"
+        "   Vocabulary      : {2}\n"
+        "   Embedding size  : {3}\n"
+        "   Sample length   : {4}\n"
+        "   Parameters      : {5}\n"
+        "   Disk size       : {6}\n"
+        "   Load time       : {7:.2f}s (+{8:.2f}s warmup)\n"
+        "   Memory / worker : {9}\n"
+        "   Process memory  : {10}\n".format(
+            len(report['labels']),
+            report['tokenizer'],
+            report['vocabulary_size'],
+            report['embedding_size'],
+            report['sample_length'],
+            report['parameters'],
+            _megabytes(report['disk_size']),
+            report['load_time'],
+            report['warmup_time'],
+            _megabytes(report['memory']['per_worker']),
+            _megabytes(report['memory']['process']),
+        )
+    )
+
+    print("   COMPONENT     DISK SIZE     IN MEMORY     RSS GROWTH    LOAD TIME")
+    for component, info in report['components'].items():
+        print("   {0:<12}  {1:<12}  {2:<12}  {3:<12}  {4:.3f}s".format(
+            component, _megabytes(info['disk_size']), _megabytes(info.get('memory')),
+            _megabytes(info['resident_memory']), info['load_time']))
+
+    print("\n   LAYER                     TYPE                  PARAMETERS  OUTPUT SHAPE")
+    for layer in report['layers']:
+        print("   {name:<24}  {type:<20}  {parameters:<10}  {output_shape}".format(**layer))
+
+    single = report['latency']['single']
+    batched = report['latency']['batched']
+    print(
+        "\n   Single message  : {0:.2f}ms mean, {1:.2f}ms p50, {2:.2f}ms p95, {3:.2f}ms p99 "
+        "({4:.0f} messages/s)\n"
+        "   Batch of {5:<6} : {6:.2f}ms mean, {7:.2f}ms p50, {8:.2f}ms p95, {9:.2f}ms p99 "
+        "({10:.0f} messages/s)\n".format(
+            single['mean_ms'], single['p50_ms'], single['p95_ms'], single['p99_ms'],
+            single['throughput'], batched['batch_size'], batched['mean_ms'],
+            batched['p50_ms'], batched['p95_ms'], batched['p99_ms'], batched['throughput'])
+    )
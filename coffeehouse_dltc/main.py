@@ -4,50 +4,127 @@ import math
 import os
 import sys
 import json
+from contextlib import contextmanager
 
 import keras.models
 import numpy as np
+import tensorflow as tf
+from keras import backend as K
 
-from coffeehouse_dltc.base.document import Document
+from coffeehouse_dltc.base.document import Document, tokenize
+from coffeehouse_dltc.base.tokenizer import get_tokenizer
 from coffeehouse_dltc.base.word2vec import train_word2vec, fit_scaler
-from coffeehouse_dltc.config import NN_ARCHITECTURE, BATCH_SIZE, EMBEDDING_SIZE, EPOCHS
-from coffeehouse_dltc.nn.input_data import get_data_for_model
+from coffeehouse_dltc.config import NN_ARCHITECTURE, BATCH_SIZE, EMBEDDING_SIZE, EPOCHS, \
+    CHECKPOINT_PERIOD, EARLY_STOPPING_MONITOR, SPLIT_SEED, SCALER_FIT_MODE, WORD2VEC_WORKERS, \
+    TOKENIZER, PROJECTION_DTYPE, SAMPLE_LENGTH
+from coffeehouse_dltc.nn.checkpoints import get_training_callbacks, latest_checkpoint
+from coffeehouse_dltc.nn.input_data import get_data_for_model, FeatureSequence
 from coffeehouse_dltc.nn.models import get_nn_model
+from coffeehouse_dltc.nn.projection import ProjectionTables
+from coffeehouse_dltc.nn.session import create_session
+from coffeehouse_dltc.nn.vectorizer import WordVectorizer
+from coffeehouse_dltc.telemetry import Telemetry, NO_STAGE
 from coffeehouse_dltc.utils import save_to_disk, load_from_disk
 
 
 # noinspection DuplicatedCode
 class DLTC(object):
 
-    def __init__(self):
+    def __init__(self, intra_op_threads=None, inter_op_threads=None, tokenizer=TOKENIZER):
         """
         Public Constructor
+
+        :param intra_op_threads: threads TensorFlow may use to parallelize a single
+        operation, use 1 when running many single-threaded workers per host
+        :param inter_op_threads: threads TensorFlow may use to run independent
+        operations concurrently
+        :param tokenizer: name of the tokenizer backend used for training and
+        prediction, loading a model cluster replaces it with the recorded one
         """
         self.labels = None
         self.keras_model = None
         self.word2vec_model = None
         self.scaler = None
+        self.projection = None
+        self.telemetry = None
+        self.sample_length = None
+        self.tokenizer = get_tokenizer(tokenizer).name
+
+        # Every instance owns its graph and session so the thread limits apply
+        # to it and several clusters can be loaded in one process
+        self.intra_op_threads = intra_op_threads
+        self.inter_op_threads = inter_op_threads
+        self.graph = tf.Graph()
+        self.session = create_session(self.graph, intra_op_threads, inter_op_threads)
+
+        self._vectorizer = None
+        self._predict_function = None
+        self._predict_function_model = None
+        self._predict_inputs = []
+
+    @contextmanager
+    def as_default(self):
+        """
+        Context in which Keras builds, trains and runs models on the graph and
+        session of this instance
+
+        :return: context manager
+        """
+        with self.graph.as_default(), self.session.as_default():
+            yield
+
+    def enable_telemetry(self, telemetry=None):
+        """
+        Record statistics of every prediction, see Telemetry. Telemetry is
+        disabled by default and costs nothing until it is enabled
+        :param telemetry: Telemetry object to record into, e.g. one shared by
+        several clusters, None creates one
+
+        :return: the Telemetry object
+        """
+        self.telemetry = telemetry or Telemetry()
+        return self.telemetry
+
+    def disable_telemetry(self):
+        """
+        Stop recording statistics
 
-    def load_model_cluster(self, model_directory):
+        :return: None
+        """
+        self.telemetry = None
+
+    def _stage(self, name):
+        """
+        Time a stage of the prediction path when telemetry is enabled
+        :param name: one of 'tokenize', 'vectorize' or 'network'
+
+        :return: context manager
+        """
+        telemetry = self.telemetry
+        return telemetry.stage(name) if telemetry is not None else NO_STAGE
+
+    def load_model_cluster(self, model_directory, warmup=True, projection=True):
         """
         Loads the model cluster into memory in which the model can be used
          to be predicted from
 
         :param model_directory: The directory which contains the model
-        files such as .che, .chs, .chm and .chl
+        files such as .che, .chs, .chm, .chl and .chc
+        :param warmup: run a prediction once so the first real request does not
+        pay for building the inference function
+        :param projection: serve the predictions from the projection tables
+        (.chp) when the cluster has them
         :return: None
         """
         if not os.path.exists(model_directory):
             raise FileNotFoundError("The model directory does not exist")
 
-        embeddings_path = os.path.join(model_directory, "{0}.che".
-                                       format(os.path.basename(model_directory[:-6])))
-        scaler_path = os.path.join(model_directory, "{0}.chs".
-                                   format(os.path.basename(model_directory[:-6])))
-        model_file_path = os.path.join(model_directory, "{0}.chm".
-                                       format(os.path.basename(model_directory[:-6])))
-        labels_file_path = os.path.join(model_directory, "{0}.chl".
-                                        format(os.path.basename(model_directory[:-6])))
+        cluster_files = self.cluster_files(model_directory)
+        embeddings_path = cluster_files['embeddings']
+        scaler_path = cluster_files['scaler']
+        model_file_path = cluster_files['model']
+        labels_file_path = cluster_files['labels']
+        cluster_file_path = cluster_files['cluster']
 
         if not os.path.exists(embeddings_path):
             raise FileNotFoundError("The embeddings model was not found ('{0}')".
@@ -65,17 +142,132 @@ class DLTC(object):
             raise FileNotFoundError("The labels file was not found ('{0}')".
                                     format(labels_file_path))
 
-        # Read the labels file
-        with open(labels_file_path, 'r') as f:
-            self.labels = json.load(f)
+        self.load_labels(labels_file_path)
+
+        # Clusters built before the cluster file existed were tokenized with nltk
+        self.sample_length = None
+        if os.path.exists(cluster_file_path):
+            self.load_cluster_config(cluster_file_path)
+        else:
+            self.tokenizer = 'nltk'
 
         self.load_model(model_file_path)
+        if self.sample_length is not None and self.sample_length != self._input_shape()[0]:
+            raise ValueError("The cluster was built for {0} words per document but the model "
+                             "reads {1}".format(self.sample_length, self._input_shape()[0]))
         self.load_word2vec_model(embeddings_path)
         self.load_scaler(scaler_path)
 
+        self.projection = None
+        if projection and os.path.exists(cluster_files['projection']):
+            self.load_projection_tables(cluster_files['projection'])
+
+        if warmup:
+            self.warmup()
+
+    def close(self):
+        """
+        Close the TensorFlow session and drop the loaded models, the instance
+        can not be used for predictions afterwards
+
+        :return: None
+        """
+        self.session.close()
+        self.keras_model = None
+        self.word2vec_model = None
+        self.scaler = None
+        self.projection = None
+        self._vectorizer = None
+        self._predict_function = None
+        self._predict_function_model = None
+
+    @staticmethod
+    def cluster_files(model_directory):
+        """
+        The paths of the files of a model cluster, the files are named after
+        the build directory without its '_build' suffix
+
+        :param model_directory: the directory of the built model cluster
+        :return: dictionary with the paths of the 'embeddings' (.che), 'scaler'
+        (.chs), 'model' (.chm), 'labels' (.chl), 'cluster' (.chc) and the
+        optional 'projection' (.chp) files
+        """
+        name = os.path.basename(model_directory[:-6])
+        extensions = (('embeddings', 'che'), ('scaler', 'chs'), ('model', 'chm'),
+                      ('labels', 'chl'), ('cluster', 'chc'), ('projection', 'chp'))
+
+        return {component: os.path.join(model_directory, "{0}.{1}".format(name, extension))
+                for component, extension in extensions}
+
+    def warmup(self):
+        """
+        Build the vectorizer and the inference function and run them once,
+        the first call otherwise pays for tracing the graph
+
+        :return: None
+        """
+        self.predict_from_text("warmup")
+
+    def build_features(self, train_dir, vocabulary, test_dir=None, test_ratio=0.0,
+                       split_seed=SPLIT_SEED, feature_dir=None, sample_weights=None,
+                       label_index=None, sparse_targets=False, sample_length=SAMPLE_LENGTH):
+        """
+        Build the feature matrices train uses, without a Keras model so they
+        can be built while the network is being set up. The parameters are
+        the ones of train
+        :param train_dir: directory with data files
+        :param vocabulary: iterable containing all considered labels
+        :param test_dir: directory with test files
+        :param test_ratio: the ratio of samples withheld for testing when there is no test_dir
+        :param split_seed: seed of the shuffle deciding which samples are withheld
+        :param feature_dir: directory to build the matrices into as memory-mapped
+        files, None builds them in memory
+        :param sample_weights: dictionary mapping file ids to their sample weight
+        :param label_index: LabelIndex of train_dir
+        :param sparse_targets: keep the targets as a sparse matrix
+        :param sample_length: number of words the network reads per document
+
+        :return: tuple (train data, test data) to pass to train as features
+        """
+        if not self.word2vec_model:
+            raise RuntimeError('word2vec model is not trained. ' + 'Run train_word2vec() first.')
+
+        if not self.scaler:
+            raise RuntimeError('The scaler is not trained. ' + 'Run fit_scaler() first.')
+
+        if not os.path.isdir(train_dir):
+            raise ValueError('The training directory ' + train_dir + ' does not exist')
+
+        if test_dir and not os.path.isdir(test_dir):
+            raise ValueError('The test directory ' + test_dir + ' does not exist')
+
+        return get_data_for_model(
+            train_dir,
+            vocabulary,
+            test_dir=test_dir,
+            nn_model=None,
+            as_generator=False,
+            word2vec_model=self.word2vec_model,
+            scaler=self.scaler,
+            tokenizer=self.tokenizer,
+            test_ratio=test_ratio,
+            split_seed=split_seed,
+            feature_dir=feature_dir,
+            sample_weights=sample_weights,
+            label_index=label_index,
+            sparse_targets=sparse_targets,
+            sample_length=sample_length,
+        )
+
     def train(self, train_dir, vocabulary, test_dir=None, callbacks=None,
               nn_model=NN_ARCHITECTURE, batch_size=BATCH_SIZE, test_ratio=0.0,
-              epochs=EPOCHS, verbose=1):
+              epochs=EPOCHS, verbose=1, checkpoint_dir=None,
+              checkpoint_period=CHECKPOINT_PERIOD, resume=False,
+              early_stopping_patience=None,
+              early_stopping_monitor=EARLY_STOPPING_MONITOR,
+              early_stopping_min_delta=0.0, split_seed=SPLIT_SEED, feature_dir=None,
+              sample_weights=None, label_index=None, sparse_targets=False,
+              sample_length=SAMPLE_LENGTH, features=None):
         """
         Train the model on given data
         :param train_dir: directory with data files. Text files should end with
@@ -87,9 +279,32 @@ class DLTC(object):
         :param nn_model: string defining the NN architecture e.g. 'crnn'
         :param batch_size: size of one batch
         :param test_ratio: the ratio of samples that will be withheld from training
-        and used for testing. This can be overridden by test_dir.
+        and used for testing. This can be overridden by test_dir. The split is
+        stratified by label and decided before the features are built.
         :param epochs: number of epochs to train
         :param verbose: 0, 1 or 2. As in Keras.
+        :param checkpoint_dir: directory to save the model and optimizer state to
+        every checkpoint_period epochs, None disables checkpointing
+        :param checkpoint_period: number of epochs between two checkpoints
+        :param resume: continue from the latest checkpoint in checkpoint_dir
+        :param early_stopping_patience: stop after this many epochs without an
+        improvement of the validation metric, None disables early stopping
+        :param early_stopping_monitor: the quantity watched by early stopping
+        :param early_stopping_min_delta: minimum change that counts as an improvement
+        :param split_seed: seed of the shuffle deciding which samples are withheld
+        :param feature_dir: directory to build the feature matrices into as
+        memory-mapped files when they do not fit in memory, None builds them in
+        memory. Memory-mapped matrices are shuffled in batch-sized chunks
+        :param sample_weights: dictionary mapping file ids (no extension) to the
+        weight of their sample in the loss, None weighs every sample 1
+        :param label_index: LabelIndex of train_dir, the labels are read from it
+        instead of the .lab files
+        :param sparse_targets: keep the targets as a sparse matrix and expand
+        them one batch at a time, for large label vocabularies
+        :param sample_length: number of words the network reads per document,
+        a model restored from a checkpoint keeps its own
+        :param features: tuple returned by build_features with the same
+        parameters, None builds the features here
 
         :return: History object
         """
@@ -106,41 +321,117 @@ class DLTC(object):
         if test_dir and not os.path.isdir(test_dir):
             raise ValueError('The test directory ' + test_dir + ' does not exist')
 
-        if self.keras_model:
-            print('WARNING! Overwriting already trained Keras model.', file=sys.stderr)
+        if early_stopping_patience is not None and not (test_dir or test_ratio):
+            raise ValueError('Early stopping requires validation data, set test_dir or test_ratio')
+
+        with self.as_default():
+            initial_epoch = self._init_keras_model(nn_model, vocabulary, checkpoint_dir, resume,
+                                                   sample_length)
+
+            if features is None:
+                train_data, test_data = get_data_for_model(
+                    train_dir,
+                    vocabulary,
+                    test_dir=test_dir,
+                    nn_model=self.keras_model,
+                    as_generator=False,
+                    batch_size=batch_size,
+                    word2vec_model=self.word2vec_model,
+                    scaler=self.scaler,
+                    tokenizer=self.tokenizer,
+                    test_ratio=test_ratio,
+                    split_seed=split_seed,
+                    feature_dir=feature_dir,
+                    sample_weights=sample_weights,
+                    label_index=label_index,
+                    sparse_targets=sparse_targets,
+                    sample_length=self._input_shape()[0],
+                )
+            else:
+                train_data, test_data = [self._network_inputs(data) for data in features]
+
+            callbacks = self._get_callbacks(
+                callbacks,
+                checkpoint_dir=checkpoint_dir,
+                checkpoint_period=checkpoint_period,
+                early_stopping_patience=early_stopping_patience,
+                early_stopping_monitor=early_stopping_monitor,
+                early_stopping_min_delta=early_stopping_min_delta,
+                initial_epoch=initial_epoch,
+            )
+            shuffle = 'batch' if feature_dir else True
+
+            if sparse_targets:
+                return self.keras_model.fit_generator(
+                    self._sparse_sequence(train_data, batch_size, shuffle, split_seed),
+                    epochs=epochs,
+                    validation_data=self._sparse_sequence(test_data, batch_size, False),
+                    shuffle=True,
+                    callbacks=callbacks,
+                    initial_epoch=initial_epoch,
+                    verbose=verbose,
+                )
+
+            return self.keras_model.fit(
+                train_data[0],
+                train_data[1],
+                sample_weight=train_data[2] if sample_weights is not None else None,
+                batch_size=batch_size,
+                epochs=epochs,
+                validation_data=test_data,
+                shuffle=shuffle,
+                callbacks=callbacks,
+                initial_epoch=initial_epoch,
+                verbose=verbose,
+            )
+
+    def _network_inputs(self, data):
+        """
+        Feed the single input matrix of features built by build_features to
+        every input of the network
+        :param data: (X, y) or (X, y, weights), None is passed through
 
-        self.labels = vocabulary
-        self.keras_model = get_nn_model(
-            nn_model,
-            embedding=self.word2vec_model.vector_size,
-            output_length=len(vocabulary)
-        )
+        :return: the same tuple with one input matrix per input of the network
+        """
+        if data is None:
+            return None
 
-        (x_train, y_train), test_data = get_data_for_model(
-            train_dir,
-            vocabulary,
-            test_dir=test_dir,
-            nn_model=self.keras_model,
-            as_generator=False,
-            batch_size=batch_size,
-            word2vec_model=self.word2vec_model,
-            scaler=self.scaler,
-        )
+        x_matrix = data[0][0]
+        if x_matrix.shape[1] != self._input_shape()[0]:
+            raise ValueError("The features were built for {0} words per document but the model "
+                             "reads {1}".format(x_matrix.shape[1], self._input_shape()[0]))
+
+        return ([x_matrix] * len(self.keras_model.inputs),) + tuple(data[1:])
 
-        return self.keras_model.fit(
-            x_train,
-            y_train,
-            batch_size=batch_size,
-            epochs=epochs,
-            validation_data=test_data,
-            validation_split=test_ratio,
-            callbacks=callbacks or [],
-            verbose=verbose,
+    @staticmethod
+    def _sparse_sequence(data, batch_size, shuffle, seed=SPLIT_SEED):
+        """
+        Wrap (X, y) or (X, y, weights) with sparse targets in a Keras Sequence
+        :param data: tuple returned by get_data_for_model, None is passed through
+        :param batch_size: size of one batch
+        :param shuffle: True, 'batch' or False, see FeatureSequence
+        :param seed: seed of the sample shuffle
+
+        :return: FeatureSequence object or None
+        """
+        if data is None:
+            return None
+
+        return FeatureSequence(
+            data[0], data[1], batch_size=batch_size,
+            sample_weights=data[2] if len(data) > 2 else None,
+            shuffle=shuffle, seed=seed,
         )
 
     def batch_train(self, train_dir, vocabulary, test_dir=None, callbacks=None,
-                    nn_model=NN_ARCHITECTURE, batch_size=BATCH_SIZE,
-                    epochs=EPOCHS, verbose=1):
+                    nn_model=NN_ARCHITECTURE, batch_size=BATCH_SIZE, test_ratio=0.0,
+                    epochs=EPOCHS, verbose=1, checkpoint_dir=None,
+                    checkpoint_period=CHECKPOINT_PERIOD, resume=False,
+                    early_stopping_patience=None,
+                    early_stopping_monitor=EARLY_STOPPING_MONITOR,
+                    early_stopping_min_delta=0.0, split_seed=SPLIT_SEED,
+                    sample_weights=None, label_index=None, sparse_targets=False,
+                    sample_length=SAMPLE_LENGTH):
         """
         Train the model on given data
         :param train_dir: directory with data files. Text files should end with
@@ -151,8 +442,28 @@ class DLTC(object):
         :param callbacks: objects passed to the Keras fit function as callbacks
         :param nn_model: string defining the NN architecture e.g. 'crnn'
         :param batch_size: size of one batch
+        :param test_ratio: the ratio of samples that will be withheld from training
+        and used for testing. This can be overridden by test_dir. The split is
+        stratified by label and decided before the features are built.
         :param epochs: number of epochs to train
         :param verbose: 0, 1 or 2. As in Keras.
+        :param checkpoint_dir: directory to save the model and optimizer state to
+        every checkpoint_period epochs, None disables checkpointing
+        :param checkpoint_period: number of epochs between two checkpoints
+        :param resume: continue from the latest checkpoint in checkpoint_dir
+        :param early_stopping_patience: stop after this many epochs without an
+        improvement of the validation metric, None disables early stopping
+        :param early_stopping_monitor: the quantity watched by early stopping
+        :param early_stopping_min_delta: minimum change that counts as an improvement
+        :param split_seed: seed of the shuffle deciding which samples are withheld
+        :param sample_weights: dictionary mapping file ids (no extension) to the
+        weight of their sample in the loss, None weighs every sample 1
+        :param label_index: LabelIndex of train_dir, the labels are read from it
+        instead of the .lab files
+        :param sparse_targets: keep the targets as a sparse matrix and expand
+        them one batch at a time, for large label vocabularies
+        :param sample_length: number of words the network reads per document,
+        a model restored from a checkpoint keeps its own
 
         :return: History object
         """
@@ -169,38 +480,101 @@ class DLTC(object):
         if test_dir and not os.path.isdir(test_dir):
             raise ValueError('The test directory ' + test_dir + ' does not exist')
 
+        if early_stopping_patience is not None and not (test_dir or test_ratio):
+            raise ValueError('Early stopping requires validation data, set test_dir or test_ratio')
+
+        with self.as_default():
+            initial_epoch = self._init_keras_model(nn_model, vocabulary, checkpoint_dir, resume,
+                                                   sample_length)
+
+            train_generator, test_data = get_data_for_model(
+                train_dir,
+                vocabulary,
+                test_dir=test_dir,
+                nn_model=self.keras_model,
+                as_generator=True,
+                batch_size=batch_size,
+                word2vec_model=self.word2vec_model,
+                scaler=self.scaler,
+                tokenizer=self.tokenizer,
+                test_ratio=test_ratio,
+                split_seed=split_seed,
+                sample_weights=sample_weights,
+                label_index=label_index,
+                sparse_targets=sparse_targets,
+                sample_length=self._input_shape()[0],
+            )
+            if sparse_targets:
+                test_data = self._sparse_sequence(test_data, batch_size, False)
+
+            nb_of_files = len({filename[:-4] for filename in os.listdir(train_dir)})
+            if test_ratio and not test_dir:
+                nb_of_files -= len(test_data.order) if sparse_targets else len(test_data[1])
+            steps_per_epoch = math.ceil(nb_of_files / batch_size)
+
+            return self.keras_model.fit_generator(
+                train_generator,
+                steps_per_epoch=steps_per_epoch,
+                epochs=epochs,
+                validation_data=test_data,
+                callbacks=self._get_callbacks(
+                    callbacks,
+                    checkpoint_dir=checkpoint_dir,
+                    checkpoint_period=checkpoint_period,
+                    early_stopping_patience=early_stopping_patience,
+                    early_stopping_monitor=early_stopping_monitor,
+                    early_stopping_min_delta=early_stopping_min_delta,
+                    initial_epoch=initial_epoch,
+                ),
+                initial_epoch=initial_epoch,
+                verbose=verbose,
+            )
+
+    def _init_keras_model(self, nn_model, vocabulary, checkpoint_dir=None, resume=False,
+                          sample_length=SAMPLE_LENGTH):
+        """
+        Create a new Keras model or restore it from the latest checkpoint
+        :param nn_model: string defining the NN architecture e.g. 'cnn'
+        :param vocabulary: iterable containing all considered labels
+        :param checkpoint_dir: directory containing the checkpoints
+        :param resume: flag whether to restore the latest checkpoint
+        :param sample_length: number of words the new model reads per document
+
+        :return: the epoch training should continue from
+        """
         if self.keras_model:
             print('WARNING! Overwriting already trained Keras model.', file=sys.stderr)
 
         self.labels = vocabulary
+
+        if resume:
+            checkpoint_path, initial_epoch = latest_checkpoint(checkpoint_dir)
+            if checkpoint_path:
+                print("Resuming from checkpoint '{0}' (epoch {1})".format(
+                    checkpoint_path, initial_epoch))
+                self.keras_model = keras.models.load_model(checkpoint_path)
+                return initial_epoch
+            print('WARNING! No checkpoint found, training from scratch.', file=sys.stderr)
+
         self.keras_model = get_nn_model(
             nn_model,
             embedding=self.word2vec_model.vector_size,
-            output_length=len(vocabulary)
+            output_length=len(vocabulary),
+            sample_length=sample_length
         )
 
-        train_generator, test_data = get_data_for_model(
-            train_dir,
-            vocabulary,
-            test_dir=test_dir,
-            nn_model=self.keras_model,
-            as_generator=True,
-            batch_size=batch_size,
-            word2vec_model=self.word2vec_model,
-            scaler=self.scaler,
-        )
+        return 0
 
-        nb_of_files = len({filename[:-4] for filename in os.listdir(train_dir)})
-        steps_per_epoch = math.ceil(nb_of_files / batch_size)
+    @staticmethod
+    def _get_callbacks(callbacks, **kwargs):
+        """
+        Combine the user callbacks with the built-in checkpointing and early stopping
+        :param callbacks: objects passed to the Keras fit function as callbacks
+        :param kwargs: arguments passed to get_training_callbacks
 
-        return self.keras_model.fit_generator(
-            train_generator,
-            steps_per_epoch=steps_per_epoch,
-            epochs=epochs,
-            validation_data=test_data,
-            callbacks=callbacks or [],
-            verbose=verbose,
-        )
+        :return: list of Keras callbacks
+        """
+        return list(callbacks or []) + get_training_callbacks(**kwargs)
 
     def predict_from_file(self, filepath):
         """
@@ -209,7 +583,7 @@ class DLTC(object):
 
         :return: list of labels with corresponding confidence intervals
         """
-        doc = Document(0, filepath)
+        doc = Document(0, filepath, tokenizer=self.tokenizer)
         return dict(self._predict(doc))
 
     def predict_from_text(self, text):
@@ -218,39 +592,123 @@ class DLTC(object):
         :param text: string or unicode with the text
         :return: list of labels with corresponding confidence intervals
         """
-        doc = Document(0, None, text=text)
+        doc = Document(0, None, text=text, tokenizer=self.tokenizer)
         return dict(self._predict(doc))
 
+    def predict_from_texts(self, texts, batch_size=BATCH_SIZE):
+        """
+        Predict labels for many strings of text, the network runs once per batch
+        :param texts: iterable of strings
+        :param batch_size: number of documents sent to the network at once
+        :return: list with a dictionary of labels and confidence intervals per text
+        """
+        texts = list(texts)
+        sample_length, _ = self._input_shape()
+        results = []
+        for i in range(0, len(texts), batch_size):
+            with self._stage('tokenize'):
+                words = [tokenize(text, self.tokenizer, sample_length)
+                         for text in texts[i:i + batch_size]]
+            for y_predicted in self.predict_tokens(words):
+                results.append(dict(zip(self.labels, y_predicted)))
+
+        return results
+
+    def predict_tokens(self, token_lists):
+        """
+        Predict labels for already tokenized documents in a single batch
+        :param token_lists: list of token lists, one per document
+        :return: numpy array of shape (documents, labels) with the confidence
+        of every label in the order of self.labels
+        """
+        sample_length, embedding_size = self._input_shape()
+        vectorizer = self._get_vectorizer()
+
+        telemetry = self.telemetry
+        if telemetry is not None:
+            telemetry.observe_batch(token_lists, vectorizer.index, sample_length)
+
+        if self.projection is not None:
+            with self._stage('vectorize'):
+                ids, lengths = self.projection.word_ids(token_lists, vectorizer.index)
+            with self._stage('network'):
+                return self.projection.predict_ids(ids, lengths)
+
+        with self._stage('vectorize'):
+            x_matrix = np.zeros((len(token_lists), sample_length, embedding_size),
+                                dtype=np.float32)
+            for i, words in enumerate(token_lists):
+                vectorizer.transform(words, sample_length, out=x_matrix[i])
+
+        with self._stage('network'):
+            return self._predict_matrix(x_matrix)
+
     def _predict(self, doc):
         """
         Predict labels for a given Document object
         :param doc: Document object
         :return: list of labels with corresponding confidence intervals
         """
+        sample_length, _ = self._input_shape()
+
+        with self._stage('tokenize'):
+            words = doc.get_all_words(limit=sample_length)
+        y_predicted = self.predict_tokens([words])
+
+        zipped = zip(self.labels, y_predicted[0])
+
+        return sorted(zipped, key=lambda elem: elem[1], reverse=True)
+
+    def _input_shape(self):
+        """
+        The input shape the Keras model expects for a single document
+        :return: tuple (sample_length, embedding_size)
+        """
         if type(self.keras_model.input) == list:
             _, sample_length, embedding_size = self.keras_model.input_shape[0]
         else:
             _, sample_length, embedding_size = self.keras_model.input_shape
 
-        words = doc.get_all_words()[:sample_length]
-        x_matrix = np.zeros((1, sample_length, embedding_size))
+        return sample_length, embedding_size
 
-        for i, w in enumerate(words):
-            if w in self.word2vec_model.wv:
-                word_vector = self.word2vec_model.wv[w].reshape(1, -1)
-                scaled_vector = self.scaler.transform(word_vector, copy=True)[0]
-                x_matrix[doc.doc_id][i] = scaled_vector
+    def _get_vectorizer(self):
+        """
+        The vectorizer for the current word2vec model and scaler, it is rebuilt
+        whenever either of them is replaced
 
-        if type(self.keras_model.input) == list:
-            x = [x_matrix] * len(self.keras_model.input)
-        else:
-            x = [x_matrix]
+        :return: WordVectorizer object
+        """
+        vectorizer = self._vectorizer
+        if vectorizer is None or vectorizer.word2vec_model is not self.word2vec_model \
+                or vectorizer.scaler is not self.scaler:
+            vectorizer = WordVectorizer(self.word2vec_model, self.scaler)
+            self._vectorizer = vectorizer
 
-        y_predicted = self.keras_model.predict(x)
+        return vectorizer
 
-        zipped = zip(self.labels, y_predicted[0])
+    def _predict_matrix(self, x_matrix):
+        """
+        Run the network on a batch of document matrices. The compiled inference
+        function is called directly, which skips the data adapter and batching
+        loop keras_model.predict goes through on every call
+        :param x_matrix: numpy array of shape (n, sample_length, embedding_size)
 
-        return sorted(zipped, key=lambda elem: elem[1], reverse=True)
+        :return: numpy array of shape (n, number of labels)
+        """
+        if self._predict_function is None or self._predict_function_model is not self.keras_model:
+            with self.as_default():
+                inputs = list(self.keras_model.inputs)
+                self._predict_inputs = []
+                if self.keras_model.uses_learning_phase and \
+                        not isinstance(K.learning_phase(), int):
+                    inputs.append(K.learning_phase())
+                    self._predict_inputs = [0]
+                self._predict_function = K.function(inputs, self.keras_model.outputs)
+                self._predict_function_model = self.keras_model
+
+        with self.as_default():
+            return self._predict_function(
+                [x_matrix] * len(self.keras_model.inputs) + self._predict_inputs)[0]
 
     def init_word_vectors(self, train_dir, vec_dim=EMBEDDING_SIZE):
         """
@@ -263,11 +721,19 @@ class DLTC(object):
         self.train_word2vec(train_dir, vec_dim=vec_dim)
         self.fit_scaler(train_dir)
 
-    def train_word2vec(self, train_dir, vec_dim=EMBEDDING_SIZE):
+    def train_word2vec(self, train_dir, vec_dim=EMBEDDING_SIZE, workers=WORD2VEC_WORKERS,
+                       corpus_file=None, **pretrained):
         """
         Train the word2vec model on a directory with text files.
         :param train_dir: directory with '.txt' files
         :param vec_dim: dimensionality of the word vectors
+        :param workers: number of threads training the word vectors
+        :param corpus_file: path of the line-sentence file to train from, it is
+        written from train_dir first if it does not exist. None feeds gensim from
+        a Python iterator instead
+        :param pretrained: pretrained, pretrained_mode, pretrained_epochs and
+        pretrained_binary to initialize the vectors from a pretrained vectors
+        file, see base.word2vec.train_word2vec
 
         :return: trained gensim model
         """
@@ -275,14 +741,18 @@ class DLTC(object):
             print('WARNING! Overwriting already trained word2vec model.',
                   file=sys.stderr)
 
-        self.word2vec_model = train_word2vec(train_dir, vec_dim=vec_dim)
+        self.word2vec_model = train_word2vec(train_dir, vec_dim=vec_dim, workers=workers,
+                                             corpus_file=corpus_file, tokenizer=self.tokenizer,
+                                             **pretrained)
 
         return self.word2vec_model
 
-    def fit_scaler(self, train_dir):
+    def fit_scaler(self, train_dir, mode=SCALER_FIT_MODE):
         """
         Fit a scaler on given data. Word vectors must be trained already.
         :param train_dir: directory with '.txt' files
+        :param mode: 'vocabulary' computes the statistics from the word counts of
+        the word2vec model, 'corpus' re-reads every document in train_dir
 
         :return: fitted scaler object
         """
@@ -293,7 +763,8 @@ class DLTC(object):
             print('WARNING! Overwriting already fitted scaler.',
                   file=sys.stderr)
 
-        self.scaler = fit_scaler(train_dir, word2vec_model=self.word2vec_model)
+        self.scaler = fit_scaler(train_dir, word2vec_model=self.word2vec_model, mode=mode,
+                                 tokenizer=self.tokenizer)
 
         return self.scaler
 
@@ -317,6 +788,26 @@ class DLTC(object):
         """ Load the word2vec model from a file """
         self.word2vec_model = load_from_disk(filepath)
 
+    def load_labels(self, filepath):
+        """ Load the labels of the model from a JSON file """
+        with open(filepath, 'r') as f:
+            self.labels = json.load(f)
+
+    def save_cluster_config(self, filepath):
+        """ Save the preprocessing settings the cluster was trained with to a JSON file """
+        cluster_config = {'tokenizer': self.tokenizer}
+        if self.keras_model:
+            cluster_config['sample_length'] = self._input_shape()[0]
+        with open(filepath, 'w') as f:
+            json.dump(cluster_config, f)
+
+    def load_cluster_config(self, filepath):
+        """ Load the preprocessing settings of a cluster from a JSON file """
+        with open(filepath, 'r') as f:
+            cluster_config = json.load(f)
+        self.tokenizer = get_tokenizer(cluster_config.get('tokenizer', 'nltk')).name
+        self.sample_length = cluster_config.get('sample_length')
+
     def save_model(self, filepath):
         """ Save the keras NN model to a HDF5 file """
         if not self.keras_model:
@@ -324,10 +815,40 @@ class DLTC(object):
 
         if os.path.exists(filepath):
             raise ValueError("File " + filepath + " already exists!")
-        self.keras_model.save(filepath)
+        with self.as_default():
+            self.keras_model.save(filepath)
+
+    def export_projection_tables(self, filepath, dtype=PROJECTION_DTYPE):
+        """
+        Build the projection tables of the 'cnn' network for the current word
+        vectors and save them to a file, see ProjectionTables
+        :param filepath: path of the .chp file
+        :param dtype: 'float32', or 'float16' to halve the size of the tables
+
+        :return: ProjectionTables object
+        """
+        if not self.keras_model:
+            raise ValueError("Can't export the projection tables, the model has not been trained yet")
+
+        with self.as_default():
+            projection = ProjectionTables.from_keras_model(
+                self.keras_model, self._get_vectorizer().vectors, dtype=dtype)
+        projection.save(filepath)
+
+        return projection
+
+    def load_projection_tables(self, filepath):
+        """ Load the projection tables predictions are served from """
+        projection = ProjectionTables.load(filepath)
+        if projection.vocabulary_size != len(self.word2vec_model.wv.vocab) or \
+                projection.sample_length != self._input_shape()[0]:
+            raise ValueError("The projection tables " + filepath + " do not match the model")
+
+        self.projection = projection
 
     def load_model(self, filepath):
         """ Load the keras NN model from a HDF5 file """
         if not os.path.exists(filepath):
             raise ValueError("File " + filepath + " does not exist")
-        self.keras_model = keras.models.load_model(filepath)
+        with self.as_default():
+            self.keras_model = keras.models.load_model(filepath)
@@ -0,0 +1,170 @@
+from __future__ import unicode_literals
+
+import os
+import re
+
+import numpy as np
+from keras.callbacks import Callback, EarlyStopping
+
+from coffeehouse_dltc.config import CHECKPOINT_PERIOD, CHECKPOINT_KEEP, \
+    EARLY_STOPPING_MONITOR
+
+CHECKPOINT_FORMAT = 'checkpoint_{epoch:04d}.chm'
+CHECKPOINT_PATTERN = re.compile(r'^checkpoint_(\d+)\.chm$')
+EARLY_STOPPING_FORMAT = 'checkpoint_{epoch:04d}.early_stopping.npz'
+
+
+class EpochCheckpoint(Callback):
+    """ Saves the full Keras model (weights and optimizer state) every N epochs.
+     The file is written under a temporary name and moved into place so that a
+     crash during saving never leaves a truncated checkpoint behind. """
+
+    def __init__(self, checkpoint_dir, period=CHECKPOINT_PERIOD, keep=CHECKPOINT_KEEP,
+                 early_stopping=None):
+        super(EpochCheckpoint, self).__init__()
+        self.checkpoint_dir = checkpoint_dir
+        self.period = period
+        self.keep = keep
+        self.early_stopping = early_stopping
+
+    def on_epoch_end(self, epoch, logs=None):
+        if (epoch + 1) % self.period != 0:
+            return
+
+        filepath = os.path.join(self.checkpoint_dir, CHECKPOINT_FORMAT.format(epoch=epoch + 1))
+        temporary_path = filepath + '.tmp'
+        self.model.save(temporary_path, overwrite=True)
+        os.replace(temporary_path, filepath)
+
+        if self.early_stopping is not None:
+            self.early_stopping.save_state(
+                os.path.join(self.checkpoint_dir, EARLY_STOPPING_FORMAT.format(epoch=epoch + 1)))
+
+        for old_epoch, old_path in list_checkpoints(self.checkpoint_dir)[:-self.keep]:
+            os.remove(old_path)
+            state_path = os.path.join(self.checkpoint_dir,
+                                      EARLY_STOPPING_FORMAT.format(epoch=old_epoch))
+            if os.path.exists(state_path):
+                os.remove(state_path)
+
+
+class ResumableEarlyStopping(EarlyStopping):
+    """ EarlyStopping whose counters and best weights are saved with every
+     checkpoint, so a resumed build stops at the same epoch and restores the
+     same weights as an uninterrupted one """
+
+    def __init__(self, state_path=None, **kwargs):
+        super(ResumableEarlyStopping, self).__init__(**kwargs)
+        self.state_path = state_path
+
+    def on_train_begin(self, logs=None):
+        super(ResumableEarlyStopping, self).on_train_begin(logs)
+        if self.state_path and os.path.exists(self.state_path):
+            self.load_state(self.state_path)
+
+    def save_state(self, filepath):
+        """
+        Save the counters and the best weights
+        :param filepath: path of the .npz file
+
+        :return: None
+        """
+        arrays = {'wait': np.asarray(self.wait), 'best': np.asarray(self.best)}
+        for i, weight in enumerate(getattr(self, 'best_weights', None) or []):
+            arrays['weight_{0}'.format(i)] = weight
+
+        temporary_path = filepath + '.tmp'
+        with open(temporary_path, 'wb') as f:
+            np.savez(f, **arrays)
+        os.replace(temporary_path, filepath)
+
+    def load_state(self, filepath):
+        """
+        Restore the counters and the best weights saved with save_state
+        :param filepath: path of the .npz file
+
+        :return: None
+        """
+        with np.load(filepath) as data:
+            self.wait = int(data['wait'])
+            self.best = float(data['best'])
+            weights = sorted((name for name in data.files if name.startswith('weight_')),
+                             key=lambda name: int(name[7:]))
+            self.best_weights = [data[name] for name in weights] or None
+
+
+def list_checkpoints(checkpoint_dir):
+    """
+    List the checkpoints saved in a directory
+    :param checkpoint_dir: directory the checkpoints were written to
+
+    :return: list of (epoch, path) tuples sorted by epoch
+    """
+    if not checkpoint_dir or not os.path.isdir(checkpoint_dir):
+        return []
+
+    checkpoints = []
+    for filename in os.listdir(checkpoint_dir):
+        match = CHECKPOINT_PATTERN.match(filename)
+        if match:
+            checkpoints.append((int(match.group(1)), os.path.join(checkpoint_dir, filename)))
+
+    return sorted(checkpoints)
+
+
+def latest_checkpoint(checkpoint_dir):
+    """
+    Find the most recent checkpoint in a directory
+    :param checkpoint_dir: directory the checkpoints were written to
+
+    :return: tuple (path, epoch), (None, 0) if there is no checkpoint
+    """
+    checkpoints = list_checkpoints(checkpoint_dir)
+    if not checkpoints:
+        return None, 0
+
+    epoch, path = checkpoints[-1]
+    return path, epoch
+
+
+def get_training_callbacks(checkpoint_dir=None, checkpoint_period=CHECKPOINT_PERIOD,
+                           early_stopping_patience=None,
+                           early_stopping_monitor=EARLY_STOPPING_MONITOR,
+                           early_stopping_min_delta=0.0, initial_epoch=0):
+    """
+    Build the built-in callbacks used while training
+    :param checkpoint_dir: directory to save checkpoints to, None disables checkpointing
+    :param checkpoint_period: save a checkpoint every N epochs
+    :param early_stopping_patience: number of epochs without improvement before
+    training stops, None disables early stopping
+    :param early_stopping_monitor: the quantity watched by early stopping e.g. 'val_loss'
+    :param early_stopping_min_delta: minimum change that counts as an improvement
+    :param initial_epoch: the epoch a resumed training continues from, the
+    early stopping state saved with its checkpoint is restored
+
+    :return: list of Keras callbacks
+    """
+    callbacks = []
+
+    # Early stopping runs first so the checkpoint of an epoch saves its updated state
+    early_stopping = None
+    if early_stopping_patience is not None:
+        state_path = os.path.join(checkpoint_dir, EARLY_STOPPING_FORMAT.format(
+            epoch=initial_epoch)) if checkpoint_dir and initial_epoch else None
+        early_stopping = ResumableEarlyStopping(
+            state_path=state_path,
+            monitor=early_stopping_monitor,
+            min_delta=early_stopping_min_delta,
+            patience=early_stopping_patience,
+            verbose=1,
+            restore_best_weights=True,
+        )
+        callbacks.append(early_stopping)
+
+    if checkpoint_dir and checkpoint_period:
+        if not os.path.isdir(checkpoint_dir):
+            raise ValueError('The checkpoint directory ' + checkpoint_dir + ' does not exist')
+        callbacks.append(EpochCheckpoint(checkpoint_dir, period=checkpoint_period,
+                                         early_stopping=early_stopping))
+
+    return callbacks
@@ -1,18 +1,26 @@
 from __future__ import unicode_literals, division
 
 import os
+import random
 import threading
+from collections import defaultdict
 
 import numpy as np
+import scipy.sparse as sp
+from keras.utils import Sequence
 
 from coffeehouse_dltc.base.document import Document
-from coffeehouse_dltc.config import BATCH_SIZE, SAMPLE_LENGTH
+from coffeehouse_dltc.config import BATCH_SIZE, SAMPLE_LENGTH, SPLIT_SEED, FEATURE_CHUNK_SIZE
+from coffeehouse_dltc.nn.vectorizer import WordVectorizer
 from coffeehouse_dltc.utils import get_answers_for_doc, load_from_disk
 
 
 def get_data_for_model(train_dir, labels, test_dir=None, nn_model=None,
                        as_generator=False, batch_size=BATCH_SIZE,
-                       word2vec_model=None, scaler=None):
+                       word2vec_model=None, scaler=None, test_ratio=0.0,
+                       split_seed=SPLIT_SEED, tokenizer=None, feature_dir=None,
+                       sample_weights=None, label_index=None, sparse_targets=False,
+                       sample_length=SAMPLE_LENGTH):
     """
     Get data in the form of matrices or generators for both train and test sets.
     :param train_dir: directory with train files
@@ -23,9 +31,25 @@ def get_data_for_model(train_dir, labels, test_dir=None, nn_model=None,
     :param batch_size: integer, size of the batch
     :param word2vec_model: trained w2v gensim model
     :param scaler: scaling object for X matrix normalisation e.g. StandardScaler
+    :param test_ratio: the ratio of the train files withheld for testing when
+    there is no test_dir, the split is stratified by label
+    :param split_seed: seed of the shuffle deciding which files are withheld
+    and of the order the training files are streamed in
+    :param tokenizer: name of the tokenizer backend, None uses the default one
+    :param feature_dir: directory to build the matrices into as memory-mapped
+    .npy files instead of building them in memory, ignored for generators
+    :param sample_weights: dictionary mapping file ids to their sample weight,
+    files which are not part of it weigh 1. None does not weight the samples
+    :param label_index: LabelIndex of the files, their labels are read from it
+    instead of the .lab files
+    :param sparse_targets: build y as a scipy CSR matrix instead of a dense
+    (N, labels) array, ignored for generators
+    :param sample_length: number of words kept per document, the input length
+    of the network
 
     :return: tuple with 2 elements for train and test data. Each element can be
-    either a pair of matrices (X, y) or their generator
+    either a pair of matrices (X, y) or their generator, or a triple (X, y, weights)
+    when sample_weights is given
     """
 
     kwargs = dict(
@@ -33,49 +57,174 @@ def get_data_for_model(train_dir, labels, test_dir=None, nn_model=None,
         word2vec_model=word2vec_model,
         scaler=scaler,
         nn_model=nn_model,
+        vectorizer=WordVectorizer(word2vec_model, scaler),
+        tokenizer=tokenizer,
+        label_index=label_index,
+        sample_length=sample_length,
     )
 
+    train_files = sorted({filename[:-4] for filename in os.listdir(train_dir)})
+    test_files = []
+    if test_ratio and not test_dir:
+        train_files, test_files = stratified_split(train_files, train_dir, test_ratio,
+                                                   seed=split_seed, label_index=label_index)
+
+    def build(files, file_directory, name):
+        index = label_index if file_directory == train_dir else None
+        if feature_dir and not as_generator:
+            if name == 'train':
+                # Keras only shuffles memory-mapped inputs in batch sized blocks, the
+                # rows are written in a random order so that a block mixes the labels
+                files = list(files)
+                random.Random(split_seed).shuffle(files)
+            data = build_x_and_y_memmap(files, file_directory, feature_dir, name,
+                                        **dict(kwargs, label_index=index,
+                                               sparse_targets=sparse_targets))
+        else:
+            data = build_x_and_y(files, file_directory,
+                                 **dict(kwargs, label_index=index, sparse_targets=sparse_targets))
+        if sample_weights is not None:
+            data += (get_sample_weights(files, sample_weights),)
+        return data
+
     if as_generator:
-        filename_it = FilenameIterator(train_dir, batch_size)
-        train_data = iterate_over_batches(filename_it, **kwargs)
+        filename_it = FilenameIterator(train_dir, batch_size, files=train_files, seed=split_seed)
+        train_data = iterate_over_batches(filename_it, sample_weights=sample_weights, **kwargs)
     else:
-        train_files = {filename[:-4] for filename in os.listdir(train_dir)}
-        train_data = build_x_and_y(train_files, train_dir, **kwargs)
+        train_data = build(train_files, train_dir, 'train')
 
     test_data = None
     if test_dir:
-        test_files = {filename[:-4] for filename in os.listdir(test_dir)}
-        test_data = build_x_and_y(test_files, test_dir, **kwargs)
+        test_files = sorted({filename[:-4] for filename in os.listdir(test_dir)})
+        test_data = build(test_files, test_dir, 'test')
+    elif test_files:
+        test_data = build(test_files, train_dir, 'test')
 
     return train_data, test_data
 
 
+def stratified_split(filenames, file_directory, test_ratio, seed=SPLIT_SEED, label_index=None):
+    """
+    Split file names into train and test sets, keeping the same ratio of test
+    files for every combination of labels. The split is decided on the names
+    only, before any feature is built.
+    :param filenames: iterable of strings showing file ids (no extension)
+    :param file_directory: path to a directory where the .lab files lie
+    :param test_ratio: the ratio of files withheld for testing
+    :param seed: seed of the shuffle deciding which files are withheld
+    :param label_index: LabelIndex of the files, None reads the .lab files
+
+    :return: tuple (train file names, test file names)
+    """
+    strata = defaultdict(list)
+    for fname, labels in zip(sorted(filenames),
+                             _get_labels(sorted(filenames), file_directory, label_index)):
+        strata[tuple(sorted(labels))].append(fname)
+
+    rng = random.Random(seed)
+    train_files, test_files = [], []
+    for key in sorted(strata):
+        files = strata[key]
+        rng.shuffle(files)
+        test_size = int(round(len(files) * test_ratio))
+        test_files.extend(files[:test_size])
+        train_files.extend(files[test_size:])
+
+    return sorted(train_files), sorted(test_files)
+
+
+def stratified_folds(filenames, file_directory, folds, seed=SPLIT_SEED, label_index=None):
+    """
+    Assign files to k folds for cross-validation, the files of every
+    combination of labels are dealt round robin so every fold holds the same
+    share of each combination and the folds differ in size by one file at most
+    :param filenames: list of strings showing file ids (no extension)
+    :param file_directory: path to a directory where the .lab files lie
+    :param folds: the number of folds
+    :param seed: seed of the shuffle deciding the fold of every file
+    :param label_index: LabelIndex of the files, None reads the .lab files
+
+    :return: numpy int32 array with the fold of every file, in the order of filenames
+    """
+    strata = defaultdict(list)
+    for i, labels in enumerate(_get_labels(filenames, file_directory, label_index)):
+        strata[tuple(sorted(labels))].append(i)
+
+    rng = random.Random(seed)
+    assignment = np.zeros(len(filenames), dtype=np.int32)
+    dealt = 0
+    for key in sorted(strata):
+        indices = strata[key]
+        rng.shuffle(indices)
+        for i in indices:
+            assignment[i] = dealt % folds
+            dealt += 1
+
+    return assignment
+
+
+def _get_labels(filenames, file_directory, label_index=None):
+    """ The labels of every file, from the label index when there is one """
+    for fname in filenames:
+        if label_index is not None:
+            yield label_index.answers(fname)
+        else:
+            yield get_answers_for_doc(fname + '.txt', file_directory)
+
+
 def build_x_and_y(filenames, file_directory, **kwargs):
     """
     Given file names and their directory, build (X, y) data matrices
     :param filenames: iterable of strings showing file ids (no extension)
     :param file_directory: path to a directory where those files lie
-    :param kwargs: additional necessary data for matrix building e.g. scaler
+    :param kwargs: additional necessary data for matrix building e.g. scaler,
+    a 'label_index' replaces the .lab files, 'sparse_targets' builds y as
+    a scipy CSR matrix and 'sample_length' sets the words kept per document
 
     :return: a tuple (X, y)
     """
     label_indices = kwargs['label_indices']
-    word2vec_model = kwargs['word2vec_model']
-    scaler = kwargs['scaler']
     nn_model = kwargs['nn_model']
+    label_index = kwargs.get('label_index')
+    vectorizer = kwargs.get('vectorizer') or \
+        WordVectorizer(kwargs['word2vec_model'], kwargs['scaler'])
+
+    sample_length = kwargs.get('sample_length') or SAMPLE_LENGTH
 
-    x_matrix = np.zeros((len(filenames), SAMPLE_LENGTH, word2vec_model.vector_size))
-    y_matrix = np.zeros((len(filenames), len(label_indices)), dtype=np.bool_)
+    x_matrix = np.zeros((len(filenames), sample_length, vectorizer.vector_size),
+                        dtype=np.float32)
 
     for doc_id, fname in enumerate(filenames):
-        doc = Document(doc_id, os.path.join(file_directory, fname + '.txt'))
-        words = doc.get_all_words()[:SAMPLE_LENGTH]
+        doc = Document(doc_id, os.path.join(file_directory, fname + '.txt'),
+                       tokenizer=kwargs.get('tokenizer'))
+        words = doc.get_all_words(limit=sample_length)
+        vectorizer.transform(words, sample_length, out=x_matrix[doc_id])
+
+    if label_index is not None:
+        y_matrix = label_index.targets(filenames, label_indices,
+                                       sparse=kwargs.get('sparse_targets', False))
+    else:
+        y_matrix = build_y(filenames, file_directory, label_indices,
+                           sparse=kwargs.get('sparse_targets', False))
+
+    if nn_model and type(nn_model.input) == list:
+        return [x_matrix] * len(nn_model.input), y_matrix
+    else:
+        return [x_matrix], y_matrix
+
 
-        for i, w in enumerate(words):
-            if w in word2vec_model.wv:
-                word_vector = word2vec_model.wv[w].reshape(1, -1)
-                x_matrix[doc_id][i] = scaler.transform(word_vector, copy=True)[0]
+def build_y(filenames, file_directory, label_indices, sparse=False):
+    """
+    Build the target matrix of files from their .lab files
+    :param filenames: iterable of strings showing file ids (no extension)
+    :param file_directory: path to a directory where the .lab files lie
+    :param label_indices: dictionary mapping the labels to their column
+    :param sparse: return a scipy CSR matrix instead of a dense array
 
+    :return: boolean matrix of shape (len(filenames), len(label_indices))
+    """
+    rows, columns = [], []
+    for doc_id, fname in enumerate(filenames):
         labels = get_answers_for_doc(
             fname + '.txt',
             file_directory,
@@ -83,8 +232,62 @@ def build_x_and_y(filenames, file_directory, **kwargs):
         )
 
         for lab in labels:
-            index = label_indices[lab]
-            y_matrix[doc_id][index] = True
+            rows.append(doc_id)
+            columns.append(label_indices[lab])
+
+    shape = (len(filenames), len(label_indices))
+    if sparse:
+        return sp.csr_matrix((np.ones(len(rows), dtype=np.bool_), (rows, columns)), shape=shape)
+
+    y_matrix = np.zeros(shape, dtype=np.bool_)
+    y_matrix[rows, columns] = True
+    return y_matrix
+
+
+def build_x_and_y_memmap(filenames, file_directory, feature_dir, name, **kwargs):
+    """
+    Build (X, y) like build_x_and_y, X is written in chunks to a memory-mapped
+    .npy file so it never has to fit in memory
+    :param filenames: iterable of strings showing file ids (no extension)
+    :param file_directory: path to a directory where those files lie
+    :param feature_dir: directory the .npy files are written to
+    :param name: prefix of the .npy files e.g. 'train'
+    :param kwargs: additional necessary data for matrix building e.g. scaler
+
+    :return: a tuple (X, y) where X is a read-only memory-mapped array
+    """
+    filenames = list(filenames)
+    nn_model = kwargs['nn_model']
+    vectorizer = kwargs.get('vectorizer') or \
+        WordVectorizer(kwargs['word2vec_model'], kwargs['scaler'])
+    kwargs = dict(kwargs, vectorizer=vectorizer, nn_model=None)
+
+    if not os.path.exists(feature_dir):
+        os.makedirs(feature_dir)
+
+    x_path = os.path.join(feature_dir, "{0}_x.npy".format(name))
+    x_matrix = np.lib.format.open_memmap(
+        x_path, mode='w+', dtype=np.float32,
+        shape=(len(filenames), kwargs.get('sample_length') or SAMPLE_LENGTH,
+               vectorizer.vector_size))
+
+    y_chunks = []
+    for start in range(0, len(filenames), FEATURE_CHUNK_SIZE):
+        end = start + FEATURE_CHUNK_SIZE
+        [x_chunk], y_chunk = build_x_and_y(filenames[start:end], file_directory, **kwargs)
+        x_matrix[start:end] = x_chunk
+        y_chunks.append(y_chunk)
+
+    if kwargs.get('sparse_targets'):
+        y_matrix = sp.vstack(y_chunks, format='csr') if y_chunks else \
+            sp.csr_matrix((0, len(kwargs['label_indices'])), dtype=np.bool_)
+    else:
+        y_matrix = np.concatenate(y_chunks) if y_chunks else \
+            np.zeros((0, len(kwargs['label_indices'])), dtype=np.bool_)
+
+    x_matrix.flush()
+    del x_matrix
+    x_matrix = np.load(x_path, mmap_mode='r')
 
     if nn_model and type(nn_model.input) == list:
         return [x_matrix] * len(nn_model.input), y_matrix
@@ -92,26 +295,101 @@ def build_x_and_y(filenames, file_directory, **kwargs):
         return [x_matrix], y_matrix
 
 
-def iterate_over_batches(filename_it, **kwargs):
+def get_sample_weights(filenames, sample_weights):
+    """
+    The sample weights of files
+    :param filenames: iterable of strings showing file ids (no extension)
+    :param sample_weights: dictionary mapping file ids to their sample weight
+
+    :return: numpy array of float32, 1 for the files without a weight
+    """
+    return np.array([sample_weights.get(fname, 1.0) for fname in filenames], dtype=np.float32)
+
+
+def iterate_over_batches(filename_it, sample_weights=None, **kwargs):
     """
     Iterate infinitely over a given filename iterator
     :param filename_it: FilenameIterator object
+    :param sample_weights: dictionary mapping file ids to their sample weight,
+    None yields no weights
     :param kwargs: additional necessary data for matrix building e.g. scaler
-    :return: yields tuples (X, y) when called
+    :return: yields tuples (X, y), or (X, y, weights), when called
     """
     while True:
         files = filename_it.next()
-        yield build_x_and_y(files, filename_it.dirname, **kwargs)
+        data = build_x_and_y(files, filename_it.dirname, **kwargs)
+        if sample_weights is not None:
+            data += (get_sample_weights(files, sample_weights),)
+        yield data
+
+
+class FeatureSequence(Sequence):
+    """ Feeds in-memory or memory-mapped inputs to Keras one batch at a time.
+     Sparse targets are only expanded to a dense array for the current batch,
+     so a large label vocabulary never needs a (N, labels) matrix, and a
+     subset of the samples can be selected by their indices without copying
+     the inputs. """
+
+    def __init__(self, x, y, batch_size=BATCH_SIZE, sample_weights=None, shuffle=True,
+                 seed=SPLIT_SEED, indices=None):
+        """
+        Public Constructor
+
+        :param x: list of input matrices, as returned by build_x_and_y
+        :param y: the targets, a numpy array or a scipy sparse matrix
+        :param batch_size: size of one batch
+        :param sample_weights: numpy array of the sample weights, None weighs every sample 1
+        :param shuffle: True draws the samples in a new random order every epoch,
+        'batch' keeps the samples of every batch together (Keras shuffles the
+        order of the batches) which suits memory-mapped inputs, False keeps the order
+        :param seed: seed of the sample shuffle
+        :param indices: the rows of x and y the sequence is made of, None uses all of them
+        """
+        self.x = x
+        self.y = sp.csr_matrix(y) if sp.issparse(y) else y
+        self.batch_size = batch_size
+        self.sample_weights = sample_weights
+        self.shuffle = shuffle
+        self.random_state = np.random.RandomState(seed)
+        self.order = np.array(indices if indices is not None else np.arange(self.y.shape[0]))
+        self.on_epoch_end()
+
+    def __len__(self):
+        return int(np.ceil(len(self.order) / self.batch_size))
+
+    def __getitem__(self, index):
+        rows = self.order[index * self.batch_size:(index + 1) * self.batch_size]
+        if self.shuffle is True:
+            # Sorted rows read memory-mapped inputs sequentially
+            rows = np.sort(rows)
+
+        y_batch = self.y[rows]
+        batch = ([x_matrix[rows] for x_matrix in self.x],
+                 y_batch.toarray() if sp.issparse(y_batch) else y_batch)
+        if self.sample_weights is not None:
+            batch += (self.sample_weights[rows],)
+
+        return batch
+
+    def on_epoch_end(self):
+        if self.shuffle is True:
+            self.random_state.shuffle(self.order)
 
 
 class FilenameIterator(object):
     """ A threadsafe iterator yielding a fixed number of filenames from a given
-     folder and looping forever. Can be used for external memory training. """
-    def __init__(self, dirname, batch_size):
+     folder and looping forever. Can be used for external memory training.
+     The filenames are shuffled at the start and on every pass, so a batch
+     mixes the labels instead of following the sorted filenames. """
+    def __init__(self, dirname, batch_size, files=None, seed=SPLIT_SEED):
         self.dirname = dirname
         self.batch_size = batch_size
         self.lock = threading.Lock()
-        self.files = list({filename[:-4] for filename in os.listdir(dirname)})
+        if files is None:
+            files = sorted({filename[:-4] for filename in os.listdir(dirname)})
+        self.files = list(files)
+        self.rng = random.Random(seed)
+        self.rng.shuffle(self.files)
         self.i = 0
 
     def __iter__(self):
@@ -122,10 +400,12 @@ class FilenameIterator(object):
 
             if self.i == len(self.files):
                 self.i = 0
+                self.rng.shuffle(self.files)
 
             batch = self.files[self.i:self.i + self.batch_size]
             if len(batch) < self.batch_size:
                 self.i = 0
+                self.rng.shuffle(self.files)
             else:
                 self.i += self.batch_size
 
@@ -0,0 +1,158 @@
+from __future__ import unicode_literals, division
+
+import numpy as np
+
+from coffeehouse_dltc.config import EVALUATION_THRESHOLD, EVALUATION_BINS
+
+
+class ClassificationMetrics(object):
+    """ Accumulates classification quality over batches of predictions with
+     constant memory. Scores are binned per label for positive and negative
+     samples, so threshold curves and per-label metrics at any threshold of
+     the grid are derived from cumulative sums of the histograms. """
+
+    def __init__(self, labels, bins=EVALUATION_BINS):
+        """
+        Public Constructor
+
+        :param labels: list of the labels in the order of the score columns
+        :param bins: number of score bins, thresholds are multiples of 1 / bins
+        """
+        self.labels = list(labels)
+        self.bins = bins
+        self.samples = 0
+
+        label_count = len(self.labels)
+        self.positive_histogram = np.zeros((label_count, bins), dtype=np.int64)
+        self.negative_histogram = np.zeros((label_count, bins), dtype=np.int64)
+        self.confusion = np.zeros((label_count, label_count), dtype=np.int64)
+
+    def update(self, y_true, y_score):
+        """
+        Add a batch of predictions
+        :param y_true: boolean array of shape (n, labels) with the expected labels
+        :param y_score: array of shape (n, labels) with the predicted confidence
+
+        :return: None
+        """
+        y_true = np.asarray(y_true, dtype=np.bool_)
+        y_score = np.asarray(y_score)
+        label_count = len(self.labels)
+
+        score_bins = np.minimum((y_score * self.bins).astype(np.int64), self.bins - 1)
+        score_bins = np.maximum(score_bins, 0)
+        flat = (np.arange(label_count) * self.bins + score_bins).ravel()
+        positives = y_true.ravel()
+
+        size = label_count * self.bins
+        self.positive_histogram += np.bincount(
+            flat[positives], minlength=size).reshape(label_count, self.bins)
+        self.negative_histogram += np.bincount(
+            flat[~positives], minlength=size).reshape(label_count, self.bins)
+
+        # The confusion matrix compares the first expected label with the top prediction
+        labelled = y_true.any(axis=1)
+        expected = np.argmax(y_true[labelled], axis=1)
+        predicted = np.argmax(y_score[labelled], axis=1)
+        self.confusion += np.bincount(
+            expected * label_count + predicted,
+            minlength=label_count * label_count).reshape(label_count, label_count)
+
+        self.samples += y_true.shape[0]
+
+    def thresholds(self):
+        """ The threshold grid the curves are computed on """
+        return np.arange(self.bins) / self.bins
+
+    def curves(self):
+        """
+        Count the true positives, false positives and false negatives of every
+        label at every threshold of the grid
+
+        :return: tuple of arrays (tp, fp, fn) of shape (labels, bins)
+        """
+        # Scores in bin b or above are predicted positive at threshold b / bins
+        tp = np.cumsum(self.positive_histogram[:, ::-1], axis=1)[:, ::-1]
+        fp = np.cumsum(self.negative_histogram[:, ::-1], axis=1)[:, ::-1]
+        fn = self.positive_histogram.sum(axis=1, keepdims=True) - tp
+        return tp, fp, fn
+
+    def threshold_curves(self):
+        """
+        Precision, recall and F1 of every label over the threshold grid
+
+        :return: dictionary of arrays of shape (labels, bins)
+        """
+        tp, fp, fn = self.curves()
+        precision, recall, f1 = _precision_recall_f1(tp, fp, fn)
+        return {
+            'thresholds': self.thresholds(),
+            'precision': precision,
+            'recall': recall,
+            'f1': f1,
+        }
+
+    def label_metrics(self, threshold=EVALUATION_THRESHOLD):
+        """
+        Precision, recall, F1 and support of every label at a threshold
+        :param threshold: labels scored at or above the threshold are predicted
+
+        :return: dictionary of the form {'label': {'precision': 0.9, ...}}
+        """
+        index = min(int(round(threshold * self.bins)), self.bins - 1)
+        tp, fp, fn = [counts[:, index] for counts in self.curves()]
+        precision, recall, f1 = _precision_recall_f1(tp, fp, fn)
+
+        return {
+            label: {
+                'precision': float(precision[i]),
+                'recall': float(recall[i]),
+                'f1': float(f1[i]),
+                'support': int(tp[i] + fn[i]),
+            }
+            for i, label in enumerate(self.labels)
+        }
+
+    def accuracy(self):
+        """ Fraction of the labelled samples where the top prediction is the expected label """
+        total = self.confusion.sum()
+        return float(np.trace(self.confusion) / total) if total else 0.0
+
+    def report(self, threshold=EVALUATION_THRESHOLD):
+        """
+        Summarize the accumulated metrics
+        :param threshold: the threshold the per-label metrics are computed at
+
+        :return: dictionary which can be serialized to JSON
+        """
+        label_metrics = self.label_metrics(threshold)
+        curves = self.threshold_curves()
+
+        return {
+            'samples': self.samples,
+            'threshold': threshold,
+            'accuracy': self.accuracy(),
+            'macro_f1': float(np.mean([m['f1'] for m in label_metrics.values()])),
+            'labels': label_metrics,
+            'confusion_matrix': {
+                'labels': self.labels,
+                'matrix': self.confusion.tolist(),
+            },
+            'threshold_curves': {
+                'thresholds': curves['thresholds'].tolist(),
+                'precision': dict(zip(self.labels, curves['precision'].tolist())),
+                'recall': dict(zip(self.labels, curves['recall'].tolist())),
+            },
+        }
+
+
+def _precision_recall_f1(tp, fp, fn):
+    """ Element-wise precision, recall and F1, 0 where undefined """
+    tp, fp, fn = [np.asarray(c, dtype=np.float64) for c in (tp, fp, fn)]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        precision = np.where(tp + fp > 0, tp / (tp + fp), 0.0)
+        recall = np.where(tp + fn > 0, tp / (tp + fn), 0.0)
+        f1 = np.where(precision + recall > 0,
+                      2 * precision * recall / (precision + recall), 0.0)
+
+    return precision, recall, f1
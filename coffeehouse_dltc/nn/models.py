@@ -1,20 +1,35 @@
-from keras.layers import Input, Dense, GRU, Dropout, BatchNormalization, MaxPooling1D, Conv1D, Flatten, Concatenate
+from keras.layers import Input, Dense, GRU, Dropout, BatchNormalization, MaxPooling1D, Conv1D, Flatten, Concatenate, \
+    Masking, GlobalAveragePooling1D, GlobalMaxPooling1D, SeparableConv1D
 from keras.models import Model
 
 from coffeehouse_dltc.config import SAMPLE_LENGTH
 
 
-def get_nn_model(nn_model, embedding, output_length):
+def get_nn_model(nn_model, embedding, output_length, sample_length=SAMPLE_LENGTH):
     if nn_model == 'cnn':
-        return cnn(embedding_size=embedding, output_length=output_length)
+        return cnn(embedding_size=embedding, output_length=output_length,
+                   sample_length=sample_length)
     elif nn_model == 'rnn':
-        return rnn(embedding_size=embedding, output_length=output_length)
+        return rnn(embedding_size=embedding, output_length=output_length,
+                   sample_length=sample_length)
+    elif nn_model == 'mlp':
+        return mlp(embedding_size=embedding, output_length=output_length,
+                   sample_length=sample_length)
+    elif nn_model == 'narrow-cnn':
+        return narrow_cnn(embedding_size=embedding, output_length=output_length,
+                          sample_length=sample_length)
+    elif nn_model == 'fasttext':
+        return fasttext(embedding_size=embedding, output_length=output_length,
+                        sample_length=sample_length)
+    elif nn_model == 'cnn-lite':
+        return cnn_lite(embedding_size=embedding, output_length=output_length,
+                        sample_length=sample_length)
     else:
         raise ValueError("Unknown NN type: {}".format(nn_model))
 
 
 # noinspection PyPep8Naming
-def cnn(embedding_size, output_length):
+def cnn(embedding_size, output_length, sample_length=SAMPLE_LENGTH):
     """ Create and return a keras model of a CNN """
 
     NB_FILTER = 256
@@ -23,7 +38,7 @@ def cnn(embedding_size, output_length):
     conv_layers, inputs = [], []
 
     for ngram_length in NGRAM_LENGTHS:
-        current_input = Input(shape=(SAMPLE_LENGTH, embedding_size))
+        current_input = Input(shape=(sample_length, embedding_size))
         inputs.append(current_input)
 
         convolution = Conv1D(
@@ -33,7 +48,7 @@ def cnn(embedding_size, output_length):
             activation='tanh',
         )(current_input)
 
-        pool_size = SAMPLE_LENGTH - ngram_length + 1
+        pool_size = sample_length - ngram_length + 1
         pooling = MaxPooling1D(pool_size=pool_size)(convolution)
         conv_layers.append(pooling)
 
@@ -53,16 +68,16 @@ def cnn(embedding_size, output_length):
     return model
 
 
-def rnn(embedding_size, output_length):
+def rnn(embedding_size, output_length, sample_length=SAMPLE_LENGTH):
     """ Create and return a keras model of a RNN """
     # noinspection PyPep8Naming
     HIDDEN_LAYER_SIZE = 256
 
-    inputs = Input(shape=(SAMPLE_LENGTH, embedding_size))
+    inputs = Input(shape=(sample_length, embedding_size))
 
     gru = GRU(
         HIDDEN_LAYER_SIZE,
-        input_shape=(SAMPLE_LENGTH, embedding_size),
+        input_shape=(sample_length, embedding_size),
         kernel_initializer="glorot_uniform",
         recurrent_initializer='normal',
         activation='relu',
@@ -81,3 +96,118 @@ def rnn(embedding_size, output_length):
     )
 
     return model
+
+
+def mlp(embedding_size, output_length, sample_length=SAMPLE_LENGTH):
+    """ Create and return a keras model averaging the word vectors of the
+     document followed by a small MLP, the padding is masked out of the average """
+    # noinspection PyPep8Naming
+    HIDDEN_LAYER_SIZE = 128
+
+    inputs = Input(shape=(sample_length, embedding_size))
+
+    masking = Masking(mask_value=0.0)(inputs)
+    average = GlobalAveragePooling1D()(masking)
+    hidden = Dense(HIDDEN_LAYER_SIZE, activation='relu')(average)
+    dropout = Dropout(0.2)(hidden)
+    outputs = Dense(output_length, activation='sigmoid')(dropout)
+
+    model = Model(inputs=inputs, outputs=outputs)
+
+    model.compile(
+        loss='binary_crossentropy',
+        optimizer='adam',
+        metrics=['top_k_categorical_accuracy'],
+    )
+
+    return model
+
+
+def narrow_cnn(embedding_size, output_length, sample_length=SAMPLE_LENGTH):
+    """ Create and return a keras model of a CNN with a single convolution width """
+    # noinspection PyPep8Naming
+    NB_FILTER = 64
+    # noinspection PyPep8Naming
+    NGRAM_LENGTH = 3
+
+    inputs = Input(shape=(sample_length, embedding_size))
+
+    convolution = Conv1D(
+        NB_FILTER,
+        NGRAM_LENGTH,
+        kernel_initializer='lecun_uniform',
+        activation='tanh',
+    )(inputs)
+
+    pooling = GlobalMaxPooling1D()(convolution)
+    dropout = Dropout(0.5)(pooling)
+    outputs = Dense(output_length, activation='sigmoid')(dropout)
+
+    model = Model(inputs=inputs, outputs=outputs)
+
+    model.compile(
+        loss='binary_crossentropy',
+        optimizer='adam',
+        metrics=['top_k_categorical_accuracy'],
+    )
+
+    return model
+
+
+def fasttext(embedding_size, output_length, sample_length=SAMPLE_LENGTH):
+    """ Create and return a keras model of a bag of word vectors, the masked
+     mean and the max of the word vectors are concatenated and fed to a single
+     dense layer. The max also covers the zero padding, which is the mean word
+     vector once the vectors are scaled """
+
+    inputs = Input(shape=(sample_length, embedding_size))
+
+    masking = Masking(mask_value=0.0)(inputs)
+    average = GlobalAveragePooling1D()(masking)
+    maximum = GlobalMaxPooling1D()(inputs)
+    merged = Concatenate()([average, maximum])
+    outputs = Dense(output_length, activation='sigmoid')(merged)
+
+    model = Model(inputs=inputs, outputs=outputs)
+
+    model.compile(
+        loss='binary_crossentropy',
+        optimizer='adam',
+        metrics=['top_k_categorical_accuracy'],
+    )
+
+    return model
+
+
+# noinspection PyPep8Naming
+def cnn_lite(embedding_size, output_length, sample_length=SAMPLE_LENGTH):
+    """ Create and return a keras model of a reduced CNN, two narrow branches
+     of depthwise separable convolutions sharing a single input """
+
+    NB_FILTER = 64
+    NGRAM_LENGTHS = [2, 3]
+
+    inputs = Input(shape=(sample_length, embedding_size))
+
+    conv_layers = []
+    for ngram_length in NGRAM_LENGTHS:
+        convolution = SeparableConv1D(
+            NB_FILTER,
+            ngram_length,
+            activation='relu',
+        )(inputs)
+        conv_layers.append(GlobalMaxPooling1D()(convolution))
+
+    merged = Concatenate()(conv_layers)
+    dropout = Dropout(0.5)(merged)
+    outputs = Dense(output_length, activation='sigmoid')(dropout)
+
+    model = Model(inputs=inputs, outputs=outputs)
+
+    model.compile(
+        loss='binary_crossentropy',
+        optimizer='adam',
+        metrics=['top_k_categorical_accuracy'],
+    )
+
+    return model
@@ -0,0 +1,275 @@
+from __future__ import print_function, unicode_literals, division
+
+import time
+
+import numpy as np
+from keras.layers import Conv1D, Concatenate, Dense, MaxPooling1D
+
+from coffeehouse_dltc.base.document import tokenize
+from coffeehouse_dltc.config import CLASSIFY_BATCH_SIZE, PROJECTION_DTYPE
+
+
+class ProjectionTables(object):
+    """ Serves the 'cnn' architecture without a matrix multiply over the word
+     vectors. The first convolution of every branch is linear in the scaled
+     vector of each word of its window, so the contribution of every word of
+     the vocabulary at every offset of the kernel is computed once. A window
+     is then the sum of one gathered row per offset, the max-pooling and the
+     tanh are swapped (tanh is monotonic) and the dense output layer is
+     applied with numpy. Padding and out of vocabulary words map to a row of
+     zeros, exactly like the zero vectors the network is fed. """
+
+    def __init__(self, kernel_sizes, tables, biases, dense_kernel, dense_bias, sample_length):
+        """
+        Public Constructor
+
+        :param kernel_sizes: the width of the convolution of every branch
+        :param tables: for every branch an array of shape (width, vocabulary + 1,
+        filters), the last row of every offset is the zero row
+        :param biases: the bias of the convolution of every branch
+        :param dense_kernel: kernel of the output layer
+        :param dense_bias: bias of the output layer
+        :param sample_length: number of words the network reads per document
+        """
+        self.kernel_sizes = [int(size) for size in kernel_sizes]
+        self.tables = list(tables)
+        self.biases = [np.asarray(bias, dtype=np.float32) for bias in biases]
+        self.dense_kernel = np.asarray(dense_kernel, dtype=np.float32)
+        self.dense_bias = np.asarray(dense_bias, dtype=np.float32)
+        self.sample_length = int(sample_length)
+        self.vocabulary_size = self.tables[0].shape[1] - 1
+
+    @classmethod
+    def from_keras_model(cls, keras_model, vectors, dtype=PROJECTION_DTYPE):
+        """
+        Build the tables of a trained 'cnn' network, has to run in the graph
+        and session the network belongs to
+        :param keras_model: the Keras model of the 'cnn' architecture
+        :param vectors: the scaled word vectors, as built by WordVectorizer
+        :param dtype: 'float32', or 'float16' to halve the size of the tables
+
+        :return: ProjectionTables object
+        """
+        output = keras_model.layers[-1]
+        concatenate = [layer for layer in keras_model.layers if isinstance(layer, Concatenate)]
+        if not isinstance(output, Dense) or output.activation.__name__ != 'sigmoid' \
+                or len(concatenate) != 1:
+            raise ValueError("Projection tables can only be built for the 'cnn' architecture")
+
+        sample_length = keras_model.input_shape[0][1] if type(keras_model.input) == list \
+            else keras_model.input_shape[1]
+
+        kernel_sizes, tables, biases = [], [], []
+        for pooling in _inbound_layers(concatenate[0]):
+            convolution = _inbound_layers(pooling)[0] if isinstance(pooling, MaxPooling1D) else None
+            if not isinstance(convolution, Conv1D) or convolution.activation.__name__ != 'tanh' \
+                    or convolution.padding != 'valid' or convolution.strides != (1,) \
+                    or convolution.dilation_rate != (1,) \
+                    or pooling.pool_size[0] != sample_length - convolution.kernel_size[0] + 1:
+                raise ValueError("Projection tables can only be built for the 'cnn' architecture")
+
+            kernel, bias = convolution.get_weights()
+            table = np.zeros((kernel.shape[0], len(vectors) + 1, kernel.shape[2]), dtype=dtype)
+            for offset in range(kernel.shape[0]):
+                table[offset, :-1] = np.dot(vectors, kernel[offset])
+
+            kernel_sizes.append(kernel.shape[0])
+            tables.append(table)
+            biases.append(bias)
+
+        dense_kernel, dense_bias = output.get_weights()
+        return cls(kernel_sizes, tables, biases, dense_kernel, dense_bias, sample_length)
+
+    @classmethod
+    def load(cls, filepath):
+        """
+        Load tables saved with save
+        :param filepath: path of the .chp file
+
+        :return: ProjectionTables object
+        """
+        with np.load(filepath) as data:
+            kernel_sizes = data['kernel_sizes']
+            return cls(
+                kernel_sizes,
+                [data['table_{0}'.format(i)] for i in range(len(kernel_sizes))],
+                [data['bias_{0}'.format(i)] for i in range(len(kernel_sizes))],
+                data['dense_kernel'],
+                data['dense_bias'],
+                data['sample_length'],
+            )
+
+    def save(self, filepath):
+        """
+        Save the tables as an uncompressed .npz file
+        :param filepath: path of the .chp file
+
+        :return: None
+        """
+        arrays = {'kernel_sizes': np.asarray(self.kernel_sizes),
+                  'dense_kernel': self.dense_kernel,
+                  'dense_bias': self.dense_bias,
+                  'sample_length': np.asarray(self.sample_length)}
+        for i, (table, bias) in enumerate(zip(self.tables, self.biases)):
+            arrays['table_{0}'.format(i)] = table
+            arrays['bias_{0}'.format(i)] = bias
+
+        with open(filepath, 'wb') as f:
+            np.savez(f, **arrays)
+
+    @property
+    def nbytes(self):
+        """ The memory used by the tables """
+        return sum(table.nbytes for table in self.tables)
+
+    def word_ids(self, token_lists, index):
+        """
+        Look up the table rows of tokenized documents
+        :param token_lists: list of token lists, one per document
+        :param index: dictionary mapping the words to their row in the word vectors
+
+        :return: tuple (int32 array of shape (documents, sample_length) where
+        padding and unknown words are the zero row, array of the document lengths)
+        """
+        ids = np.full((len(token_lists), self.sample_length), self.vocabulary_size, dtype=np.int32)
+        lengths = np.zeros(len(token_lists), dtype=np.int64)
+        for i, words in enumerate(token_lists):
+            words = words[:self.sample_length]
+            lengths[i] = len(words)
+            for position, word in enumerate(words):
+                row = index.get(word)
+                if row is not None:
+                    ids[i, position] = row
+
+        return ids, lengths
+
+    def predict_ids(self, ids, lengths=None):
+        """
+        Run the network on documents given as table rows. Windows starting
+        after the longest document only hold padding, they are not gathered
+        and count as a pre-activation of 0 in the max-pooling
+        :param ids: int array of shape (documents, sample_length), see word_ids
+        :param lengths: the length of every document, None gathers every window
+
+        :return: numpy array of shape (documents, number of labels)
+        """
+        longest = self.sample_length if lengths is None or not len(lengths) \
+            else max(1, int(np.max(lengths)))
+
+        features = []
+        for size, table, bias in zip(self.kernel_sizes, self.tables, self.biases):
+            windows = self.sample_length - size + 1
+            gathered = min(windows, longest)
+
+            activations = table[0][ids[:, :gathered]].astype(np.float32)
+            for offset in range(1, size):
+                activations += table[offset][ids[:, offset:offset + gathered]]
+
+            pooled = activations.max(axis=1)
+            if gathered < windows:
+                np.maximum(pooled, 0.0, out=pooled)
+            features.append(np.tanh(pooled + bias))
+
+        logits = np.dot(np.concatenate(features, axis=1), self.dense_kernel) + self.dense_bias
+        return 1.0 / (1.0 + np.exp(-logits))
+
+    def predict_tokens(self, token_lists, index):
+        """
+        Run the network on tokenized documents
+        :param token_lists: list of token lists, one per document
+        :param index: dictionary mapping the words to their row in the word vectors
+
+        :return: numpy array of shape (documents, number of labels)
+        """
+        ids, lengths = self.word_ids(token_lists, index)
+        return self.predict_ids(ids, lengths)
+
+
+def _inbound_layers(layer):
+    """ The layers feeding a layer of a functional model """
+    inbound_layers = layer._inbound_nodes[0].inbound_layers
+    return inbound_layers if isinstance(inbound_layers, list) else [inbound_layers]
+
+
+def compare_projection(dltc, texts, batch_size=CLASSIFY_BATCH_SIZE):
+    """
+    Compare the projection tables of a DLTC with its Keras network on the same
+    messages, the latency is measured from the tokens so tokenization is
+    left out of both paths
+    :param dltc: DLTC with a loaded model cluster and projection tables
+    :param texts: list of messages
+    :param batch_size: number of messages per batch for the batched latency
+
+    :return: dictionary with the differences of the outputs and the latencies
+    """
+    sample_length, embedding_size = dltc._input_shape()
+    vectorizer = dltc._get_vectorizer()
+    projection = dltc.projection
+
+    def network(token_lists):
+        x_matrix = np.zeros((len(token_lists), sample_length, embedding_size), dtype=np.float32)
+        for i, words in enumerate(token_lists):
+            vectorizer.transform(words, sample_length, out=x_matrix[i])
+        return dltc._predict_matrix(x_matrix)
+
+    def tables(token_lists):
+        return projection.predict_tokens(token_lists, vectorizer.index)
+
+    token_lists = [tokenize(text, dltc.tokenizer, sample_length) for text in texts]
+    batches = [token_lists[i:i + batch_size] for i in range(0, len(token_lists), batch_size)]
+    y_network = np.concatenate([network(batch) for batch in batches])
+    y_tables = np.concatenate([tables(batch) for batch in batches])
+
+    difference = np.abs(y_network - y_tables)
+    report = {
+        'samples': len(token_lists),
+        'dtype': str(projection.tables[0].dtype),
+        'table_size': int(projection.nbytes),
+        'max_abs_error': float(difference.max()),
+        'mean_abs_error': float(difference.mean()),
+        'top_label_agreement': float(np.mean(
+            np.argmax(y_network, axis=1) == np.argmax(y_tables, axis=1))),
+        'label_agreement': float(np.mean((y_network >= 0.5) == (y_tables >= 0.5))),
+    }
+
+    for name, predict in (('network', network), ('tables', tables)):
+        predict(token_lists[:1])
+        start = time.time()
+        for words in token_lists:
+            predict([words])
+        report['{0}_single_ms'.format(name)] = (time.time() - start) / len(token_lists) * 1000
+
+        start = time.time()
+        for batch in batches:
+            predict(batch)
+        report['{0}_batch_ms'.format(name)] = (time.time() - start) / len(batches) * 1000
+
+    report['batch_size'] = min(batch_size, len(token_lists))
+    report['single_speedup'] = report['network_single_ms'] / report['tables_single_ms'] \
+        if report['tables_single_ms'] else 0.0
+    report['batch_speedup'] = report['network_batch_ms'] / report['tables_batch_ms'] \
+        if report['tables_batch_ms'] else 0.0
+
+    return report
+
+
+def print_projection_report(report):
+    """
+    Print a comparison of the projection tables with the network
+    :param report: dictionary returned by compare_projection
+
+    :return: None
+    """
+    print(
+        "\n--- Projection Tables ---\n\n"
+        "   Tables          : {dtype}, {0:.1f} MB\n"
+        "   Messages        : {samples}\n"
+        "   Max abs. error  : {max_abs_error:.2e}\n"
+        "   Mean abs. error : {mean_abs_error:.2e}\n"
+        "   Agreement       : {top_label_agreement:.4f} (top label), {label_agreement:.4f} "
+        "(labels at 0.5)\n"
+        "   Single message  : {network_single_ms:.2f}ms -> {tables_single_ms:.2f}ms "
+        "({single_speedup:.1f}x)\n"
+        "   Batch of {batch_size:<6} : {network_batch_ms:.2f}ms -> {tables_batch_ms:.2f}ms "
+        "({batch_speedup:.1f}x)\n".format(report['table_size'] / 1024 ** 2, **report)
+    )
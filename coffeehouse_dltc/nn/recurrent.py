@@ -0,0 +1,139 @@
+from __future__ import unicode_literals, division
+
+import numpy as np
+from keras.layers import GRU, BatchNormalization, Dropout, Dense, InputLayer
+
+ACTIVATIONS = {
+    'relu': lambda x: np.maximum(x, 0.0),
+    'tanh': np.tanh,
+    'linear': lambda x: x,
+    'sigmoid': lambda x: 1.0 / (1.0 + np.exp(-x)),
+    'hard_sigmoid': lambda x: np.clip(0.2 * x + 0.5, 0.0, 1.0),
+}
+
+
+class GRUStepper(object):
+    """ Runs the 'rnn' architecture one word at a time with numpy so the hidden
+     state can be kept between calls. The GRU follows the Keras 2 equations
+     (gates z, r, h in the kernels, the reset gate applied before the
+     recurrent kernel), the batch normalization uses its moving statistics
+     and the dropout is left out as in inference. """
+
+    def __init__(self, kernel, recurrent_kernel, bias, activation, recurrent_activation,
+                 normalization, dense_kernel, dense_bias, sample_length):
+        """
+        Public Constructor
+
+        :param kernel: input kernel of the GRU, shape (embedding, 3 x units)
+        :param recurrent_kernel: recurrent kernel of the GRU, shape (units, 3 x units)
+        :param bias: bias of the GRU, shape (3 x units)
+        :param activation: name of the activation of the candidate state
+        :param recurrent_activation: name of the activation of the gates
+        :param normalization: tuple (scale, offset) the batch normalization
+        reduces to at inference
+        :param dense_kernel: kernel of the output layer
+        :param dense_bias: bias of the output layer
+        :param sample_length: number of words the network reads per document
+        """
+        self.units = recurrent_kernel.shape[0]
+        self.kernel = np.asarray(kernel, dtype=np.float32)
+        self.recurrent_kernel = np.asarray(recurrent_kernel, dtype=np.float32)
+        self.bias = np.asarray(bias, dtype=np.float32)
+        self.activation = ACTIVATIONS[activation]
+        self.recurrent_activation = ACTIVATIONS[recurrent_activation]
+        self.scale, self.offset = normalization
+        self.dense_kernel = np.asarray(dense_kernel, dtype=np.float32)
+        self.dense_bias = np.asarray(dense_bias, dtype=np.float32)
+        self.sample_length = int(sample_length)
+
+    @classmethod
+    def from_keras_model(cls, keras_model):
+        """
+        Extract the weights of a trained 'rnn' network, has to run in the graph
+        and session the network belongs to
+        :param keras_model: the Keras model of the 'rnn' architecture
+
+        :return: GRUStepper object
+        """
+        layers = [layer for layer in keras_model.layers
+                  if not isinstance(layer, (InputLayer, Dropout))]
+        if [type(layer) for layer in layers] != [GRU, BatchNormalization, Dense]:
+            raise ValueError("Only the 'rnn' architecture can be run one word at a time")
+
+        gru, normalization, output = layers
+        if gru.reset_after or not gru.use_bias or gru.go_backwards or gru.return_sequences \
+                or gru.activation.__name__ not in ACTIVATIONS \
+                or gru.recurrent_activation.__name__ not in ACTIVATIONS:
+            raise ValueError("Only the 'rnn' architecture can be run one word at a time")
+
+        kernel, recurrent_kernel, bias = gru.get_weights()
+
+        weights = dict(zip(('gamma', 'beta', 'moving_mean', 'moving_variance'),
+                           _normalization_weights(normalization)))
+        scale = weights['gamma'] / np.sqrt(weights['moving_variance'] + normalization.epsilon)
+        offset = weights['beta'] - weights['moving_mean'] * scale
+
+        dense_kernel, dense_bias = output.get_weights()
+        return cls(kernel, recurrent_kernel, bias, gru.activation.__name__,
+                   gru.recurrent_activation.__name__,
+                   (scale.astype(np.float32), offset.astype(np.float32)),
+                   dense_kernel, dense_bias, keras_model.input_shape[1])
+
+    def initial_state(self):
+        """ The hidden state before the first word """
+        return np.zeros(self.units, dtype=np.float32)
+
+    def project(self, vectors):
+        """
+        Apply the input kernel to word vectors, which does not depend on the state
+        :param vectors: numpy array of shape (words, embedding)
+
+        :return: numpy array of shape (words, 3 x units)
+        """
+        return np.dot(vectors, self.kernel) + self.bias
+
+    def advance(self, state, projected):
+        """
+        Advance the hidden state over words
+        :param state: the hidden state, numpy array of shape (units,)
+        :param projected: the words, as returned by project
+
+        :return: the new hidden state
+        """
+        units = self.units
+        recurrent_gates = self.recurrent_kernel[:, :2 * units]
+        recurrent_candidate = self.recurrent_kernel[:, 2 * units:]
+
+        for x in projected:
+            gates = self.recurrent_activation(x[:2 * units] + np.dot(state, recurrent_gates))
+            z, r = gates[:units], gates[units:]
+            candidate = self.activation(x[2 * units:] + np.dot(r * state, recurrent_candidate))
+            state = z * state + (1.0 - z) * candidate
+
+        return state.astype(np.float32)
+
+    def finish(self, state, words):
+        """
+        The output of the network for a document of which the state covers
+        the first words, the remaining positions are zero padding
+        :param state: the hidden state after the words of the document
+        :param words: the number of positions the state covers
+
+        :return: numpy array of the confidence of every label
+        """
+        padding = self.sample_length - words
+        if padding > 0:
+            state = self.advance(state, np.broadcast_to(self.bias, (padding, len(self.bias))))
+
+        hidden = state * self.scale + self.offset
+        logits = np.dot(hidden, self.dense_kernel) + self.dense_bias
+        return 1.0 / (1.0 + np.exp(-logits))
+
+
+def _normalization_weights(layer):
+    """ gamma, beta, moving mean and moving variance of a BatchNormalization layer """
+    weights = list(layer.get_weights())
+    size = weights[-1].shape[0]
+    gamma = weights.pop(0) if layer.scale else np.ones(size, dtype=np.float32)
+    beta = weights.pop(0) if layer.center else np.zeros(size, dtype=np.float32)
+    return [gamma, beta] + weights
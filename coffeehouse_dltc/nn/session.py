@@ -0,0 +1,68 @@
+from __future__ import unicode_literals
+
+import os
+from contextlib import contextmanager
+
+import tensorflow as tf
+from keras import backend as K
+
+
+def create_session(graph=None, intra_op_threads=None, inter_op_threads=None):
+    """
+    Create a TensorFlow session with explicit thread limits
+    :param graph: the graph the session runs, None for the default graph
+    :param intra_op_threads: threads used to parallelize a single operation,
+    None lets TensorFlow decide
+    :param inter_op_threads: threads used to run independent operations
+    concurrently, None lets TensorFlow decide
+
+    :return: TensorFlow session
+    """
+    config = tf.ConfigProto(
+        intra_op_parallelism_threads=intra_op_threads or 0,
+        inter_op_parallelism_threads=inter_op_threads or 0,
+    )
+    return tf.Session(graph=graph, config=config)
+
+
+def configure_threads(intra_op_threads=None, inter_op_threads=None):
+    """
+    Limit the number of threads used by TensorFlow in the current process
+    :param intra_op_threads: threads used to parallelize a single operation,
+    None lets TensorFlow decide
+    :param inter_op_threads: threads used to run independent operations
+    concurrently, None lets TensorFlow decide
+
+    :return: the new TensorFlow session
+    """
+    session = create_session(intra_op_threads=intra_op_threads,
+                             inter_op_threads=inter_op_threads)
+    K.set_session(session)
+
+    return session
+
+
+@contextmanager
+def thread_environment(threads=None):
+    """
+    Limit the OpenMP and MKL thread pools of the processes started inside the
+    context. The pools are sized when numpy and TensorFlow are imported, which
+    a spawned worker does before its initializer runs, so the limit has to be
+    in the environment it inherits from the parent
+    :param threads: threads per pool, None leaves the environment unchanged
+
+    :return: context manager
+    """
+    names = ('OMP_NUM_THREADS', 'MKL_NUM_THREADS')
+    previous = {name: os.environ.get(name) for name in names}
+    if threads:
+        for name in names:
+            os.environ[name] = str(threads)
+    try:
+        yield
+    finally:
+        for name, value in previous.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
@@ -0,0 +1,56 @@
+from __future__ import unicode_literals
+
+import numpy as np
+
+
+class WordVectorizer(object):
+    """ Turns tokens into scaled word vectors. The scaler is applied to the whole
+     vocabulary once, so vectorizing a document is a dictionary lookup and a
+     single gather instead of one scaler call per word. """
+
+    def __init__(self, word2vec_model, scaler):
+        self.word2vec_model = word2vec_model
+        self.scaler = scaler
+        self.vector_size = word2vec_model.vector_size
+        self.index = {word: vocab.index for word, vocab in word2vec_model.wv.vocab.items()}
+        self.vectors = scaler.transform(
+            np.asarray(word2vec_model.wv.vectors, dtype=np.float32), copy=True
+        ).astype(np.float32)
+
+    def __contains__(self, word):
+        return word in self.index
+
+    def indices(self, words):
+        """
+        Look up the vocabulary indices of the words, out of vocabulary words are skipped
+        :param words: list of tokens
+
+        :return: tuple (list of indices, list of positions they were found at)
+        """
+        indices, positions = [], []
+        for i, w in enumerate(words):
+            index = self.index.get(w)
+            if index is not None:
+                indices.append(index)
+                positions.append(i)
+
+        return indices, positions
+
+    def transform(self, words, sample_length, out=None):
+        """
+        Build the zero padded matrix of scaled word vectors for a document
+        :param words: list of tokens
+        :param sample_length: number of tokens the matrix holds
+        :param out: optional (sample_length, vector_size) array to write into,
+        it has to be zeroed already
+
+        :return: numpy array of shape (sample_length, vector_size)
+        """
+        if out is None:
+            out = np.zeros((sample_length, self.vector_size), dtype=np.float32)
+
+        indices, positions = self.indices(words[:sample_length])
+        if indices:
+            out[positions] = self.vectors[indices]
+
+        return out
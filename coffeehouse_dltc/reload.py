@@ -0,0 +1,276 @@
+from __future__ import print_function, unicode_literals, division
+
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+from coffeehouse_dltc.config import RELOAD_POLL_INTERVAL
+from coffeehouse_dltc.main import DLTC
+
+
+class _Generation(object):
+    """ One loaded model cluster and the number of calls using it """
+
+    __slots__ = ('dltc', 'version', 'fingerprint', 'loaded_at', 'references', 'retired')
+
+    def __init__(self, dltc, version, fingerprint):
+        self.dltc = dltc
+        self.version = version
+        self.fingerprint = fingerprint
+        self.loaded_at = time.time()
+        self.references = 0
+        self.retired = False
+
+
+class ReloadableCluster(object):
+    """ Serves a model cluster which can be replaced while it is being used.
+     A new cluster is loaded and warmed up next to the current one, without
+     holding any lock, and then swapped in by replacing a single reference.
+     Every call holds a reference to the cluster it started on, so calls in
+     flight finish on the old cluster and its session and memory are only
+     released once the last of them returned. A failed reload keeps serving
+     the current cluster. """
+
+    def __init__(self, model_directory, intra_op_threads=None, inter_op_threads=None,
+                 projection=True):
+        """
+        Public Constructor, loads the cluster
+
+        :param model_directory: the directory of the built model cluster
+        :param intra_op_threads: threads TensorFlow may use per operation in every cluster
+        :param inter_op_threads: threads TensorFlow may use to run operations concurrently
+        :param projection: serve the predictions from the projection tables
+        when the cluster has them
+        """
+        self.model_directory = model_directory
+        self.intra_op_threads = intra_op_threads
+        self.inter_op_threads = inter_op_threads
+        self.projection = projection
+
+        self.lock = threading.Lock()
+        self.reload_lock = threading.Lock()
+        self.last_error = None
+        self.watcher = None
+
+        self.current = None
+        self.current = self._load(model_directory, version=1)
+
+    @property
+    def version(self):
+        """ The number of clusters loaded so far, the current one included """
+        return self.current.version
+
+    @property
+    def labels(self):
+        return self.current.dltc.labels
+
+    @contextmanager
+    def acquire(self):
+        """
+        Use the current cluster, it is not released before the context exits
+        even when a reload swaps it meanwhile
+
+        :return: context manager yielding the DLTC object
+        """
+        with self.lock:
+            generation = self.current
+            generation.references += 1
+        try:
+            yield generation.dltc
+        finally:
+            with self.lock:
+                generation.references -= 1
+                release = generation.retired and generation.references == 0
+            if release:
+                self._release(generation)
+
+    def predict_from_text(self, text):
+        """
+        Predict labels for a given string of text with the current cluster
+        :param text: string or unicode with the text
+        :return: dictionary of labels and confidence intervals
+        """
+        with self.acquire() as dltc:
+            return dltc.predict_from_text(text)
+
+    def predict_from_texts(self, texts, **kwargs):
+        """
+        Predict labels for many strings of text with the current cluster, see
+        DLTC.predict_from_texts
+        :param texts: iterable of strings
+        :return: list with a dictionary of labels and confidence intervals per text
+        """
+        with self.acquire() as dltc:
+            return dltc.predict_from_texts(texts, **kwargs)
+
+    def predict_tokens(self, token_lists):
+        """
+        Predict labels for already tokenized documents with the current cluster
+        :param token_lists: list of token lists, one per document
+        :return: tuple (labels, numpy array of shape (documents, labels)), the
+        labels are returned as well since they may change with a reload
+        """
+        with self.acquire() as dltc:
+            return dltc.labels, dltc.predict_tokens(token_lists)
+
+    def reload(self, model_directory=None, background=False):
+        """
+        Load a cluster and swap it in once it is warmed up, reloads are
+        serialized
+        :param model_directory: the directory of the new cluster, None reloads
+        the current directory
+        :param background: load in a new thread and return immediately
+
+        :return: the version of the new cluster, or the thread when loading in
+        the background. Errors are raised, or stored in last_error in the background
+        """
+        if background:
+            thread = threading.Thread(target=self._reload_quietly, args=(model_directory,),
+                                      name='dltc-reload')
+            thread.daemon = True
+            thread.start()
+            return thread
+
+        with self.reload_lock:
+            model_directory = model_directory or self.model_directory
+            try:
+                generation = self._load(model_directory, version=self.current.version + 1)
+            except Exception as e:
+                self.last_error = e
+                raise
+
+            with self.lock:
+                previous = self.current
+                self.current = generation
+                previous.retired = True
+                release = previous.references == 0
+            self.model_directory = model_directory
+            self.last_error = None
+
+        if release:
+            self._release(previous)
+
+        print("Reloaded '{0}' as version {1}".format(model_directory, generation.version))
+        return generation.version
+
+    def watch(self, interval=RELOAD_POLL_INTERVAL):
+        """
+        Reload whenever the files of the cluster directory change. The
+        directory is polled, a change is only loaded once the files stayed
+        the same for one more interval so a build still being copied is not
+        picked up half written
+        :param interval: seconds between two polls
+
+        :return: None
+        """
+        if self.watcher is not None:
+            raise RuntimeError("The cluster is already being watched")
+
+        self.watcher = _DirectoryWatcher(self, interval)
+        self.watcher.start()
+
+    def close(self):
+        """
+        Stop watching and release the current cluster once it is unused
+
+        :return: None
+        """
+        if self.watcher is not None:
+            self.watcher.stop()
+            self.watcher = None
+
+        with self.lock:
+            generation = self.current
+            generation.retired = True
+            release = generation.references == 0
+        if release:
+            self._release(generation)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _reload_quietly(self, model_directory):
+        """ Reload and report an error instead of raising it, returns whether it succeeded """
+        try:
+            self.reload(model_directory)
+            return True
+        except Exception as e:
+            print("ERROR: Reloading '{0}' failed, the current cluster is kept: {1}".format(
+                model_directory or self.model_directory, e), file=sys.stderr)
+            return False
+
+    def _load(self, model_directory, version):
+        """ Load and warm up a cluster without touching the current one """
+        fingerprint = cluster_fingerprint(model_directory)
+        dltc = DLTC(intra_op_threads=self.intra_op_threads,
+                    inter_op_threads=self.inter_op_threads)
+        try:
+            dltc.load_model_cluster(model_directory, warmup=True, projection=self.projection)
+        except Exception:
+            # A broken cluster must not keep its graph and session alive
+            dltc.close()
+            raise
+
+        # The statistics continue across reloads
+        if self.current is not None and self.current.dltc.telemetry is not None:
+            dltc.enable_telemetry(self.current.dltc.telemetry)
+
+        return _Generation(dltc, version, fingerprint)
+
+    @staticmethod
+    def _release(generation):
+        """ Free the memory of a retired cluster """
+        generation.dltc.close()
+
+
+class _DirectoryWatcher(threading.Thread):
+    """ Polls the files of a cluster directory and reloads it on a change """
+
+    def __init__(self, cluster, interval):
+        super(_DirectoryWatcher, self).__init__(name='dltc-watcher')
+        self.daemon = True
+        self.cluster = cluster
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        pending = failed = None
+        while not self.stopped.wait(self.interval):
+            fingerprint = cluster_fingerprint(self.cluster.model_directory)
+            if fingerprint == self.cluster.current.fingerprint or fingerprint == failed:
+                pending = None
+            elif fingerprint != pending:
+                # Wait one more interval for the files to settle
+                pending = fingerprint
+            else:
+                pending = None
+                # The same broken files are not loaded again until they change
+                failed = None if self.cluster._reload_quietly(None) else fingerprint
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+def cluster_fingerprint(model_directory):
+    """
+    The size and modification time of every file of a model cluster, a
+    missing file is recorded as None
+    :param model_directory: the directory of the built model cluster
+
+    :return: tuple which changes whenever a file of the cluster is replaced
+    """
+    fingerprint = []
+    for component, filepath in sorted(DLTC.cluster_files(model_directory).items()):
+        try:
+            stat = os.stat(filepath)
+            fingerprint.append((component, stat.st_size, stat.st_mtime))
+        except OSError:
+            fingerprint.append((component, None))
+
+    return tuple(fingerprint)
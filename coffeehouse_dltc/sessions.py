@@ -0,0 +1,230 @@
+from __future__ import print_function, unicode_literals, division
+
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from coffeehouse_dltc.base.document import tokenize
+from coffeehouse_dltc.config import SESSION_IDLE_TIMEOUT, SESSION_MAX_SESSIONS
+from coffeehouse_dltc.nn.recurrent import GRUStepper
+
+
+class _Session(object):
+    """ The state of one conversation, its lock serializes the updates of
+     the conversation """
+
+    __slots__ = ('state', 'words', 'scores', 'last_used', 'lock')
+
+    def __init__(self, state):
+        self.state = state
+        self.words = 0
+        self.scores = None
+        self.last_used = time.time()
+        self.lock = threading.Lock()
+
+
+class ConversationSessions(object):
+    """ Classifies conversations which grow one message at a time with an
+     'rnn' model cluster. The hidden state of the GRU is kept per conversation
+     and only advanced over the words of the new message, which is the only
+     text that is tokenized. The network reads the first sample_length words
+     of a document, so once a conversation reaches them its scores no longer
+     change and are returned without any computation. Before that, scoring
+     replays the GRU over the remaining padding positions, so an update costs
+     up to sample_length steps whatever the length of the message. Only the
+     bookkeeping of the sessions is serialized, every conversation is
+     computed under its own lock. Sessions idle for longer than idle_timeout,
+     and the least recently used sessions beyond max_sessions, are evicted. """
+
+    def __init__(self, dltc, idle_timeout=SESSION_IDLE_TIMEOUT,
+                 max_sessions=SESSION_MAX_SESSIONS):
+        """
+        Public Constructor
+
+        :param dltc: DLTC with a loaded 'rnn' model cluster
+        :param idle_timeout: seconds after which an unused session is evicted,
+        None keeps idle sessions
+        :param max_sessions: number of sessions kept at most, None does not limit them
+        """
+        self.dltc = dltc
+        self.idle_timeout = idle_timeout
+        self.max_sessions = max_sessions
+
+        with dltc.as_default():
+            self.stepper = GRUStepper.from_keras_model(dltc.keras_model)
+        self.vectorizer = dltc._get_vectorizer()
+
+        self.sessions = OrderedDict()
+        self.lock = threading.Lock()
+        self.evicted = 0
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def __contains__(self, session_id):
+        return session_id in self.sessions
+
+    def update(self, session_id, text):
+        """
+        Append a message to a conversation and classify the conversation, a
+        new session is started for an unknown session_id
+        :param session_id: hashable identifier of the conversation
+        :param text: the new message
+
+        :return: dictionary of labels and confidence intervals
+        """
+        with self.lock:
+            self._evict_idle(time.time())
+            session = self.sessions.get(session_id)
+            if session is None:
+                session = _Session(self.stepper.initial_state())
+                self.sessions[session_id] = session
+            self.sessions.move_to_end(session_id)
+            session.last_used = time.time()
+            self._evict_overflow()
+
+        # Tokenizing needs no lock, it stops once the window is full. The
+        # words are trimmed again below in case another update came first
+        words = []
+        remaining = self.stepper.sample_length - session.words
+        if remaining > 0:
+            with self.dltc._stage('tokenize'):
+                words = tokenize(text, self.dltc.tokenizer, remaining) if text else []
+
+        with session.lock:
+            words = words[:self.stepper.sample_length - session.words]
+            computed = bool(words) or session.scores is None
+            if computed:
+                vectors = np.zeros((len(words), self.vectorizer.vector_size), dtype=np.float32)
+                self.vectorizer.transform(words, len(words), out=vectors)
+                session.state = self.stepper.advance(
+                    session.state, self.stepper.project(vectors))
+                session.words += len(words)
+                session.scores = self.stepper.finish(session.state, session.words)
+
+            scores = session.scores
+
+        # A conversation whose window is full reuses its scores
+        if self.dltc.telemetry is not None:
+            self.dltc.telemetry.count_cache(not computed)
+
+        return dict(zip(self.dltc.labels, scores))
+
+    def scores(self, session_id):
+        """
+        The scores of a conversation without appending to it
+        :param session_id: identifier of the conversation
+
+        :return: dictionary of labels and confidence intervals, None for an unknown session
+        """
+        with self.lock:
+            session = self.sessions.get(session_id)
+            if session is None or session.scores is None:
+                return None
+            return dict(zip(self.dltc.labels, session.scores))
+
+    def close(self, session_id):
+        """
+        Forget a conversation
+        :param session_id: identifier of the conversation
+
+        :return: True when the session existed
+        """
+        with self.lock:
+            return self.sessions.pop(session_id, None) is not None
+
+    def evict_idle(self, now=None):
+        """
+        Evict the sessions which were not used for idle_timeout seconds, the
+        sessions are kept in the order they were last used
+        :param now: the current time, None uses time.time()
+
+        :return: number of evicted sessions
+        """
+        with self.lock:
+            return self._evict_idle(now if now is not None else time.time())
+
+    def _evict_idle(self, now):
+        """ Evict the idle sessions, the lock has to be held """
+        if self.idle_timeout is None:
+            return 0
+
+        deadline = now - self.idle_timeout
+        evicted = 0
+        while self.sessions:
+            session_id, session = next(iter(self.sessions.items()))
+            if session.last_used > deadline:
+                break
+            del self.sessions[session_id]
+            evicted += 1
+
+        self.evicted += evicted
+        return evicted
+
+    def _evict_overflow(self):
+        """ Evict the least recently used sessions beyond max_sessions """
+        while self.max_sessions is not None and len(self.sessions) > self.max_sessions:
+            self.sessions.popitem(last=False)
+            self.evicted += 1
+
+
+def compare_sessions(dltc, messages):
+    """
+    Classify a conversation message by message with a session and with the
+    whole network on all the words so far, to verify that both agree and to
+    compare the cost of an update
+    :param dltc: DLTC with a loaded 'rnn' model cluster
+    :param messages: list of messages forming one conversation
+
+    :return: dictionary with the largest difference of the scores, the
+    average time of an update of both paths, and the part of a session update
+    spent replaying the padding
+    """
+    sessions = ConversationSessions(dltc, idle_timeout=None)
+    sample_length, _ = dltc._input_shape()
+
+    words, history = [], []
+    session_time = network_time = network_tokens_time = padding_time = 0.0
+    padding_steps = 0
+    max_abs_error = 0.0
+    for message in messages:
+        start = time.time()
+        scores = sessions.update(0, message)
+        session_time += time.time() - start
+
+        # The padding replay of the update, timed again on its own
+        session = sessions.sessions[0]
+        padding_steps += sample_length - session.words
+        start = time.time()
+        sessions.stepper.finish(session.state, session.words)
+        padding_time += time.time() - start
+
+        # The network path re-tokenizes and re-runs the whole conversation
+        history.append(message)
+        start = time.time()
+        dltc.predict_tokens([tokenize('\n'.join(history), dltc.tokenizer, sample_length)])
+        network_time += time.time() - start
+
+        # The scores are compared on the same words, so only the numbers differ
+        words.extend(tokenize(message, dltc.tokenizer, sample_length) if message else [])
+        start = time.time()
+        y_network = dltc.predict_tokens([words[:sample_length]])[0]
+        network_tokens_time += time.time() - start
+        y_session = np.array([scores[label] for label in dltc.labels])
+        max_abs_error = max(max_abs_error, float(np.max(np.abs(y_session - y_network))))
+
+    updates = max(1, len(messages))
+    return {
+        'messages': len(messages),
+        'words': len(words),
+        'max_abs_error': max_abs_error,
+        'session_update_ms': session_time / updates * 1000,
+        'padding_ms': padding_time / updates * 1000,
+        'padding_steps': padding_steps / updates,
+        'network_update_ms': network_time / updates * 1000,
+        'network_tokens_ms': network_tokens_time / updates * 1000,
+        'speedup': network_time / session_time if session_time else 0.0,
+        'tokens_speedup': network_tokens_time / session_time if session_time else 0.0,
+    }
@@ -0,0 +1,266 @@
+from __future__ import unicode_literals, division
+
+import bisect
+import threading
+import time
+
+from coffeehouse_dltc.config import TELEMETRY_LATENCY_BUCKETS, TELEMETRY_TOKEN_BUCKETS, \
+    TELEMETRY_BATCH_BUCKETS, TELEMETRY_OOV_BUCKETS
+
+STAGES = ('tokenize', 'vectorize', 'network')
+COUNTERS = ('documents', 'batches', 'tokens', 'oov_tokens', 'cache_hits', 'cache_misses')
+
+
+class Histogram(object):
+    """ Counts observations into fixed buckets, each bucket holds the
+     observations up to and including its upper bound """
+
+    def __init__(self, buckets):
+        """
+        Public Constructor
+
+        :param buckets: sorted upper bounds of the buckets, an overflow bucket
+        for the larger values is added
+        """
+        self.buckets = [float(bound) for bound in buckets]
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value, times=1):
+        """
+        Add an observation
+        :param value: the observed value
+        :param times: number of times the value was observed
+
+        :return: None
+        """
+        self.counts[bisect.bisect_left(self.buckets, value)] += times
+        self.count += times
+        self.sum += value * times
+
+    def quantile(self, q):
+        """
+        Estimate a quantile from the buckets, the upper bound of the bucket it
+        falls into is returned
+        :param q: the quantile, between 0 and 1
+
+        :return: float, None when nothing was observed, inf for the overflow bucket
+        """
+        if not self.count:
+            return None
+
+        rank = q * self.count
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            if cumulative >= rank:
+                return bound
+
+        return float('inf')
+
+    def stats(self):
+        """ Dictionary with the count, the sum, the mean, estimated quantiles and the buckets """
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'mean': self.sum / self.count if self.count else None,
+            'p50': self.quantile(0.5),
+            'p90': self.quantile(0.9),
+            'p99': self.quantile(0.99),
+            'buckets': dict(zip([str(bound) for bound in self.buckets] + ['+Inf'], self.counts)),
+        }
+
+
+class _Stage(object):
+    """ Context manager adding its duration to a latency histogram """
+
+    __slots__ = ('telemetry', 'name', 'start')
+
+    def __init__(self, telemetry, name):
+        self.telemetry = telemetry
+        self.name = name
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.telemetry.observe_latency(self.name, time.time() - self.start)
+
+
+class _NoStage(object):
+    """ Context manager doing nothing, used while telemetry is disabled """
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+
+NO_STAGE = _NoStage()
+
+
+class Telemetry(object):
+    """ Collects statistics of the prediction path of a DLTC: the latency of
+     tokenization, vectorization and the network, the tokens per document,
+     the share of tokens which are out of vocabulary, the batch sizes sent to
+     the network and the cache hits of conversation sessions. A rising out of
+     vocabulary ratio means the messages drift away from the training data.
+     Recording takes a lock and a few additions per batch, the statistics can
+     be read as a dictionary or as a Prometheus text snapshot. """
+
+    def __init__(self):
+        """
+        Public Constructor
+        """
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """
+        Forget everything recorded so far
+
+        :return: None
+        """
+        with self.lock:
+            self.started = time.time()
+            self.latency = {stage: Histogram(TELEMETRY_LATENCY_BUCKETS) for stage in STAGES}
+            self.tokens_per_document = Histogram(TELEMETRY_TOKEN_BUCKETS)
+            self.oov_ratio = Histogram(TELEMETRY_OOV_BUCKETS)
+            self.batch_size = Histogram(TELEMETRY_BATCH_BUCKETS)
+            self.counters = dict.fromkeys(COUNTERS, 0)
+
+    def stage(self, name):
+        """
+        Time a stage of the prediction path
+        :param name: one of 'tokenize', 'vectorize' or 'network'
+
+        :return: context manager
+        """
+        return _Stage(self, name)
+
+    def observe_latency(self, name, seconds):
+        """
+        Record the duration of a stage
+        :param name: one of 'tokenize', 'vectorize' or 'network'
+        :param seconds: the duration
+
+        :return: None
+        """
+        with self.lock:
+            self.latency[name].observe(seconds)
+
+    def observe_batch(self, token_lists, index, sample_length):
+        """
+        Record a batch of tokenized documents sent to the network
+        :param token_lists: list of token lists, one per document
+        :param index: the vocabulary, words which are not part of it are out of vocabulary
+        :param sample_length: number of tokens the network reads per document
+
+        :return: None
+        """
+        measurements = []
+        for words in token_lists:
+            words = words[:sample_length]
+            measurements.append((len(words), sum(1 for word in words if word not in index)))
+
+        with self.lock:
+            self.batch_size.observe(len(token_lists))
+            self.counters['batches'] += 1
+            self.counters['documents'] += len(token_lists)
+            for tokens, oov_tokens in measurements:
+                self.tokens_per_document.observe(tokens)
+                self.counters['tokens'] += tokens
+                self.counters['oov_tokens'] += oov_tokens
+                if tokens:
+                    self.oov_ratio.observe(oov_tokens / tokens)
+
+    def count_cache(self, hit):
+        """
+        Record a lookup of a cached result
+        :param hit: True when the result was reused
+
+        :return: None
+        """
+        with self.lock:
+            self.counters['cache_hits' if hit else 'cache_misses'] += 1
+
+    def stats(self):
+        """
+        The statistics recorded so far
+
+        :return: dictionary which can be serialized to JSON
+        """
+        with self.lock:
+            counters = dict(self.counters)
+            lookups = counters['cache_hits'] + counters['cache_misses']
+            return {
+                'uptime': time.time() - self.started,
+                'counters': counters,
+                'oov_ratio': counters['oov_tokens'] / counters['tokens']
+                if counters['tokens'] else None,
+                'cache_hit_ratio': counters['cache_hits'] / lookups if lookups else None,
+                'latency': {stage: histogram.stats() for stage, histogram in self.latency.items()},
+                'tokens_per_document': self.tokens_per_document.stats(),
+                'document_oov_ratio': self.oov_ratio.stats(),
+                'batch_size': self.batch_size.stats(),
+            }
+
+    def prometheus(self, prefix='coffeehouse_dltc', labels=None):
+        """
+        The statistics recorded so far in the Prometheus text exposition format
+        :param prefix: prefix of the metric names
+        :param labels: optional dictionary of labels added to every sample,
+        e.g. the name of the model
+
+        :return: string
+        """
+        lines = []
+        with self.lock:
+            for name in COUNTERS:
+                metric = "{0}_{1}_total".format(prefix, name)
+                lines.append("# TYPE {0} counter".format(metric))
+                lines.append("{0}{1} {2}".format(metric, _labels(labels), self.counters[name]))
+
+            metric = "{0}_stage_latency_seconds".format(prefix)
+            lines.append("# TYPE {0} histogram".format(metric))
+            for stage in STAGES:
+                lines.extend(_histogram_lines(metric, self.latency[stage],
+                                              dict(labels or {}, stage=stage)))
+
+            for name, histogram in (('tokens_per_document', self.tokens_per_document),
+                                    ('document_oov_ratio', self.oov_ratio),
+                                    ('batch_size', self.batch_size)):
+                metric = "{0}_{1}".format(prefix, name)
+                lines.append("# TYPE {0} histogram".format(metric))
+                lines.extend(_histogram_lines(metric, histogram, labels))
+
+        return '\n'.join(lines) + '\n'
+
+
+def _labels(labels):
+    """ The label set of a Prometheus sample """
+    if not labels:
+        return ''
+    return '{' + ','.join('{0}="{1}"'.format(
+        key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for key, value in sorted(labels.items())) + '}'
+
+
+def _histogram_lines(metric, histogram, labels):
+    """ The cumulative buckets, the sum and the count of a histogram """
+    lines = []
+    cumulative = 0
+    for bound, count in zip(histogram.buckets + [float('inf')], histogram.counts):
+        cumulative += count
+        le = '+Inf' if bound == float('inf') else repr(bound)
+        lines.append("{0}_bucket{1} {2}".format(metric, _labels(dict(labels or {}, le=le)),
+                                                cumulative))
+    lines.append("{0}_sum{1} {2!r}".format(metric, _labels(labels), histogram.sum))
+    lines.append("{0}_count{1} {2}".format(metric, _labels(labels), histogram.count))
+    return lines
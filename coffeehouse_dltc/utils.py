@@ -12,6 +12,7 @@ import random
 from collections import Counter, defaultdict
 
 from coffeehouse_dltc.base.document import Document
+from coffeehouse_dltc.base.label_index import load_label_index
 
 
 def save_to_disk(path_to_disk, obj, overwrite=False):
@@ -34,13 +35,14 @@ def load_from_disk(path_to_disk):
     return pickle.load(open(path_to_disk, 'rb'))
 
 
-def get_documents(data_dir, as_generator=True, shuffle=False):
+def get_documents(data_dir, as_generator=True, shuffle=False, tokenizer=None):
     """
     Extract documents from *.txt files in a given directory
     :param data_dir: path to the directory with .txt files
     :param as_generator: flag whether to return a document generator or a list
     :param shuffle: flag whether to return the documents
     in a shuffled vs sorted order
+    :param tokenizer: name of the tokenizer backend the documents use
 
     :return: generator or a list of Document objects
     """
@@ -49,14 +51,15 @@ def get_documents(data_dir, as_generator=True, shuffle=False):
     if shuffle:
         random.shuffle(files)
 
-    generator = (Document(doc_id, os.path.join(data_dir, f + '.txt'))
+    generator = (Document(doc_id, os.path.join(data_dir, f + '.txt'), tokenizer=tokenizer)
                  for doc_id, f in enumerate(files))
     return generator if as_generator else list(generator)
 
 
 def get_all_answers(data_dir, filtered_by=None):
     """
-    Extract ground truth answers from *.lab files in a given directory
+    Extract ground truth answers from *.lab files in a given directory, the
+    label index of the directory is used instead when there is one
     :param data_dir: path to the directory with .lab files
     :param filtered_by: whether to filter the answers.
 
@@ -65,6 +68,10 @@ def get_all_answers(data_dir, filtered_by=None):
     answers = dict()
 
     files = {filename[:-4] for filename in os.listdir(data_dir)}
+    label_index = load_label_index(data_dir, documents=len(files))
+    if label_index is not None:
+        return label_index.all_answers(filtered_by=filtered_by)
+
     for f in files:
         answers[f] = get_answers_for_doc(f + '.txt',
                                          data_dir,
@@ -107,6 +114,10 @@ def calculate_label_distribution(data_dir, filtered_by=None):
     :return: list of KV pairs of the form (14, ['lab1', 'lab2']), which means
              that both lab1 and lab2 were labels in 14 documents
     """
+    label_index = _get_label_index(data_dir)
+    if label_index is not None:
+        return label_index.label_distribution(filtered_by=filtered_by)
+
     answers = [kw for v in get_all_answers(data_dir, filtered_by=filtered_by).values()
                for kw in v]
     counts = Counter(answers)
@@ -121,11 +132,21 @@ def calculate_label_distribution(data_dir, filtered_by=None):
 def calculate_number_of_labels_distribution(data_dir, filtered_by=None):
     """ Look how many papers are there with 3 labels, 4 labels etc.
      Return a histogram. """
+    label_index = _get_label_index(data_dir)
+    if label_index is not None:
+        return label_index.number_of_labels_distribution(filtered_by=filtered_by)
+
     answers = get_all_answers(data_dir, filtered_by=filtered_by).values()
     lengths = [len(ans_set) for ans_set in answers]
     return Counter(lengths).items()
 
 
+def _get_label_index(data_dir):
+    """ The label index of a directory, None when it has none or it is stale """
+    return load_label_index(
+        data_dir, documents=len({filename[:-4] for filename in os.listdir(data_dir)}))
+
+
 def get_coverage_ratio_for_label_subset(no_of_labels, hist=None):
     """
     Compute fraction of the samples we would be able to predict, if we reduce
@@ -0,0 +1,122 @@
+from __future__ import unicode_literals, division
+
+import os
+
+import numpy as np
+import pytest
+import tensorflow as tf
+
+from coffeehouse_dltc.nn.models import cnn, mlp
+from coffeehouse_dltc.nn.projection import ProjectionTables
+from coffeehouse_dltc.nn.session import create_session
+
+SAMPLE_LENGTH = 12
+EMBEDDING_SIZE = 8
+LABELS = 3
+VOCABULARY = ['word{0}'.format(i) for i in range(30)]
+
+DOCUMENTS = [
+    [],
+    ['word0'],
+    ['word1', 'word2'],
+    ['unknown', 'word3', 'missing'],
+    ['word4', 'word5', 'word6', 'word7', 'word8'],
+    ['oov'] * 4,
+    VOCABULARY[:SAMPLE_LENGTH],
+    VOCABULARY + ['unknown'],
+]
+
+
+@pytest.fixture(scope='module')
+def network():
+    """ A small untrained 'cnn' network, the scaled word vectors and their
+     index. The tests using it run in the graph and session of the network """
+    rng = np.random.RandomState(0)
+    vectors = rng.normal(size=(len(VOCABULARY), EMBEDDING_SIZE)).astype(np.float32)
+    index = {word: i for i, word in enumerate(VOCABULARY)}
+
+    graph = tf.Graph()
+    session = create_session(graph)
+    with graph.as_default(), session.as_default():
+        keras_model = cnn(EMBEDDING_SIZE, LABELS, sample_length=SAMPLE_LENGTH)
+        yield keras_model, vectors, index
+
+    session.close()
+
+
+def _padded_matrix(token_lists, vectors, index):
+    """ The input the network is fed, unknown words and padding are zero vectors """
+    x_matrix = np.zeros((len(token_lists), SAMPLE_LENGTH, EMBEDDING_SIZE), dtype=np.float32)
+    for i, words in enumerate(token_lists):
+        for position, word in enumerate(words[:SAMPLE_LENGTH]):
+            if word in index:
+                x_matrix[i, position] = vectors[index[word]]
+    return x_matrix
+
+
+def _network_predict(keras_model, token_lists, vectors, index):
+    x_matrix = _padded_matrix(token_lists, vectors, index)
+    return keras_model.predict([x_matrix] * len(keras_model.inputs))
+
+
+@pytest.mark.parametrize('dtype, tolerance', [('float32', 1e-5), ('float16', 2e-2)])
+def test_tables_match_network(network, dtype, tolerance):
+    keras_model, vectors, index = network
+    tables = ProjectionTables.from_keras_model(keras_model, vectors, dtype=dtype)
+    assert tables.tables[0].dtype == np.dtype(dtype)
+    assert tables.vocabulary_size == len(VOCABULARY)
+
+    y_network = _network_predict(keras_model, DOCUMENTS, vectors, index)
+    ids, lengths = tables.word_ids(DOCUMENTS, index)
+    np.testing.assert_allclose(tables.predict_ids(ids, lengths), y_network, atol=tolerance)
+    # Gathering every window has to give the same result as skipping the padding
+    np.testing.assert_allclose(tables.predict_ids(ids), y_network, atol=tolerance)
+    np.testing.assert_allclose(tables.predict_tokens(DOCUMENTS, index), y_network, atol=tolerance)
+
+
+@pytest.mark.parametrize('document', DOCUMENTS)
+def test_single_documents_match_network(network, document):
+    keras_model, vectors, index = network
+    tables = ProjectionTables.from_keras_model(keras_model, vectors, dtype='float32')
+
+    np.testing.assert_allclose(tables.predict_tokens([document], index),
+                               _network_predict(keras_model, [document], vectors, index),
+                               atol=1e-5)
+
+
+def test_oov_and_padding_use_the_zero_row(network):
+    keras_model, vectors, index = network
+    tables = ProjectionTables.from_keras_model(keras_model, vectors)
+
+    ids, lengths = tables.word_ids([['unknown', 'word3'], VOCABULARY + ['unknown']], index)
+    assert ids[0, 0] == len(VOCABULARY) and ids[0, 1] == index['word3']
+    assert np.all(ids[0, 2:] == len(VOCABULARY))
+    assert list(lengths) == [2, SAMPLE_LENGTH]
+    for table in tables.tables:
+        assert not np.any(table[:, -1])
+
+
+def test_save_and_load(network, tmpdir):
+    keras_model, vectors, index = network
+    tables = ProjectionTables.from_keras_model(keras_model, vectors, dtype='float16')
+    filepath = os.path.join(str(tmpdir), 'model.chp')
+    tables.save(filepath)
+
+    loaded = ProjectionTables.load(filepath)
+    assert loaded.kernel_sizes == tables.kernel_sizes
+    assert loaded.sample_length == SAMPLE_LENGTH
+    np.testing.assert_array_equal(loaded.predict_tokens(DOCUMENTS, index),
+                                  tables.predict_tokens(DOCUMENTS, index))
+
+
+def test_other_architectures_are_rejected():
+    graph = tf.Graph()
+    session = create_session(graph)
+    try:
+        with graph.as_default(), session.as_default():
+            keras_model = mlp(EMBEDDING_SIZE, LABELS, sample_length=SAMPLE_LENGTH)
+            with pytest.raises(ValueError):
+                ProjectionTables.from_keras_model(
+                    keras_model, np.zeros((len(VOCABULARY), EMBEDDING_SIZE), dtype=np.float32))
+    finally:
+        session.close()
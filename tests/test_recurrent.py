@@ -0,0 +1,89 @@
+from __future__ import unicode_literals, division
+
+import numpy as np
+import pytest
+import tensorflow as tf
+
+from coffeehouse_dltc.nn.models import cnn, rnn
+from coffeehouse_dltc.nn.recurrent import GRUStepper
+from coffeehouse_dltc.nn.session import create_session
+
+SAMPLE_LENGTH = 12
+EMBEDDING_SIZE = 8
+LABELS = 3
+
+
+@pytest.fixture(scope='module')
+def network():
+    """ A small untrained 'rnn' network with random batch normalization
+     statistics and a batch of documents of every length, unknown words and
+     padding are zero vectors. The tests using it run in the graph and
+     session of the network """
+    rng = np.random.RandomState(0)
+    x_matrix = rng.normal(size=(SAMPLE_LENGTH + 1, SAMPLE_LENGTH, EMBEDDING_SIZE))
+    x_matrix = x_matrix.astype(np.float32)
+    lengths = np.arange(SAMPLE_LENGTH + 1)
+    for i, length in enumerate(lengths):
+        x_matrix[i, length:] = 0.0
+    x_matrix[SAMPLE_LENGTH, 2] = 0.0
+
+    graph = tf.Graph()
+    session = create_session(graph)
+    with graph.as_default(), session.as_default():
+        keras_model = rnn(EMBEDDING_SIZE, LABELS, sample_length=SAMPLE_LENGTH)
+        normalization = keras_model.layers[2]
+        normalization.set_weights([
+            rng.uniform(0.5, 1.5, size=weight.shape).astype(np.float32)
+            for weight in normalization.get_weights()
+        ])
+        yield keras_model, x_matrix, lengths
+
+    session.close()
+
+
+def test_stepper_matches_network(network):
+    keras_model, x_matrix, lengths = network
+    stepper = GRUStepper.from_keras_model(keras_model)
+    assert stepper.sample_length == SAMPLE_LENGTH
+
+    y_network = keras_model.predict(x_matrix)
+    for i, length in enumerate(lengths):
+        state = stepper.advance(stepper.initial_state(), stepper.project(x_matrix[i, :length]))
+        np.testing.assert_allclose(stepper.finish(state, length), y_network[i], atol=1e-4)
+
+
+def test_stepping_in_parts_matches_network(network):
+    keras_model, x_matrix, _ = network
+    stepper = GRUStepper.from_keras_model(keras_model)
+
+    # A conversation growing by messages of 1, 3, 5 and the remaining 3 words
+    state, words = stepper.initial_state(), 0
+    for end in (1, 4, 9, SAMPLE_LENGTH):
+        state = stepper.advance(state, stepper.project(x_matrix[-1, words:end]))
+        words = end
+        y_network = keras_model.predict(np.concatenate(
+            [x_matrix[-1:, :end], np.zeros((1, SAMPLE_LENGTH - end, EMBEDDING_SIZE),
+                                           dtype=np.float32)], axis=1))
+        np.testing.assert_allclose(stepper.finish(state, words), y_network[0], atol=1e-4)
+
+
+def test_finish_does_not_change_the_state(network):
+    keras_model, x_matrix, _ = network
+    stepper = GRUStepper.from_keras_model(keras_model)
+
+    state = stepper.advance(stepper.initial_state(), stepper.project(x_matrix[-1, :3]))
+    copy = state.copy()
+    stepper.finish(state, 3)
+    np.testing.assert_array_equal(state, copy)
+
+
+def test_other_architectures_are_rejected():
+    graph = tf.Graph()
+    session = create_session(graph)
+    try:
+        with graph.as_default(), session.as_default():
+            keras_model = cnn(EMBEDDING_SIZE, LABELS, sample_length=SAMPLE_LENGTH)
+            with pytest.raises(ValueError):
+                GRUStepper.from_keras_model(keras_model)
+    finally:
+        session.close()
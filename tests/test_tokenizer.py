@@ -0,0 +1,135 @@
+from __future__ import unicode_literals
+
+import io
+import json
+import os
+
+import pytest
+
+from coffeehouse_dltc.base.tokenizer import NltkTokenizer, RegexTokenizer, get_tokenizer, \
+    compare_tokenizers
+from coffeehouse_dltc.main import DLTC
+
+# Single sentences the regex backend has to tokenize exactly like nltk
+PARITY_TEXTS = [
+    "Hello world, how are you?",
+    "I don't think it's working.",
+    "She said \"hello\" and left...",
+    "The price is $1,000.50 today -- really!",
+    "Mr Smith can't go; he's gonna stay.",
+    "e-mail me at foo@bar.com",
+    "We'll see, won't we?",
+    "Numbers: 3.14, 2,718 and 42",
+    "(Parentheses) [brackets] {braces}",
+    "It was 'quoted' here",
+    "Tabs\tand  spaces",
+    "I'm sure you'd agree they've left",
+    "Cannot wait, gimme a sec!",
+    "well-known state-of-the-art models",
+    "I love NLP!!!",
+    "wait.. what.... no",
+    "*grins* that's ``quoted``",
+    "a well-known ques- and -d reply",
+    "dashes \u2013 and \u201cunicode\u201d quotes",
+]
+
+SPAM_HAM_DIRECTORY = os.path.join(os.path.dirname(__file__), os.pardir, 'example', 'spam_ham')
+
+
+def _has_punkt():
+    try:
+        NltkTokenizer().tokenize('Punkt. Data')
+        return True
+    except LookupError:
+        return False
+
+
+def _spam_ham_lines():
+    lines = []
+    for filename in sorted(os.listdir(SPAM_HAM_DIRECTORY)):
+        if filename.endswith('.dat'):
+            with io.open(os.path.join(SPAM_HAM_DIRECTORY, filename), 'r', encoding='utf-8') as f:
+                lines.extend(line.rstrip('\n') for line in f)
+    return lines
+
+
+requires_punkt = pytest.mark.skipif(not _has_punkt(), reason="the NLTK punkt data is not installed")
+
+
+@requires_punkt
+@pytest.mark.parametrize('text', PARITY_TEXTS)
+def test_regex_matches_nltk(text):
+    assert RegexTokenizer().tokenize(text) == NltkTokenizer().tokenize(text)
+
+
+@requires_punkt
+def test_compare_tokenizers_reports_full_agreement():
+    report = compare_tokenizers(PARITY_TEXTS)
+    assert report['documents'] == len(PARITY_TEXTS)
+    assert report['identical_documents'] == 1.0
+    assert report['token_agreement'] == 1.0
+    assert report['missing_tokens'] == [] and report['extra_tokens'] == []
+
+
+@requires_punkt
+def test_regex_matches_nltk_on_spam_ham():
+    report = compare_tokenizers(_spam_ham_lines())
+    # The remaining differences are periods only Punkt can tell apart from a
+    # sentence boundary, e.g. the initial in "fr u. Thanx"
+    assert report['identical_documents'] >= 0.97
+    assert report['token_agreement'] >= 0.995
+
+
+@pytest.mark.parametrize('limit', [0, 1, 3, 100])
+def test_regex_truncates_at_limit(limit):
+    tokenizer = RegexTokenizer()
+    for text in PARITY_TEXTS:
+        assert tokenizer.tokenize(text, limit=limit) == tokenizer.tokenize(text)[:limit]
+
+
+@requires_punkt
+@pytest.mark.parametrize('limit', [0, 1, 3, 100])
+def test_nltk_truncates_at_limit(limit):
+    tokenizer = NltkTokenizer()
+    for text in PARITY_TEXTS:
+        assert tokenizer.tokenize(text, limit=limit) == tokenizer.tokenize(text)[:limit]
+
+
+def test_get_tokenizer():
+    assert get_tokenizer('regex').name == 'regex'
+    assert get_tokenizer('nltk').name == 'nltk'
+    assert get_tokenizer('regex') is get_tokenizer('regex')
+    with pytest.raises(ValueError):
+        get_tokenizer('whitespace')
+
+
+def _write_cluster(tmpdir, cluster_config):
+    """ A model cluster with empty model files, only the labels and the .chc are read """
+    model_directory = os.path.join(str(tmpdir), 'model_build')
+    os.mkdir(model_directory)
+    for extension in ('che', 'chs', 'chm'):
+        open(os.path.join(model_directory, 'model.' + extension), 'w').close()
+    with open(os.path.join(model_directory, 'model.chl'), 'w') as f:
+        json.dump(['ham', 'spam'], f)
+    if cluster_config is not None:
+        with open(os.path.join(model_directory, 'model.chc'), 'w') as f:
+            json.dump(cluster_config, f)
+    return model_directory
+
+
+@pytest.mark.parametrize('cluster_config, expected', [
+    (None, 'nltk'),
+    ({}, 'nltk'),
+    ({'tokenizer': 'nltk'}, 'nltk'),
+    ({'tokenizer': 'regex'}, 'regex'),
+])
+def test_cluster_config_tokenizer(tmpdir, monkeypatch, cluster_config, expected):
+    for method in ('load_model', 'load_word2vec_model', 'load_scaler'):
+        monkeypatch.setattr(DLTC, method, lambda self, filepath: None)
+
+    dltc = DLTC(tokenizer='regex' if expected == 'nltk' else 'nltk')
+    try:
+        dltc.load_model_cluster(_write_cluster(tmpdir, cluster_config), warmup=False)
+        assert dltc.tokenizer == expected
+    finally:
+        dltc.close()